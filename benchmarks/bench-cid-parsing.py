@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+#  Compare CollectID.batch_to_dataframe() against building one CollectID per row.
+#
+
+import argparse, random, sys, time
+
+import pandas as pd
+
+#  DUG API
+sys.path.insert(0,'.')
+from dug_api.CollectID import CollectID
+
+def parse_command_line():
+
+    parser = argparse.ArgumentParser(description='Benchmark bulk Collection ID parsing.')
+
+    parser.add_argument( '-n',
+                         dest='num_ids',
+                         default=100000,
+                         type=int,
+                         help='Number of synthetic IDs to parse.' )
+
+    parser.add_argument( '--files',
+                         dest='is_file',
+                         default=False,
+                         action='store_true',
+                         help='Generate file paths instead of collection folders.' )
+
+    return parser.parse_args()
+
+def create_synthetic_ids( num_ids, is_file, seed = 0 ):
+
+    rng = random.Random( seed )
+
+    output = []
+    for x in range( 0, num_ids ):
+        sensor, satellite = rng.choice( [ ('C','08'), ('C','09'), ('E','07') ] )
+        level = rng.choice( [ 'L1TP', 'L1GT', 'L2SP', 'CU' ] )
+        acq   = f'{rng.randint(2013,2023)}{rng.randint(1,12):02d}{rng.randint(1,28):02d}'
+        cid   = f'L{sensor}{satellite}_{level}_{rng.randint(1,40):03d}{rng.randint(1,40):03d}_{acq}_20240101_02'
+        pathname = f'/data/imagery/Landsat/collections/{cid}'
+
+        if is_file:
+            band = rng.randint(1,11)
+            if level == 'CU':
+                pathname = f'{pathname}/{cid}_ST_B6.TIF'
+            elif level == 'L2SP':
+                pathname = f'{pathname}/{cid}_T1_SR_B{band}.TIF'
+            else:
+                pathname = f'{pathname}/{cid}_T1_B{band}.TIF'
+        output.append( pathname )
+
+    return output
+
+def parse_per_object( names, is_file ):
+
+    data = { 'pathname': [], 'cid': [], 'sensor': [], 'satellite': [],
+             'processing_level': [], 'wrs2_path': [], 'wrs2_row': [],
+             'ard_col': [], 'ard_row': [], 'acquisition_date': [],
+             'production_date': [], 'collection_number': [], 'file_type': [] }
+
+    for name in names:
+        c = CollectID( name, is_file = is_file )
+        data['pathname'].append( c.pathname() )
+        data['cid'].append( c.cid() )
+        data['sensor'].append( c.sensor().name )
+        data['satellite'].append( c.satellite() )
+        data['processing_level'].append( c.processing_level().name )
+        data['wrs2_path'].append( c.wrs2_path() )
+        data['wrs2_row'].append( c.wrs2_row() )
+        data['ard_col'].append( c.ard_col() )
+        data['ard_row'].append( c.ard_row() )
+        data['acquisition_date'].append( c.acquisition_date() )
+        data['production_date'].append( c.production_date() )
+        data['collection_number'].append( c.collection_number() )
+        data['file_type'].append( None if c.file_type() is None else c.file_type().name )
+
+    return pd.DataFrame( data )
+
+def main():
+
+    cmd_options = parse_command_line()
+
+    names = create_synthetic_ids( cmd_options.num_ids, cmd_options.is_file )
+
+    start = time.perf_counter()
+    obj_df = parse_per_object( names, cmd_options.is_file )
+    obj_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_df = CollectID.batch_to_dataframe( names, is_file = cmd_options.is_file )
+    batch_time = time.perf_counter() - start
+
+    #  Sanity check that both paths agree
+    assert( (obj_df['cid'].values == batch_df['cid'].values).all() )
+    assert( (obj_df['processing_level'].values == batch_df['processing_level'].astype(str).values).all() )
+
+    print( f'IDs:         {len(names)}' )
+    print( f'Per-object:  {obj_time:8.3f} s' )
+    print( f'Batch:       {batch_time:8.3f} s' )
+    print( f'Speedup:     {obj_time / batch_time:8.2f}x' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+#  Compare the keyed merge in Configuration.update_table() against the original
+#  row-by-row merge.
+#
+
+import argparse, configparser, sys, time
+
+import numpy as np
+import pandas as pd
+
+#  DUG API
+sys.path.insert(0,'.')
+from dug_api.CollectID import FileType
+from dug_api.config import Configuration
+
+def parse_command_line():
+
+    parser = argparse.ArgumentParser(description='Benchmark collection table updates.')
+
+    parser.add_argument( '--rows',
+                         dest='num_rows',
+                         default=50000,
+                         type=int,
+                         help='Rows in the existing table.' )
+
+    parser.add_argument( '--update',
+                         dest='num_update',
+                         default=5000,
+                         type=int,
+                         help='Rows in the update (half new, half existing).' )
+
+    parser.add_argument( '--no-legacy',
+                         dest='legacy',
+                         default=True,
+                         action='store_false',
+                         help='Skip the (slow) row-by-row merge.' )
+
+    return parser.parse_args()
+
+def create_table( cids, rng, fill_ratio ):
+
+    data = { 'pathname': [ f'/data/{x}' for x in cids ],
+             'cid':      cids }
+    for key in FileType.create_empty_dict():
+        paths = np.array( [ f'/data/{x}/{key}.TIF' for x in cids ], dtype = object )
+        paths[rng.random( len(cids) ) > fill_ratio] = None
+        data[key] = paths
+    return pd.DataFrame( data )
+
+def legacy_process_rows( table, new_entries ):
+    '''
+    Original Configuration._process_rows(), kept for comparison.
+    '''
+
+    for rdata in new_entries.itertuples(index=False):
+
+        row = rdata._asdict()
+        c = table.loc[table['cid'] == row['cid']]
+
+        if c.shape[0] == 0:
+            new_data = {}
+            for temp_col in row:
+                new_data[temp_col] = [row[temp_col]]
+            table = pd.concat( [ table, pd.DataFrame( new_data ) ], ignore_index=True)
+
+        else:
+            for c in row:
+                if '_path' in c:
+                    src_val = row[c]
+                    dst_val = table.loc[table['cid'] == row['cid'],c]
+                    if (dst_val.values[0] is None or dst_val.isna().any() ) and src_val != None:
+                        table.loc[table['cid'] == row['cid'],c] = src_val
+    return table
+
+def main():
+
+    cmd_options = parse_command_line()
+    rng = np.random.default_rng( 0 )
+
+    cids = [ f'LC08_L1TP_{x:06d}_20230101_20230102_02' for x in range( 0, cmd_options.num_rows + cmd_options.num_update ) ]
+    table = create_table( cids[:cmd_options.num_rows], rng, 0.5 )
+
+    num_existing = cmd_options.num_update // 2
+    update_cids = list( rng.choice( cids[:cmd_options.num_rows], num_existing, replace = False ) )
+    update_cids += cids[cmd_options.num_rows:cmd_options.num_rows + cmd_options.num_update - num_existing]
+    update = create_table( update_cids, rng, 0.7 )
+
+    #  Configuration without a config file, the table is set directly
+    config = Configuration.__new__( Configuration )
+    config.config = configparser.ConfigParser()
+    config.scene_index = None
+    config.ls_collection_df = table.copy()
+
+    start = time.perf_counter()
+    conflicts = config._process_rows( update )
+    merge_time = time.perf_counter() - start
+
+    print( f'Table: {table.shape[0]} rows, Update: {update.shape[0]} rows' )
+    print( f'Keyed merge:  {merge_time:8.3f} s  ({conflicts.shape[0]} conflicts reported)' )
+
+    if cmd_options.legacy:
+        start = time.perf_counter()
+        expected = legacy_process_rows( table.copy(), update )
+        legacy_time = time.perf_counter() - start
+
+        result = config.ls_collection_df.set_index( 'cid' ).sort_index()
+        expected = expected.set_index( 'cid' ).sort_index()
+        assert( ( result.fillna( '' ).astype( str ) == expected.fillna( '' ).astype( str ) ).all().all() )
+
+        print( f'Row-by-row:   {legacy_time:8.3f} s' )
+        print( f'Speedup:      {legacy_time / merge_time:8.2f}x' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+#  Time warping.warp_array() across worker counts on a synthetic raster, and check
+#  that every run is bit-identical to a plain rasterio.warp.reproject() of the same
+#  grid.  Each memory limit changes how GDAL chunks the grid, and each worker count
+#  how the rows of a chunk are shared out.
+#
+
+import argparse, sys, time
+
+import numpy as np
+
+import rasterio
+from rasterio import crs, warp
+
+#  DUG API
+sys.path.insert(0,'.')
+from dug_api import warping
+
+def parse_command_line():
+
+    parser = argparse.ArgumentParser(description='Benchmark warp_array() on GDAL warper threads against a plain reproject().')
+
+    parser.add_argument( '-s', '--size',
+                         dest='size',
+                         default=8192,
+                         type=int,
+                         help='Width and height of the synthetic source raster.' )
+
+    parser.add_argument( '-w', '--workers',
+                         dest='workers',
+                         default='1,2,4,8',
+                         help='Comma-separated worker counts.' )
+
+    parser.add_argument( '-m', '--mem-limits',
+                         dest='mem_limits',
+                         default='0,16,64',
+                         help='Comma-separated GDAL warp memory limits, in MB (0 is the GDAL default).' )
+
+    return parser.parse_args()
+
+def create_synthetic_raster( size, seed = 0 ):
+
+    rng = np.random.default_rng( seed )
+
+    #  Smooth field plus noise, so the resampling kernel has something to do
+    y, x = np.mgrid[0:size, 0:size].astype( np.float32 ) / size
+    img  = 300.0 + 20.0 * np.sin( 12.0 * x ) * np.cos( 9.0 * y )
+    img += rng.normal( 0.0, 1.0, size = ( size, size ) ).astype( np.float32 )
+    return img.astype( np.float32 )
+
+def main():
+
+    cmd_options = parse_command_line()
+
+    size = cmd_options.size
+    src_img = create_synthetic_raster( size )
+
+    #  30 m scene in UTM 12N, warped into UTM 13N at the same resolution
+    src_crs       = crs.CRS.from_epsg( 32612 )
+    src_transform = rasterio.Affine( 30.0, 0, 600000.0, 0, -30.0, 4500000.0 )
+    dst_crs       = crs.CRS.from_epsg( 32613 )
+
+    dst_transform, dst_width, dst_height = warp.calculate_default_transform( src_crs,
+                                                                             dst_crs,
+                                                                             size,
+                                                                             size,
+                                                                             *rasterio.transform.array_bounds( size, size, src_transform ),
+                                                                             resolution = 30.0 )
+
+    print( f'Source:      {size}x{size} float32, EPSG:32612' )
+    print( f'Destination: {dst_width}x{dst_height}, EPSG:32613' )
+
+    warp_args = { 'src_transform': src_transform,
+                  'src_crs':       src_crs,
+                  'src_nodata':    np.nan,
+                  'dst_transform': dst_transform,
+                  'dst_crs':       dst_crs,
+                  'dst_nodata':    np.nan,
+                  'resampling':    rasterio.enums.Resampling.bilinear }
+
+    for warp_mem_limit in [ int(x) for x in cmd_options.mem_limits.split(',') ]:
+
+        #  The serial reference
+        start = time.perf_counter()
+        reference = np.full( ( dst_height, dst_width ), np.nan, dtype = np.float32 )
+        warp.reproject( src_img, reference, warp_mem_limit = warp_mem_limit, **warp_args )
+        base_time = time.perf_counter() - start
+        print( f'Memory limit: {warp_mem_limit:4d} MB  Reference: {base_time:8.3f} s' )
+
+        for num_workers in [ int(x) for x in cmd_options.workers.split(',') ]:
+
+            start = time.perf_counter()
+            dst_img = warping.warp_array( src_img,
+                                          dst_width      = dst_width,
+                                          dst_height     = dst_height,
+                                          num_workers    = num_workers,
+                                          warp_mem_limit = warp_mem_limit,
+                                          **warp_args )
+            elapsed = time.perf_counter() - start
+
+            #  Compare the raw bytes, so NaN == NaN
+            identical = reference.tobytes() == dst_img.tobytes()
+            print( f'    Workers: {num_workers:2d}  {elapsed:8.3f} s  Speedup: {base_time / elapsed:5.2f}x  Identical: {identical}' )
+            assert( identical )
+
+if __name__ == '__main__':
+    main()
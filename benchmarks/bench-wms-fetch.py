@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+#  Compare serial wms.load_tile() calls against a WMSFetcher batch, using a local
+#  stand-in WMS which adds latency, fails every Nth request, can answer every Mth
+#  request with a 4-band PNG and reports its timings.
+#
+
+import argparse, http.server, io, sys, threading, time, urllib.parse, warnings
+
+import numpy as np
+from PIL import Image
+
+#  DUG API
+sys.path.insert(0,'.')
+from dug_api import wms
+from dug_api.WMSFetcher import WMSFetcher
+
+#  The stand-in serves PNGs, which have no georeferencing
+warnings.filterwarnings( 'ignore', message = 'Dataset has no geotransform' )
+
+def parse_command_line():
+
+    parser = argparse.ArgumentParser(description='Benchmark batch WMS fetching.')
+
+    parser.add_argument( '-n', '--tiles',
+                         dest='num_tiles',
+                         default=200,
+                         type=int,
+                         help='Number of tiles (gardens).' )
+
+    parser.add_argument( '--size',
+                         dest='size',
+                         default=256,
+                         type=int,
+                         help='Tile width and height, in pixels.' )
+
+    parser.add_argument( '--latency',
+                         dest='latency',
+                         default=0.05,
+                         type=float,
+                         help='Seconds the stand-in WMS takes per request.' )
+
+    parser.add_argument( '--fail-every',
+                         dest='fail_every',
+                         default=0,
+                         type=int,
+                         help='Answer every Nth request with HTTP 503.' )
+
+    parser.add_argument( '--rgba-every',
+                         dest='rgba_every',
+                         default=0,
+                         type=int,
+                         help='Answer every Mth batch request with an RGBA instead of an RGB PNG.' )
+
+    parser.add_argument( '-w', '--workers',
+                         dest='workers',
+                         default=8,
+                         type=int,
+                         help='Fetcher threads.' )
+
+    parser.add_argument( '--per-host',
+                         dest='per_host',
+                         default=4,
+                         type=int,
+                         help='Requests in flight per host.' )
+
+    parser.add_argument( '--rate',
+                         dest='rate',
+                         default=None,
+                         type=float,
+                         help='Requests per second per host.' )
+
+    return parser.parse_args()
+
+class MockWMS( http.server.BaseHTTPRequestHandler ):
+
+    protocol_version = 'HTTP/1.1'
+    latency     = 0.0
+    fail_every  = 0
+    rgba_every  = 0
+    lock        = threading.Lock()
+    num_request = 0
+    clients     = set()
+    timings     = []
+
+    def do_GET( self ):
+
+        start = time.perf_counter()
+        with MockWMS.lock:
+            MockWMS.num_request += 1
+            count = MockWMS.num_request
+            MockWMS.clients.add( self.client_address )
+
+        time.sleep( MockWMS.latency )
+        if MockWMS.fail_every > 0 and count % MockWMS.fail_every == 0:
+            self.send_response( 503 )
+            self.send_header( 'Content-Length', '0' )
+            self.end_headers()
+        else:
+            query = dict( urllib.parse.parse_qsl( urllib.parse.urlsplit( self.path ).query ) )
+            width  = int( float( query['width'] ) )
+            height = int( float( query['height'] ) )
+            bands  = 4 if MockWMS.rgba_every > 0 and count % MockWMS.rgba_every == 0 else 3
+            img = np.full( ( height, width, bands ), count % 256, dtype = np.uint8 )
+
+            buffer = io.BytesIO()
+            Image.fromarray( img ).save( buffer, 'PNG' )
+            body = buffer.getvalue()
+
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', 'image/png' )
+            self.send_header( 'Content-Length', str(len(body)) )
+            self.end_headers()
+            self.wfile.write( body )
+
+        with MockWMS.lock:
+            MockWMS.timings.append( time.perf_counter() - start )
+
+    def log_message( self, *args ):
+        pass
+
+    @staticmethod
+    def reset():
+        with MockWMS.lock:
+            MockWMS.num_request = 0
+            MockWMS.clients     = set()
+            MockWMS.timings     = []
+
+    @staticmethod
+    def report( label, elapsed ):
+        timings = np.array( MockWMS.timings )
+        print( f'{label:8s} {elapsed:8.3f} s  Requests: {MockWMS.num_request:4d}  Connections: {len(MockWMS.clients):4d}  '
+               f'Server p50/p95: {np.percentile( timings, 50 ) * 1000:6.1f}/{np.percentile( timings, 95 ) * 1000:6.1f} ms' )
+
+def main():
+
+    cmd_options = parse_command_line()
+
+    server = http.server.ThreadingHTTPServer( ( '127.0.0.1', 0 ), MockWMS )
+    threading.Thread( target = server.serve_forever, daemon = True ).start()
+    url = f'http://127.0.0.1:{server.server_port}/wms?service=WMS'
+
+    MockWMS.latency = cmd_options.latency
+    centers = [ [ -105.05 + 0.001 * x, 39.74 ] for x in range( 0, cmd_options.num_tiles ) ]
+    size    = [ cmd_options.size, cmd_options.size ]
+
+    #  Serial, one connection per tile (no failures, the serial path doesn't retry)
+    start = time.perf_counter()
+    for center_ll in centers:
+        wms.load_tile( url, 32613, center_ll, size, 1.0, [ '0' ], 'image/png' )
+    MockWMS.report( 'Serial', time.perf_counter() - start )
+
+    MockWMS.reset()
+    MockWMS.fail_every = cmd_options.fail_every
+    MockWMS.rgba_every = cmd_options.rgba_every
+    wms_maps = [ wms.WMS( url          = url,
+                          epsg_code    = 32613,
+                          center_ll    = center_ll,
+                          win_size_pix = size,
+                          gsd          = 1.0,
+                          layers       = [ '0' ],
+                          format       = 'image/png' ) for center_ll in centers ]
+
+    with WMSFetcher( max_workers  = cmd_options.workers,
+                     max_per_host = cmd_options.per_host,
+                     rate         = cmd_options.rate,
+                     backoff      = 0.05 ) as fetcher:
+        start = time.perf_counter()
+        tiles = fetcher.fetch( wms_maps )
+        MockWMS.report( 'Batch', time.perf_counter() - start )
+
+        retried = sum( 1 for x in fetcher.timings if x.attempts > 1 )
+        rgba    = sum( 1 for x in tiles if x.shape[0] == 4 )
+        print( f'Tiles: {len(tiles)}  Retried: {retried}  RGBA: {rgba}' )
+        assert( all( x is not None and x.shape[1:] == ( size[1], size[0] ) for x in tiles ) )
+        assert( ( rgba > 0 ) == ( cmd_options.rgba_every > 0 ) )
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
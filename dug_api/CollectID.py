@@ -1,6 +1,9 @@
 
-import datetime, enum, os, re
+import concurrent.futures, datetime, enum, logging, os, re, time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 class Sensor(enum.Enum):
     C = 'C' # OLI/TIRS Combined
@@ -64,6 +67,13 @@ class ProductType(enum.Enum):
         raise Exception( f'Unsupported type: {value}' )
 
 
+#  Lookup which, unlike ProductType.from_str(), does not throw for unknown levels
+PRODUCT_LEVELS = { 'L1GT': ProductType.L1GT,
+                   'L1TP': ProductType.L1TP,
+                   'L2SP': ProductType.L2SP,
+                   'CU':   ProductType.ARD_CU }
+
+
 class FileType(enum.Enum):
 
     ANG      = enum.auto()
@@ -130,205 +140,356 @@ class FileType(enum.Enum):
                 
         return True
         
+#  Landsat Collection ID.  Compiled once and used for a single pass over each name.
+#  Example: LC09_L1TP_034032_20230516_20230517_02
+CID_PATTERN = re.compile( 'L(?P<sensor>[COTE])(?P<satellite>[0-9]{2})_'
+                          '(?P<level>[a-zA-Z0-9]{2,4})_'
+                          '(?P<tile_a>[0-9]{3})(?P<tile_b>[0-9]{3})_'
+                          '(?P<acquisition>[0-9]{8})_'
+                          '(?P<production>[0-9]{8})_'
+                          '(?P<collection>[0-9]{2})' )
+
+def _parse_date( value ):
+    return datetime.date( year  = int(value[0:4]),
+                          month = int(value[4:6]),
+                          day   = int(value[6:8]) )
+
 class CollectID:
+    '''
+    Immutable, hashable Landsat Collection ID.
+
+    All fields are decoded once in the constructor, so the accessors are simple lookups.
+    '''
+
+    __slots__ = ( 'm_pathname',
+                  'm_is_file',
+                  'm_cid',
+                  'm_sensor',
+                  'm_satellite',
+                  'm_processing_level',
+                  'm_tile',
+                  'm_acquisition_date',
+                  'm_production_date',
+                  'm_collection_number',
+                  'm_file_type' )
 
     def __init__( self, pathname, is_file = False ):
 
-        self.m_pathname = pathname
-        self.m_is_file  = is_file
+        bname = os.path.basename( pathname )
+        res = CID_PATTERN.match( bname )
+        if res is None:
+            raise Exception( f'Not a valid Collection ID: {pathname}' )
+
+        level = ProductType.from_str( res['level'] )
+
+        setter = object.__setattr__
+        setter( self, 'm_pathname',          pathname )
+        setter( self, 'm_is_file',           is_file )
+        setter( self, 'm_cid',               res[0] )
+        setter( self, 'm_sensor',            Sensor.from_str( res['sensor'] ) )
+        setter( self, 'm_satellite',         int(res['satellite']) )
+        setter( self, 'm_processing_level',  level )
+        setter( self, 'm_tile',              ( int(res['tile_a']), int(res['tile_b']) ) )
+        setter( self, 'm_acquisition_date',  _parse_date( res['acquisition'] ) )
+        setter( self, 'm_production_date',   _parse_date( res['production'] ) )
+        setter( self, 'm_collection_number', int(res['collection']) )
+        setter( self, 'm_file_type',         None )
+
+        if is_file:
+            stem = os.path.splitext( bname )[0]
+            setter( self, 'm_file_type', CollectID._decode_file_type( stem[res.end()+1:],
+                                                                      level,
+                                                                      self.m_satellite ) )
+
+    @staticmethod
+    def _decode_file_type( suffix, level, satellite ):
+        '''
+        Convert the portion of the filename after the CID into a FileType.  Returns None
+        if the file is not one we track.
+        '''
+
+        #  For ARD, we don't have a "tier"
+        if not level.is_ard():
+            suffix = suffix.partition('_')[2]
+
+            #  Landsat 7 likes to add B6_VCID_1 or things like that.
+            if satellite == 7:
+                if suffix == 'B6_VCID_1':
+                    suffix = 'B6'
+                elif suffix == 'B6_VCID_2':
+                    suffix = 'B10'
+
+            #  Some sensor types (L2SP for example), add SR_B5 or a product
+            #  designation with it.
+            if level == ProductType.L2SP:
+                suffix = suffix.partition('_')[2]
+
+        return FileType.__members__.get( suffix )
+
+    def __setattr__( self, name, value ):
+        raise AttributeError( 'CollectID is immutable' )
+
+    def __delattr__( self, name ):
+        raise AttributeError( 'CollectID is immutable' )
+
+    def __eq__( self, other ):
+        if not isinstance( other, CollectID ):
+            return NotImplemented
+        return self.m_pathname == other.m_pathname and self.m_is_file == other.m_is_file
+
+    def __hash__( self ):
+        return hash( ( self.m_pathname, self.m_is_file ) )
+
+    def __repr__( self ):
+        return f'CollectID({self.m_pathname!r}, is_file={self.m_is_file})'
 
     def pathname(self):
         return self.m_pathname
 
     def cid(self):
         '''
-        Return the Collection ID. 
-
-        This method is really weird and super customized based on product-type.
+        Return the Collection ID (everything up to, and including, the collection number).
         '''
-        if self.m_is_file:
-            bname = os.path.basename(self.pathname())
-
-            #  Locate the processing-level, without calling processing_level() function
-            proc_level = self.pathname().split('_')[1]
-            
-            #  Ignore the collection number
-            proc_levels = [ 'L1TP', 'L1GT', 'CU' ]
-            if proc_level in proc_levels:
-                regex = 'L[COTE][0-9]{2}_[a-zA-Z0-9]{2,4}_[0-9]{6}_[0-9]{8}_[0-9]{8}_[0-9]{2}'
-                res = re.match( regex, os.path.basename( self.pathname() ) )
-                return res[0]
-
-        else:
-            # Stop at the 6th underscore
-            regex = 'L[COTE][0-9]{2}_[a-zA-Z0-9]{2,4}_[0-9]{6}_[0-9]{8}_[0-9]{8}_[0-9]{2}'
-            res = re.match( regex, os.path.basename( self.pathname() ) )
-            return res[0]
+        return self.m_cid
 
     def sensor(self):
-        return Sensor.from_str( self.cid()[1] )
+        return self.m_sensor
 
     def satellite(self):
-        return int(self.cid()[2:4])
+        return self.m_satellite
 
     def processing_level(self):
-
-        substr = self.cid()[5:]
-        idx = substr.find('_')
-        return ProductType.from_str(substr[0:idx])
-        
+        return self.m_processing_level
 
     def wrs2_path(self):
 
-        if self.processing_level().is_ard():
+        if self.m_processing_level.is_ard():
             return None
-
-        tpstr = self.processing_level().name[0:2]
-        if tpstr == 'L1' or tpstr == 'L2':
-
-            pl_us = self.cid()[5:].find('_')
-            wrs_substr = self.cid()[5:][pl_us+1:pl_us+7]
-            return int(wrs_substr[0:3])
+        return self.m_tile[0]
 
     def wrs2_row(self):
 
-        if self.processing_level().is_ard():
+        if self.m_processing_level.is_ard():
             return None
+        return self.m_tile[1]
 
-        tpstr = self.processing_level().name[0:2]
-        if tpstr == 'L1' or tpstr == 'L2':
-
-            pl_us = self.cid()[5:].find('_')
-            wrs_substr = self.cid()[5:][pl_us+1:pl_us+7]
-            return int(wrs_substr[3:6])
-        
     def ard_col(self):
 
-        if not self.processing_level().is_ard():
+        if not self.m_processing_level.is_ard():
             return None
-
-        tpstr = self.processing_level()
-        if tpstr == ProductType.ARD_CU:
-
-            pl_us = self.cid()[5:].find('_')
-            ard_substr = self.cid()[5:][pl_us+1:pl_us+7]
-            return int(ard_substr[0:3])
+        return self.m_tile[0]
 
     def ard_row(self):
 
-        if not self.processing_level().is_ard():
+        if not self.m_processing_level.is_ard():
             return None
-
-        tpstr = self.processing_level()
-        if tpstr == ProductType.ARD_CU:
-
-            pl_us = self.cid()[5:].find('_')
-            ard_substr = self.cid()[5:][pl_us+1:pl_us+7]
-            return int(ard_substr[3:6])
+        return self.m_tile[1]
 
     def acquisition_date( self ):
+        return self.m_acquisition_date
 
-        #  We need the substring after the third underscore
-        sub = self.cid()
-        for x in range( 0, 3 ):
-            us_idx = sub.find('_')
-            sub = sub[us_idx+1:]
-
-        return datetime.date( year=int(sub[0:4]),
-                              month = int(sub[4:6]),
-                              day = int(sub[6:8]) )
     def production_date( self ):
-
-        #  We need the substring after the fourth underscore
-        sub = self.cid()
-        for x in range( 0, 4 ):
-            us_idx = sub.find('_')
-            sub = sub[us_idx+1:]
-
-        return datetime.date( year=int(sub[0:4]),
-                              month = int(sub[4:6]),
-                              day = int(sub[6:8]) )
+        return self.m_production_date
 
     def collection_number(self):
-        
-        #  We need the substring after the fifth underscore
-        sub = self.cid()
-        for x in range( 0, 5 ):
-            us_idx = sub.find('_')
-            sub = sub[us_idx+1:]
-        return int(sub[0:2])
+        return self.m_collection_number
 
     def file_type(self):
-        if self.m_is_file:
-            
-            #  We need the substring after the seventh underscore
-            sub = os.path.splitext( os.path.basename(self.pathname()))[0]
-
-            #  For ARD, we don't have a "tier"
-            if self.processing_level().is_ard():
-
-                for x in range( 0, 6 ):
-                    us_idx = sub.find('_')
-                    sub = sub[us_idx+1:]
-
-                return FileType.from_str(sub)
-
-            else:
-                for x in range( 0, 7 ):
-                    us_idx = sub.find('_')
-                    sub = sub[us_idx+1:]
-
-                #  Landsat 7 likes to add B6_VCID_1 or things like that.
-                if self.satellite() == 7:
-                    if sub == 'B6_VCID_1':
-                        sub = 'B6'
-                    elif sub == 'B6_VCID_2':
-                        sub = 'B10'
-                
-                #  Some sensor types (L2SP for example), add SR_B5 or a product
-                #  designation with it.
-                if self.processing_level() == ProductType.L2SP:
-                    us_idx = sub.find('_')
-                    sub = sub[us_idx+1:]
-
-                return FileType.from_str(sub)
-        
-        return None
+        '''
+        FileType of the file, None for folders or for files we don't track.
+        '''
+        return self.m_file_type
 
     def to_cid_folder(self):
 
-        #  Remove the file type
-        if self.file_type() is not None:
-            raise Exception('Not ready to figure this out yet.')
         if self.m_is_file:
             raise Exception('Not ready to deal with files yet.')
 
-        # Stop at the 6th underscore
-        regex = 'L[COTE][0-9]{2}_[a-zA-Z0-9]{2,4}_[0-9]{6}_[0-9]{8}_[0-9]{8}_[0-9]{2}'
-        res = re.match( regex, os.path.basename( self.pathname() ) )
-        return res[0]
-            
+        return self.m_cid
+
     @staticmethod
     def from_pathname( pathname ):
 
         #  Convert to directory name
         cid = os.path.basename( pathname )
 
-        #  Check against regex list
-        regex = 'L[COTE][0-9]{2}_[a-zA-Z0-9]{2,4}_[0-9]{6}_[0-9]{8}_[0-9]{8}_[0-9]{2}'
-        res = re.match( regex, cid )
-        if res is None:
-            return None
-        
-        sp = res.span()
-        if sp[0] != 0 or (sp[1]-sp[0]) != len( cid ):
+        #  Must be the entire folder name
+        if CID_PATTERN.fullmatch( cid ) is None:
             return None
 
         #  Otherwise, valid CID
         return CollectID( pathname )
 
     @staticmethod
-    def list_to_dataframes( cid_list ):
+    def batch_to_dataframe( names, is_file = False ):
+        '''
+        Decode an array or Series of Collection IDs (or paths to them) in one vectorized
+        pass.  Returns the same descriptive columns as list_to_dataframes() using categorical,
+        nullable integer and datetime64 dtypes.  Fields of entries which are not valid CIDs
+        are left null.
+
+        The basenames are matched against CID_PATTERN with str.extract(), so the batch
+        and the constructor share one pattern.  On Arrow strings, pandas runs the match
+        in pyarrow's regex engine rather than one Python call per name.  File types are
+        decoded with _decode_file_type(), once per distinct suffix.
+        '''
+
+        names = pd.Series( names ).reset_index( drop = True )
+        text  = names.fillna( '' ).astype( str ).astype( pd.ArrowDtype( pa.string() ) )
+
+        #  Basename, then the constructor's CID_PATTERN.match() anchored at its start
+        seps  = re.escape( os.sep + ( os.altsep or '' ) )
+        base  = text.str.replace( f'^.*[{seps}]', '', regex = True )
+        parts = base.str.extract( f'^(?P<cid>{CID_PATTERN.pattern})(?P<rest>.*)$' )
+
+        def to_codes( col, values ):
+            codes = pc.index_in( pa.array( parts[col].array ), value_set = pa.array( values ) )
+            return pc.fill_null( codes, -1 ).to_numpy().astype( np.int64 )
+
+        def to_int( col ):
+            #  The pattern only lets digits into these groups
+            return pc.fill_null( pc.cast( pa.array( parts[col].array ), pa.int64() ), 0 ).to_numpy()
+
+        #  Like the constructor, levels ProductType doesn't know are not valid CIDs
+        levels      = list( ProductType )
+        level_keys  = list( PRODUCT_LEVELS )
+        level_index = np.array( [ levels.index( PRODUCT_LEVELS[x] ) for x in level_keys ] + [ -1 ] )
+        level_codes = level_index[to_codes( 'level', level_keys )]
+        invalid     = level_codes < 0
+        is_ard      = level_codes == levels.index( ProductType.ARD_CU )
+
+        sensor_codes = to_codes( 'sensor', [ x.value for x in Sensor ] )
+        sensor_codes[invalid] = -1
+
+        def to_nullable( values, dtype, mask ):
+            return pd.arrays.IntegerArray( np.where( mask, 0, values ).astype( dtype ), mask )
+
+        def to_date( col ):
+            #  Impossible dates, such as a 13th month or February 30th, are left null
+            dates = pd.to_datetime( parts[col], format = '%Y%m%d', errors = 'coerce' ).astype( 'datetime64[s]' )
+            dates[invalid] = pd.NaT
+            return dates
+
+        satellite = to_int( 'satellite' )
+        tile_a    = to_int( 'tile_a' )
+        tile_b    = to_int( 'tile_b' )
+
+        cids = parts['cid'].astype( 'string' )
+        cids[invalid] = pd.NA
+
+        output = pd.DataFrame( { 'pathname': names,
+                                 'cid':      cids } )
+        output['sensor'] = pd.Categorical.from_codes( sensor_codes, [ x.name for x in Sensor ] )
+        output['satellite'] = to_nullable( satellite, np.int8, invalid )
+        output['product_type'] = pd.Categorical.from_codes( level_codes, [ x.type() for x in ProductType ] )
+        output['processing_level'] = pd.Categorical.from_codes( level_codes, [ x.name for x in ProductType ] )
+        output['wrs2_path'] = to_nullable( tile_a, np.int16, invalid | is_ard )
+        output['wrs2_row']  = to_nullable( tile_b, np.int16, invalid | is_ard )
+        output['ard_col']   = to_nullable( tile_a, np.int16, invalid | ~is_ard )
+        output['ard_row']   = to_nullable( tile_b, np.int16, invalid | ~is_ard )
+        output['acquisition_date']  = to_date( 'acquisition' )
+        output['production_date']   = to_date( 'production' )
+        output['collection_number'] = to_nullable( to_int( 'collection' ), np.int8, invalid )
+
+        if is_file:
+
+            #  As in the constructor, the suffix starts one character past the CID and
+            #  ends before the last extension
+            suffix = parts['rest'].str.replace( r'\.[^.]*$', '', regex = True ).str[1:]
+            keys = pd.DataFrame( { 'suffix':    suffix.where( ~invalid, '' ),
+                                   'level':     level_codes,
+                                   'satellite': satellite } )
+
+            file_types = [ x for x in FileType if x != FileType.UNKNOWN ]
+            ft_index   = { x: idx for idx, x in enumerate( file_types ) }
+
+            unique = keys[~invalid].drop_duplicates()
+            unique = unique.assign( code = [ ft_index.get( CollectID._decode_file_type( s, levels[l], sat ), -1 )
+                                             for s, l, sat in unique.itertuples( index = False ) ] )
+
+            #  A left merge keeps the row order
+            ft_codes = keys.merge( unique, how = 'left', on = [ 'suffix', 'level', 'satellite' ] )['code']
+            ft_codes = ft_codes.fillna( -1 ).to_numpy( dtype = np.int64, copy = True )
+            ft_codes[invalid] = -1
+
+            output['file_type'] = pd.Categorical.from_codes( ft_codes, [ x.name for x in file_types ] )
+
+        return output
+
+    @staticmethod
+    def classify_file( filename ):
+        '''
+        Return the FileType of a collection file from its name, or None if it is not
+        a file we track.  Unlike the constructor, this never raises.
+        '''
+
+        res = CID_PATTERN.match( filename )
+        if res is None:
+            return None
+
+        level = PRODUCT_LEVELS.get( res['level'] )
+        if level is None:
+            return None
+
+        stem = os.path.splitext( filename )[0]
+        return CollectID._decode_file_type( stem[res.end()+1:], level, int(res['satellite']) )
+
+    @staticmethod
+    def scan_folder( pathname ):
+        '''
+        Locate every tracked file under a collection folder using os.scandir.
+
+        Returns a dictionary of file keys to paths (see FileType.create_empty_dict()),
+        the number of directory entries visited and the elapsed time in seconds.
+        '''
+
+        start = time.perf_counter()
+        available_files = FileType.create_empty_dict()
+        num_entries = 0
+
+        #  Same traversal as os.walk(): errors are ignored and symlinked folders are not followed
+        pending = [ pathname ]
+        while len(pending) > 0:
+            try:
+                entries = os.scandir( pending.pop() )
+            except OSError:
+                continue
+
+            with entries:
+                for entry in entries:
+                    num_entries += 1
+
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink():
+                            pending.append( entry.path )
+                        continue
+
+                    ftype = CollectID.classify_file( entry.name )
+                    if ftype is None:
+                        continue
+
+                    fkey = ftype.to_file_key()
+                    if available_files[fkey] != None:
+                        raise Exception( f'File cannot be set for key ({fkey}) with existing path: {available_files[fkey]}. New {entry.path}' )
+                    available_files[fkey] = entry.path
+
+        return available_files, num_entries, time.perf_counter() - start
+
+    @staticmethod
+    def scan_collections( cid_list, num_workers = 8 ):
+        '''
+        Build the collection table for a list of CollectIDs, scanning the collection
+        folders concurrently on a thread pool.
+
+        Returns the table (same schema as list_to_dataframes()) and a table with the
+        per-folder scan timing, which is useful for finding slow mounts.
+        '''
+
+        cid_list = list( cid_list )
 
         data = { 'pathname': [],
                  'cid': [],
@@ -347,45 +508,41 @@ class CollectID:
         ftypes = FileType.create_empty_dict()
         for ftype in ftypes:
             data[ftype] = []
-        
-        for cid in cid_list:
-            data['pathname'].append( cid.pathname() )
-            data['cid'].append( cid.cid() )
-            data['sensor'].append( cid.sensor().name )
-            data['satellite'].append( cid.satellite() )
-            data['product_type'].append( cid.processing_level().type() )
-            data['processing_level'].append( cid.processing_level().name )
-            data['wrs2_path'].append( cid.wrs2_path() )
-            data['wrs2_row'].append( cid.wrs2_row() )
-            data['ard_col'].append( cid.ard_col() )
-            data['ard_row'].append( cid.ard_row() )
-            data['acquisition_date'].append( cid.acquisition_date() )
-            data['production_date'].append( cid.production_date() )
-
-            #  Create dictionary we can update with files we discover
-            available_files = FileType.create_empty_dict()
-                
-            #  Check all files in folder
-            for (root,d,files) in os.walk( cid.pathname() ):
-                for f in files:
-                    pname = os.path.join( root, f )
-                    fkey = None
-                    try:
-                        c = CollectID( pname, is_file=True )
 
-                        #  Landsat 7 adds VCID_# to the end of the file
-                        fkey = c.file_type().to_file_key()
-                    except Exception as e:
-                        continue
+        timing = { 'pathname':    [],
+                   'num_entries': [],
+                   'scan_time_s': [] }
+
+        #  Directory listings release the GIL, so threads overlap the (network) filesystem waits
+        with concurrent.futures.ThreadPoolExecutor( max_workers = max( 1, num_workers ) ) as executor:
+            results = executor.map( CollectID.scan_folder, [ cid.pathname() for cid in cid_list ] )
+
+            for cid, ( available_files, num_entries, elapsed ) in zip( cid_list, results ):
+                data['pathname'].append( cid.pathname() )
+                data['cid'].append( cid.cid() )
+                data['sensor'].append( cid.sensor().name )
+                data['satellite'].append( cid.satellite() )
+                data['product_type'].append( cid.processing_level().type() )
+                data['processing_level'].append( cid.processing_level().name )
+                data['wrs2_path'].append( cid.wrs2_path() )
+                data['wrs2_row'].append( cid.wrs2_row() )
+                data['ard_col'].append( cid.ard_col() )
+                data['ard_row'].append( cid.ard_row() )
+                data['acquisition_date'].append( cid.acquisition_date() )
+                data['production_date'].append( cid.production_date() )
+
+                for key in available_files:
+                    data[key].append( available_files[key] )
+
+                logging.debug( f'Scanned {cid.pathname()}: {num_entries} entries in {elapsed:0.3f} s' )
+                timing['pathname'].append( cid.pathname() )
+                timing['num_entries'].append( num_entries )
+                timing['scan_time_s'].append( elapsed )
+
+        return pd.DataFrame( data ), pd.DataFrame( timing )
 
-                    if available_files[fkey] != None:
-                        raise Exception( f'File cannot be set for key ({fkey}) with existing path: {available_files[fkey]}. New {c.pathname()}' )
-                    available_files[fkey] = c.pathname()
-                    
-            #  Update the list
-            for key in available_files:
-                data[key].append( available_files[key] )
-        
-        collect_list_df = pd.DataFrame( data )
+    @staticmethod
+    def list_to_dataframes( cid_list, num_workers = 8 ):
+
+        collect_list_df, timing_df = CollectID.scan_collections( cid_list, num_workers )
         return collect_list_df
-        
\ No newline at end of file
@@ -1,5 +1,6 @@
 
-import sqlite3
+import datetime, sqlite3
+import numpy as np
 import pandas as pd
 
 def init_db( pathname ):
@@ -95,4 +96,237 @@ def close_db( conn ):
         if conn:
             conn.close()
             print('SQLite Connection closed')
-            
\ No newline at end of file
+            
+
+#----------------------------------------------------------------#
+#-          Landsat Catalog (Collections, Files, Products)      -#
+#----------------------------------------------------------------#
+
+COLLECTION_COLUMNS = [ 'cid',
+                       'pathname',
+                       'sensor',
+                       'satellite',
+                       'product_type',
+                       'processing_level',
+                       'wrs2_path',
+                       'wrs2_row',
+                       'ard_col',
+                       'ard_row',
+                       'acquisition_date',
+                       'production_date' ]
+
+CATALOG_SCHEMA = [ '''CREATE TABLE IF NOT EXISTS collections (
+                          cid              TEXT PRIMARY KEY,
+                          pathname         TEXT,
+                          sensor           TEXT,
+                          satellite        INTEGER,
+                          product_type     TEXT,
+                          processing_level TEXT,
+                          wrs2_path        INTEGER,
+                          wrs2_row         INTEGER,
+                          ard_col          INTEGER,
+                          ard_row          INTEGER,
+                          acquisition_date TEXT,
+                          production_date  TEXT )''',
+                   '''CREATE TABLE IF NOT EXISTS files (
+                          cid      TEXT NOT NULL REFERENCES collections(cid) ON DELETE CASCADE,
+                          file_key TEXT NOT NULL,
+                          pathname TEXT NOT NULL,
+                          PRIMARY KEY ( cid, file_key ) )''',
+                   '''CREATE TABLE IF NOT EXISTS products (
+                          cid      TEXT NOT NULL REFERENCES collections(cid) ON DELETE CASCADE,
+                          product  TEXT NOT NULL,
+                          epsg     INTEGER NOT NULL DEFAULT 0,
+                          pathname TEXT NOT NULL,
+                          updated  TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          PRIMARY KEY ( cid, product, epsg ) )''',
+                   '''CREATE TABLE IF NOT EXISTS scene_quality (
+                          cid                   TEXT PRIMARY KEY REFERENCES collections(cid) ON DELETE CASCADE,
+                          mtl_path              TEXT NOT NULL,
+                          mtl_source            TEXT NOT NULL,
+                          cloud_cover           REAL,
+                          cloud_cover_land      REAL,
+                          sun_elevation         REAL,
+                          sun_azimuth           REAL,
+                          earth_sun_distance    REAL,
+                          radiance_mult_b10     REAL,
+                          radiance_add_b10      REAL,
+                          radiance_mult_b11     REAL,
+                          radiance_add_b11      REAL,
+                          k1_b10                REAL,
+                          k2_b10                REAL,
+                          k1_b11                REAL,
+                          k2_b11                REAL,
+                          corner_ul_lat         REAL,
+                          corner_ul_lon         REAL,
+                          corner_ur_lat         REAL,
+                          corner_ur_lon         REAL,
+                          corner_ll_lat         REAL,
+                          corner_ll_lon         REAL,
+                          corner_lr_lat         REAL,
+                          corner_lr_lon         REAL )''',
+                   'CREATE INDEX IF NOT EXISTS idx_collections_wrs2 ON collections ( wrs2_path, wrs2_row, acquisition_date )',
+                   'CREATE INDEX IF NOT EXISTS idx_collections_ard  ON collections ( ard_col, ard_row, acquisition_date )',
+                   'CREATE INDEX IF NOT EXISTS idx_collections_date ON collections ( acquisition_date )',
+                   'CREATE INDEX IF NOT EXISTS idx_products_product ON products ( product, epsg )',
+                   'CREATE INDEX IF NOT EXISTS idx_quality_cloud    ON scene_quality ( cloud_cover )' ]
+
+def open_catalog( pathname, timeout = 30.0 ):
+    '''
+    Open (and create if needed) the SQLite Landsat catalog.
+
+    The database runs in WAL mode so pipeline workers can read while another records
+    its outputs.  Writers wait up to timeout seconds for the lock.
+    '''
+
+    conn = sqlite3.connect( pathname, timeout = timeout )
+    conn.execute( 'PRAGMA journal_mode=WAL' )
+    conn.execute( 'PRAGMA synchronous=NORMAL' )
+    conn.execute( 'PRAGMA foreign_keys=ON' )
+
+    with conn:
+        for statement in CATALOG_SCHEMA:
+            conn.execute( statement )
+    return conn
+
+def _to_db_value( value ):
+
+    if value is None or ( not isinstance( value, str ) and pd.isna( value ) ):
+        return None
+    if isinstance( value, ( pd.Timestamp, datetime.datetime ) ):
+        return value.strftime( '%Y-%m-%d' )
+    if isinstance( value, datetime.date ):
+        return value.isoformat()
+    if isinstance( value, np.generic ):
+        return value.item()
+    return value
+
+def upsert_collections( conn, collection_df ):
+    '''
+    Insert or update collections from a collection table (see
+    CollectID.list_to_dataframes()).  Non-null *_path columns are recorded in the
+    files table.  All rows are written in a single transaction.
+    '''
+
+    columns   = [ x for x in COLLECTION_COLUMNS if x in collection_df ]
+    file_keys = [ x for x in collection_df.columns if x.endswith( '_path' ) and x not in COLLECTION_COLUMNS ]
+
+    coll_rows = [ tuple( _to_db_value( x ) for x in row )
+                  for row in collection_df[columns].itertuples( index = False, name = None ) ]
+
+    file_rows = []
+    for row in collection_df[['cid'] + file_keys].itertuples( index = False, name = None ):
+        for key, path in zip( file_keys, row[1:] ):
+            path = _to_db_value( path )
+            if path is not None:
+                file_rows.append( ( row[0], key, path ) )
+
+    updates = ', '.join( f'{x} = excluded.{x}' for x in columns if x != 'cid' )
+    coll_sql = f'''INSERT INTO collections ( {', '.join(columns)} )
+                   VALUES ( {', '.join( '?' * len(columns) )} )
+                   ON CONFLICT ( cid ) DO UPDATE SET {updates}'''
+    file_sql = '''INSERT INTO files ( cid, file_key, pathname ) VALUES ( ?, ?, ? )
+                  ON CONFLICT ( cid, file_key ) DO UPDATE SET pathname = excluded.pathname'''
+
+    with conn:
+        conn.executemany( coll_sql, coll_rows )
+        conn.executemany( file_sql, file_rows )
+
+    return len(coll_rows)
+
+def upsert_products( conn, records ):
+    '''
+    Record derived products (NDVI, emissivity, LST, reprojected bands, ...).  Each record
+    is a (cid, product, epsg, pathname) tuple; use None for products without an EPSG.
+    All records are written in a single transaction.
+    '''
+
+    rows = [ ( cid, product, 0 if epsg is None else int(epsg), pathname )
+             for cid, product, epsg, pathname in records ]
+
+    sql = '''INSERT INTO products ( cid, product, epsg, pathname ) VALUES ( ?, ?, ?, ? )
+             ON CONFLICT ( cid, product, epsg ) DO UPDATE SET pathname = excluded.pathname,
+                                                               updated  = CURRENT_TIMESTAMP'''
+    with conn:
+        conn.executemany( sql, rows )
+
+    return len(rows)
+
+def record_product( conn, cid, product, pathname, epsg = None ):
+    '''
+    Record a single derived product.  Safe to call from concurrent workers.
+    '''
+    return upsert_products( conn, [ ( cid, product, epsg, pathname ) ] )
+
+def query_collections( conn,
+                       columns          = None,
+                       processing_level = None,
+                       wrs2_path        = None,
+                       wrs2_row         = None,
+                       start_date       = None,
+                       end_date         = None ):
+    '''
+    Select collections using the indexes.  The date range is inclusive.
+    '''
+
+    clauses = []
+    params  = []
+    for name, value in [ ( 'processing_level', processing_level ),
+                         ( 'wrs2_path',        wrs2_path ),
+                         ( 'wrs2_row',         wrs2_row ) ]:
+        if value is not None:
+            clauses.append( f'{name} = ?' )
+            params.append( _to_db_value( value ) )
+    if start_date is not None:
+        clauses.append( 'acquisition_date >= ?' )
+        params.append( _to_db_value( pd.Timestamp( start_date ) ) )
+    if end_date is not None:
+        clauses.append( 'acquisition_date <= ?' )
+        params.append( _to_db_value( pd.Timestamp( end_date ) ) )
+
+    if columns is None:
+        columns = COLLECTION_COLUMNS
+    sql = f'SELECT {", ".join(columns)} FROM collections'
+    if len(clauses) > 0:
+        sql = f'{sql} WHERE {" AND ".join(clauses)}'
+    sql = f'{sql} ORDER BY acquisition_date'
+
+    date_cols = [ x for x in [ 'acquisition_date', 'production_date' ] if x in columns ]
+    int_cols  = { x: 'Int16' for x in [ 'satellite', 'wrs2_path', 'wrs2_row', 'ard_col', 'ard_row' ] if x in columns }
+    return pd.read_sql_query( sql, conn, params = params, parse_dates = date_cols, dtype = int_cols )
+
+def load_files( conn, cid = None, wide = False ):
+    '''
+    Load the file paths, optionally for a single CID.  With wide=True, returns one row
+    per CID with a column per file key.
+    '''
+
+    sql = 'SELECT cid, file_key, pathname FROM files'
+    params = []
+    if cid is not None:
+        sql = f'{sql} WHERE cid = ?'
+        params.append( cid )
+
+    df = pd.read_sql_query( sql, conn, params = params )
+    if wide:
+        df = df.pivot( index = 'cid', columns = 'file_key', values = 'pathname' ).reset_index()
+        df.columns.name = None
+    return df
+
+def load_products( conn, cid = None, product = None, epsg = None ):
+    '''
+    Load the derived products, optionally filtered by CID, product name and EPSG.
+    '''
+
+    clauses = []
+    params  = []
+    for name, value in [ ( 'cid', cid ), ( 'product', product ), ( 'epsg', epsg ) ]:
+        if value is not None:
+            clauses.append( f'{name} = ?' )
+            params.append( _to_db_value( value ) )
+
+    sql = 'SELECT cid, product, epsg, pathname, updated FROM products'
+    if len(clauses) > 0:
+        sql = f'{sql} WHERE {" AND ".join(clauses)}'
+
+    return pd.read_sql_query( sql, conn, params = params, parse_dates = [ 'updated' ] )
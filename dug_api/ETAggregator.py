@@ -0,0 +1,253 @@
+#    File:    ETAggregator.py
+#
+#    Purpose: Rolling-window aggregation of a garden's daily OpenET rasters.  Only the
+#             crop around the garden is read, and each window step adds the frames
+#             entering the window and removes those leaving it from running sums.
+#
+
+import collections, logging, math, os
+
+import numpy as np
+import pandas as pd
+
+import rasterio
+from rasterio.windows import Window, transform as window_transform
+
+import dug_api.coordinate as crd
+
+#  One aggregated window.  Dates are inclusive, mean and sum are float32 rasters
+#  (NaN where no frame had data), count the number of valid frames per pixel.
+ETWindow = collections.namedtuple( 'ETWindow', [ 'start_date', 'end_date', 'num_frames', 'mean', 'sum', 'count', 'transform', 'crs' ] )
+
+#  Meters per degree of latitude, for rasters in geographic coordinates
+METERS_PER_DEGREE = 111320.0
+
+
+class ETAggregator:
+    '''
+    Rolling windows of win_size_days days, starting every win_skip_days days, over a
+    garden's daily ET rasters (see the [openet] section of the config file).
+
+    Frames are read one at a time, cropped to crop_width_m x crop_height_m around the
+    garden.  A per-pixel running sum and count are kept, so moving the window adds
+    the frames entering it and subtracts those leaving it rather than re-summing the
+    whole window.  Only the frames inside the current window are held, so memory is
+    bounded by the window length, not the length of the series.
+    '''
+
+    def __init__( self, win_size_days, win_skip_days = 1, crop_width_m = None, crop_height_m = None ):
+
+        if int(win_size_days) < 1 or int(win_skip_days) < 1:
+            raise Exception( f'Invalid window, size: {win_size_days} days, skip: {win_skip_days} days' )
+
+        self.win_size_days = int(win_size_days)
+        self.win_skip_days = int(win_skip_days)
+        self.crop_width_m  = crop_width_m
+        self.crop_height_m = crop_height_m
+
+    def get_crop_window( self, src, center_ll ):
+        '''
+        Pixel window of the crop around a lon/lat point, or the whole raster if no
+        crop size is set.
+        '''
+        if self.crop_width_m is None or self.crop_height_m is None:
+            return Window( 0, 0, src.width, src.height )
+
+        center = crd.convert_coord_point( center_ll, 4326, src.crs )
+        half_w = self.crop_width_m / 2.0
+        half_h = self.crop_height_m / 2.0
+        if src.crs.is_geographic:
+            half_h /= METERS_PER_DEGREE
+            half_w /= METERS_PER_DEGREE * math.cos( math.radians( center_ll[1] ) )
+
+        #  Round the size, not the corners, so every frame on a grid crops the same shape
+        col, row = ~src.transform * ( center[0] - half_w, center[1] + half_h )
+        width  = max( 1, int( round( 2 * half_w / abs( src.transform.a ) ) ) )
+        height = max( 1, int( round( 2 * half_h / abs( src.transform.e ) ) ) )
+        return Window( int( round( col ) ), int( round( row ) ), width, height )
+
+    @staticmethod
+    def get_grid_window( src, grid ):
+        '''
+        Pixel window of a frame covering a reference grid (transform, CRS, shape).
+        Raises if the frame is in another CRS or its pixels don't line up with the grid.
+        '''
+        xform, crs, shape = grid
+        if src.crs != crs:
+            raise Exception( f'Frame CRS {src.crs} does not match {crs}: {src.name}' )
+        if not np.allclose( [ src.transform.a, src.transform.b, src.transform.d, src.transform.e ],
+                            [ xform.a, xform.b, xform.d, xform.e ], rtol = 1e-9, atol = 0 ):
+            raise Exception( f'Frame pixel size {src.res} does not match {( abs(xform.a), abs(xform.e) )}: {src.name}' )
+
+        col, row = ~src.transform * ( xform.c, xform.f )
+        if abs( col - round( col ) ) > 1e-6 or abs( row - round( row ) ) > 1e-6:
+            raise Exception( f'Frame pixels are offset from the reference grid by ({col % 1:.3f}, {row % 1:.3f}): {src.name}' )
+        return Window( int( round( col ) ), int( round( row ) ), shape[1], shape[0] )
+
+    def read_frame( self, path, center_ll, grid = None ):
+        '''
+        Crop of one frame as float32, with nodata as NaN.  Returns the array, and the
+        transform and CRS of the crop.
+
+        With grid (the transform, CRS and shape of an earlier crop), the frame is read
+        onto that grid instead, padded with NaN where it doesn't cover it, see
+        get_grid_window().
+        '''
+        with rasterio.open( path ) as src:
+            if grid is None:
+                window = self.get_crop_window( src, center_ll )
+            else:
+                window = ETAggregator.get_grid_window( src, grid )
+            inside = ( window.col_off >= 0 and window.row_off >= 0 and
+                       window.col_off + window.width <= src.width and
+                       window.row_off + window.height <= src.height )
+
+            nodata = src.nodata
+            if inside:
+                arr = src.read( 1, window = window, out_dtype = 'float32' )
+            else:
+                arr = src.read( 1,
+                                window     = window,
+                                out_dtype  = 'float32',
+                                boundless  = True,
+                                fill_value = np.nan if nodata is None else nodata )
+            if nodata is not None and not np.isnan( nodata ):
+                arr[arr == nodata] = np.nan
+            return arr, window_transform( window, src.transform ), src.crs
+
+    def iter_windows( self, paths, dates, center_ll, start_date = None, end_date = None ):
+        '''
+        Aggregate frames (paths, and their dates, sorted by date, e.g. from
+        FrameIndex.query()) around a lon/lat point.  Yields an ETWindow for each window
+        with at least one frame which lies within start_date and end_date (default: the
+        first and last frames).  Frames no window covers are never read.
+        '''
+
+        dates = np.asarray( dates ).astype( 'datetime64[D]' )
+        if len(dates) == 0:
+            return
+        if np.any( dates[1:] < dates[:-1] ):
+            raise Exception( 'Frames must be sorted by date' )
+
+        first = dates[0] if start_date is None else np.datetime64( pd.Timestamp( start_date ).date(), 'D' )
+        last  = dates[-1] if end_date is None else np.datetime64( pd.Timestamp( end_date ).date(), 'D' )
+        size  = np.timedelta64( self.win_size_days, 'D' )
+        skip  = np.timedelta64( self.win_skip_days, 'D' )
+
+        active  = collections.deque()
+        sum_arr = None
+        count   = None
+        grid    = None
+        pos     = int( np.searchsorted( dates, first, side = 'left' ) )
+
+        start = first
+        while start + size <= last + np.timedelta64( 1, 'D' ):
+
+            end = start + size
+
+            #  Drop the frames which left the window
+            while len(active) > 0 and active[0][0] < start:
+                arr = active.popleft()[1]
+                valid = ~np.isnan( arr )
+                np.subtract( sum_arr, arr, out = sum_arr, where = valid )
+                count -= valid
+            if sum_arr is not None:
+                #  Clear rounding residue where no frame is left
+                sum_arr[count == 0] = 0.0
+
+            #  Skip frames which fell between windows, then add the new ones
+            while pos < len(dates) and dates[pos] < start:
+                pos += 1
+            while pos < len(dates) and dates[pos] < end:
+                #  Every frame after the first is read onto the first frame's crop
+                arr, xform, crs = self.read_frame( paths[pos], center_ll, grid )
+                if sum_arr is None:
+                    sum_arr = np.zeros( arr.shape, dtype = np.float64 )
+                    count   = np.zeros( arr.shape, dtype = np.int32 )
+                    grid    = ( xform, crs, arr.shape )
+
+                valid = ~np.isnan( arr )
+                np.add( sum_arr, arr, out = sum_arr, where = valid )
+                count += valid
+                active.append( ( dates[pos], arr ) )
+                pos += 1
+
+            if len(active) > 0:
+                with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+                    mean = ( sum_arr / count ).astype( np.float32 )
+                window_sum = sum_arr.astype( np.float32 )
+                window_sum[count == 0] = np.nan
+
+                yield ETWindow( start.item(),
+                                ( end - np.timedelta64( 1, 'D' ) ).item(),
+                                len(active),
+                                mean,
+                                window_sum,
+                                count.copy(),
+                                grid[0],
+                                grid[1] )
+
+            start = start + skip
+
+    @staticmethod
+    def summarize( window ):
+        '''
+        Scalar summary of an ETWindow.
+        '''
+        valid = window.count > 0
+        if not valid.any():
+            stats = [ np.nan ] * 4
+        else:
+            stats = [ float( window.mean[valid].mean() ), float( window.mean[valid].min() ),
+                      float( window.mean[valid].max() ), float( window.sum[valid].mean() ) ]
+
+        return { 'start_date':     window.start_date,
+                 'end_date':       window.end_date,
+                 'num_frames':     window.num_frames,
+                 'valid_fraction': float( valid.mean() ),
+                 'et_mean':        stats[0],
+                 'et_min':         stats[1],
+                 'et_max':         stats[2],
+                 'et_sum_mean':    stats[3] }
+
+    @staticmethod
+    def write_window( window, output_dir, prefix ):
+        '''
+        Write the mean and sum rasters of an ETWindow as
+        output_dir/<prefix>_<start>_<end>_{mean,sum}.tif.  Returns both paths.
+        '''
+        os.makedirs( output_dir, exist_ok = True )
+        stem = f'{prefix}_{window.start_date:%Y%m%d}_{window.end_date:%Y%m%d}'
+
+        output = []
+        for name, arr in [ ( 'mean', window.mean ), ( 'sum', window.sum ) ]:
+            pathname = os.path.join( output_dir, f'{stem}_{name}.tif' )
+            with rasterio.open( pathname,
+                                'w',
+                                driver    = 'GTiff',
+                                width     = arr.shape[1],
+                                height    = arr.shape[0],
+                                count     = 1,
+                                dtype     = 'float32',
+                                crs       = window.crs,
+                                transform = window.transform,
+                                nodata    = np.nan ) as dst:
+                dst.write( arr, 1 )
+            output.append( pathname )
+        return output
+
+    def aggregate( self, paths, dates, center_ll, start_date = None, end_date = None, output_dir = None, prefix = 'openet' ):
+        '''
+        Summarize every window (see iter_windows()) into a table, one row per window.
+        With output_dir, the mean and sum rasters of each window are written as well
+        (see write_window()) and listed in the mean_path and sum_path columns.
+        '''
+        rows = []
+        for window in self.iter_windows( paths, dates, center_ll, start_date, end_date ):
+            row = ETAggregator.summarize( window )
+            if output_dir is not None:
+                row['mean_path'], row['sum_path'] = ETAggregator.write_window( window, output_dir, prefix )
+            rows.append( row )
+
+        logging.debug( f'Aggregated {len(paths)} frames into {len(rows)} windows of {self.win_size_days} days' )
+        return pd.DataFrame( rows )
@@ -0,0 +1,180 @@
+#    File:    FrameIndex.py
+#
+#    Purpose: In-memory index of the OpenET frames on disk, grouped by garden with
+#             sorted dates, so date-range lookups and existence checks don't have to
+#             walk the folder or stat one file per day.
+#
+
+import datetime, logging, os, re
+
+import numpy as np
+import pandas as pd
+
+#  File type to ( folder under base_dir, extension )
+FRAME_TYPES = { 'zip':     ( 'raw',     '.zip' ),
+                'geotiff': ( 'geotiff', '.tif' ) }
+
+#  Example name: openet_a211N000002Jm8Q_20230805.tif
+FRAME_PATTERN = r'openet_([a-zA-Z0-9]{15})_([0-9]{8})'
+
+def _to_day( value ):
+    return np.datetime64( pd.Timestamp( value ).date(), 'D' )
+
+
+class FrameIndex:
+    '''
+    Index of the OpenET frames of one file type (see FRAME_TYPES) under base_dir.
+
+    The folder is listed once (including sub-folders) and frames are grouped by garden
+    ID, each garden holding its dates as a sorted datetime64[D] array and the matching
+    paths.  Date range queries are a binary search within a garden.
+
+    refresh() picks up new or removed files by re-listing only the folders whose
+    modification time changed since the last scan.
+    '''
+
+    def __init__( self, base_dir, file_type = 'geotiff' ):
+
+        if file_type not in FRAME_TYPES:
+            raise Exception( f'Unsupported file_type: {file_type}' )
+
+        self.base_dir  = base_dir
+        self.file_type = file_type
+        self.root      = os.path.join( base_dir, FRAME_TYPES[file_type][0] )
+        self.pattern   = re.compile( FRAME_PATTERN + re.escape( FRAME_TYPES[file_type][1] ) )
+
+        #  Folder to ( mtime, [ ( garden_id, date, path ) ] )
+        self.folders = {}
+        self.gardens = {}
+        self.refresh()
+
+    def __len__( self ):
+        return sum( len(x[0]) for x in self.gardens.values() )
+
+    def _scan_folder( self, folder ):
+        '''
+        List one folder.  Returns its frames and sub-folders.
+        '''
+        frames  = []
+        subdirs = []
+        with os.scandir( folder ) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append( entry.path )
+                    continue
+                match = self.pattern.fullmatch( entry.name )
+                if match is not None:
+                    frames.append( ( match.group(1), match.group(2), entry.path ) )
+        return frames, subdirs
+
+    def refresh( self ):
+        '''
+        Re-list the folders changed since the last scan, and rebuild the garden arrays
+        if any frame was added or removed.  Returns whether anything changed.
+        '''
+
+        changed = False
+        seen    = set()
+        pending = [ self.root ] if os.path.isdir( self.root ) else []
+        while len(pending) > 0:
+
+            folder = pending.pop()
+            seen.add( folder )
+            try:
+                mtime = os.stat( folder ).st_mtime_ns
+            except OSError:
+                continue
+
+            known = self.folders.get( folder )
+            if known is not None and known[0] == mtime:
+                pending.extend( known[2] )
+                continue
+
+            frames, subdirs = self._scan_folder( folder )
+            self.folders[folder] = ( mtime, frames, subdirs )
+            pending.extend( subdirs )
+            changed = True
+
+        for folder in [ x for x in self.folders if x not in seen ]:
+            del self.folders[folder]
+            changed = True
+
+        if changed:
+            self._build()
+        return changed
+
+    def _build( self ):
+
+        frames = [ x for entry in self.folders.values() for x in entry[1] ]
+        logging.debug( f'Indexing {len(frames)} OpenET frames under {self.root}' )
+
+        self.gardens = {}
+        if len(frames) == 0:
+            return
+
+        garden_ids = np.array( [ x[0] for x in frames ] )
+        dates      = np.array( [ f'{x[1][0:4]}-{x[1][4:6]}-{x[1][6:8]}' for x in frames ], dtype = 'datetime64[D]' )
+        paths      = np.array( [ x[2] for x in frames ], dtype = object )
+
+        #  Sort by garden, then date, and split into one slice per garden
+        order = np.lexsort( ( dates, garden_ids ) )
+        garden_ids = garden_ids[order]
+        dates      = dates[order]
+        paths      = paths[order]
+
+        starts = np.flatnonzero( np.r_[ True, garden_ids[1:] != garden_ids[:-1] ] )
+        ends   = np.r_[ starts[1:], len(garden_ids) ]
+        for lo, hi in zip( starts, ends ):
+            self.gardens[str( garden_ids[lo] )] = ( dates[lo:hi], paths[lo:hi] )
+
+    def garden_ids( self ):
+        return sorted( self.gardens.keys() )
+
+    def _search( self, garden_id, start_date, end_date ):
+
+        if garden_id not in self.gardens:
+            return np.zeros( 0, dtype = 'datetime64[D]' ), np.zeros( 0, dtype = object )
+
+        dates, paths = self.gardens[garden_id]
+        lo = 0 if start_date is None else np.searchsorted( dates, _to_day( start_date ), side = 'left' )
+        hi = len(dates) if end_date is None else np.searchsorted( dates, _to_day( end_date ), side = 'right' )
+        return dates[lo:hi], paths[lo:hi]
+
+    def query( self, garden_id, start_date = None, end_date = None ):
+        '''
+        Dates (datetime64[D]) and paths of a garden's frames within an (inclusive)
+        date range, sorted by date.  The arrays are views into the index.
+        '''
+        return self._search( garden_id, start_date, end_date )
+
+    def count( self, garden_id, start_date = None, end_date = None ):
+        '''
+        Number of a garden's frames within an (inclusive) date range.
+        '''
+        return len( self._search( garden_id, start_date, end_date )[0] )
+
+    def get_frames( self, garden_id, start_date = None, end_date = None ):
+        '''
+        Frames of a garden as a list of { 'path', 'date' }, sorted by date, as returned
+        by OpenET.get_frame_list().
+        '''
+        dates, paths = self._search( garden_id, start_date, end_date )
+        return [ { 'path': p, 'date': datetime.datetime.combine( d.item(), datetime.time() ) }
+                 for d, p in zip( dates, paths ) ]
+
+    def exists( self, garden_id, date_start, num_days ):
+        '''
+        Boolean array of whether a frame exists for each of num_days days from
+        date_start.
+        '''
+        first = _to_day( date_start )
+        days  = first + np.arange( 0, num_days )
+        dates = self._search( garden_id, first, days[-1] if num_days > 0 else first )[0]
+        return np.isin( days, dates )
+
+    def missing_dates( self, garden_id, date_start, num_days ):
+        '''
+        Days (datetime64[D]) of the num_days from date_start without a frame.
+        '''
+        days = _to_day( date_start ) + np.arange( 0, num_days )
+        return days[~self.exists( garden_id, date_start, num_days )]
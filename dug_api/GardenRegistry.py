@@ -0,0 +1,229 @@
+#    File:    GardenRegistry.py
+#
+#    Purpose: Garden locations from any of the garden lists (CSV, KML or the DUG Excel
+#             export), loaded once and cached, with lookups by name or Garden ID and a
+#             KD-tree for nearest-garden and radius queries.
+#
+
+import logging, os
+
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+
+import dug_api.catalog as catalog
+import dug_api.coordinate as crd
+from dug_api import kml
+
+#  Garden list columns to registry columns
+COLUMN_ALIASES = { 'Name':                           'name',
+                   'Longitude':                      'longitude',
+                   'Latitude':                       'latitude',
+                   'Elevation':                      'elevation',
+                   'Garden: Garden Name':            'name',
+                   'Garden: ID':                     'garden_id',
+                   'Garden Geolocation (Longitude)': 'longitude',
+                   'Garden Geolocation (Latitude)':  'latitude' }
+
+GARDEN_COLUMNS = [ 'garden_id', 'name', 'longitude', 'latitude', 'elevation' ]
+
+
+class GardenRegistry:
+    '''
+    Table of gardens with their lon/lat and their projected x/y in epsg.
+
+    Names (case-insensitive) and Garden IDs map straight to row positions.  Spatial
+    queries run on a KD-tree over the projected coordinates, so distances are in the
+    units of epsg (meters for UTM).
+    '''
+
+    def __init__( self, garden_df, epsg ):
+
+        self.epsg = int(epsg)
+        garden_df = garden_df.reset_index( drop = True )
+        if 'x' not in garden_df or 'y' not in garden_df:
+            garden_df = GardenRegistry.project( garden_df, self.epsg )
+        self.garden_df = garden_df
+
+        #  First entry wins for duplicate names
+        self.name_lookup = {}
+        for pos, name in enumerate( garden_df['name'] ):
+            if isinstance( name, str ):
+                self.name_lookup.setdefault( name.casefold(), pos )
+
+        self.id_lookup = {}
+        for pos, garden_id in enumerate( garden_df['garden_id'] ):
+            if isinstance( garden_id, str ):
+                self.id_lookup.setdefault( garden_id, pos )
+
+        self.xy   = garden_df[['x','y']].to_numpy( dtype = np.float64 )
+        self.tree = cKDTree( self.xy )
+
+    def __len__( self ):
+        return self.garden_df.shape[0]
+
+    @staticmethod
+    def normalize( garden_df ):
+        '''
+        Rename the columns of a garden list to GARDEN_COLUMNS.  Other columns are kept,
+        and rows without a location are dropped.
+        '''
+        garden_df = garden_df.rename( columns = { k: v for k, v in COLUMN_ALIASES.items() if k in garden_df } )
+        for col in GARDEN_COLUMNS:
+            if col not in garden_df:
+                garden_df[col] = np.nan if col == 'elevation' else None
+
+        garden_df = garden_df.dropna( subset = [ 'longitude', 'latitude' ] )
+        others = [ x for x in garden_df.columns if x not in GARDEN_COLUMNS ]
+        return garden_df[GARDEN_COLUMNS + others].reset_index( drop = True )
+
+    @staticmethod
+    def project( garden_df, epsg ):
+        '''
+        Add the x/y of each garden in epsg, in a single transform.
+        '''
+        x, y = crd.convert_coord_xy( garden_df['longitude'].to_numpy( dtype = np.float64 ),
+                                     garden_df['latitude'].to_numpy( dtype = np.float64 ),
+                                     4326,
+                                     epsg )
+        return garden_df.assign( x = x, y = y )
+
+    @staticmethod
+    def read_kml( pathname ):
+        '''
+        Garden list from a KML file, streamed with iterparse.
+        '''
+        rows = []
+        for placemark in kml.iter_kml_placemarks( pathname ):
+            coord = placemark['coordinate']
+            rows.append( { 'name':      placemark['name'],
+                           'longitude': coord[0],
+                           'latitude':  coord[1],
+                           'elevation': coord[2] if len(coord) > 2 else np.nan } )
+        return pd.DataFrame( rows, columns = [ 'name', 'longitude', 'latitude', 'elevation' ] )
+
+    @staticmethod
+    def read_garden_list( pathname ):
+        '''
+        Parse a garden list (.csv, .kml or .xlsx) into GARDEN_COLUMNS.
+        '''
+        ext = os.path.splitext( pathname )[1].lower()
+        if ext == '.kml':
+            garden_df = GardenRegistry.read_kml( pathname )
+        elif ext in [ '.xlsx', '.xls' ]:
+            garden_df = pd.read_excel( pathname )
+        elif ext == '.csv':
+            garden_df = pd.read_csv( pathname )
+        else:
+            raise Exception( f'Unsupported garden list format: {pathname}' )
+        return GardenRegistry.normalize( garden_df )
+
+    @staticmethod
+    def cache_path( pathname, epsg ):
+        '''
+        Return the binary cache path for a garden list projected into epsg.  The source
+        extension is kept, so a .csv and a .kml list of the same name don't share a cache.
+        '''
+        return f'{pathname}.gardens_epsg_{int(epsg)}.feather'
+
+    @staticmethod
+    def from_file( pathname, epsg, use_cache = True ):
+        '''
+        Load a garden list.  With use_cache, the normalized and projected table is kept
+        next to the list as Feather and reused until the list changes.
+        '''
+        if not os.path.exists( pathname ):
+            raise Exception( f'Garden list does not exist: {pathname}' )
+
+        cache_pathname = GardenRegistry.cache_path( pathname, epsg )
+        if use_cache:
+            garden_df = catalog.read_cache( pathname, cache_pathname )
+            if garden_df is not None:
+                return GardenRegistry( garden_df, epsg )
+
+        logging.debug( f'Parsing garden list {pathname}' )
+        garden_df = GardenRegistry.project( GardenRegistry.read_garden_list( pathname ), epsg )
+        if use_cache:
+            catalog.write_excel_cache( garden_df, pathname, cache_pathname )
+        return GardenRegistry( garden_df, epsg )
+
+    def position( self, key ):
+        '''
+        Row position of a garden by Garden ID or name, or None.
+        '''
+        pos = self.id_lookup.get( key )
+        if pos is None and isinstance( key, str ):
+            pos = self.name_lookup.get( key.casefold() )
+        return pos
+
+    def positions( self, keys ):
+        '''
+        Row positions of a list of Garden IDs or names, -1 where not found.
+        '''
+        output = [ self.position( x ) for x in keys ]
+        return np.array( [ -1 if x is None else x for x in output ], dtype = np.int64 )
+
+    def get( self, key ):
+        '''
+        Row of a garden by Garden ID or name, or None.  Replaces
+        garden_df.loc[garden_df['Name'] == name].
+        '''
+        pos = self.position( key )
+        if pos is None:
+            return None
+        return self.garden_df.iloc[pos]
+
+    def get_center( self, key ):
+        '''
+        [lon, lat] of a garden by Garden ID or name.
+        '''
+        pos = self.position( key )
+        if pos is None:
+            raise Exception( f'Garden not found: {key}' )
+        return [ float( self.garden_df['longitude'].iat[pos] ), float( self.garden_df['latitude'].iat[pos] ) ]
+
+    def _to_xy( self, points_ll ):
+        return crd.convert_coord_array( points_ll, 4326, self.epsg )
+
+    def nearest( self, point_ll, k = 1 ):
+        '''
+        The k gardens nearest a lon/lat point, closest first, with a distance column in
+        the units of epsg.
+        '''
+        k = min( k, len(self) )
+        dist, pos = self.tree.query( self._to_xy( point_ll )[0], k = k )
+        pos  = np.atleast_1d( pos )
+        dist = np.atleast_1d( dist )
+        return self.garden_df.iloc[pos].assign( distance = dist )
+
+    def nearest_positions( self, points_ll ):
+        '''
+        Row position of, and distance to, the nearest garden of each of an Nx2 array of
+        lon/lat points.
+        '''
+        dist, pos = self.tree.query( self._to_xy( points_ll ), k = 1 )
+        return pos, dist
+
+    def within( self, point_ll, radius ):
+        '''
+        Gardens within radius (in the units of epsg) of a lon/lat point, closest first,
+        with a distance column.
+        '''
+        xy  = self._to_xy( point_ll )[0]
+        pos = np.array( self.tree.query_ball_point( xy, radius ), dtype = np.int64 )
+        dist = np.hypot( self.xy[pos,0] - xy[0], self.xy[pos,1] - xy[1] )
+        order = np.argsort( dist, kind = 'stable' )
+        return self.garden_df.iloc[pos[order]].assign( distance = dist[order] )
+
+    def within_bounds( self, bounds ):
+        '''
+        Gardens inside bounds in epsg, in the form [corner1, corner2].
+        '''
+        min_x = min( bounds[0][0], bounds[1][0] )
+        min_y = min( bounds[0][1], bounds[1][1] )
+        max_x = max( bounds[0][0], bounds[1][0] )
+        max_y = max( bounds[0][1], bounds[1][1] )
+
+        mask = ( self.xy[:,0] >= min_x ) & ( self.xy[:,0] <= max_x ) & ( self.xy[:,1] >= min_y ) & ( self.xy[:,1] <= max_y )
+        return self.garden_df[mask]
@@ -2,61 +2,65 @@
 #
 #
 
-import datetime, logging, os, re
+import datetime, logging, os
 
-def create_path( base_dir, garden_id, date_str, file_type ):
+from .FrameIndex import FRAME_TYPES, FrameIndex
 
-    img_folder = 'geotiff'
-    filename = f'openet_{garden_id}_{date_str}'
+#  Frame indexes by ( base_dir, file_type ), see get_frame_index()
+_frame_indexes = {}
 
-    if file_type == 'zip':
-        filename = f'{filename}.zip'
-        img_folder = 'raw'
-    elif file_type == 'geotiff':
-        filename = f'{filename}.tif'
-        img_folder = 'geotiff'
-    else:
+def create_path( base_dir, garden_id, date_str, file_type ):
+
+    if file_type not in FRAME_TYPES:
         raise Exception( f'Unsupported file_type: {file_type}' )
-    
+
+    img_folder, ext = FRAME_TYPES[file_type]
+    filename = f'openet_{garden_id}_{date_str}{ext}'
+
     return os.path.join( base_dir, img_folder, filename )
 
+def get_frame_index( base_dir, file_type = 'geotiff' ):
+    '''
+    Frame index of base_dir, built on first use and refreshed (only re-listing changed
+    folders) on every later call.
+    '''
+    key = ( os.path.abspath( base_dir ), file_type )
+    if key not in _frame_indexes:
+        _frame_indexes[key] = FrameIndex( base_dir, file_type )
+    else:
+        _frame_indexes[key].refresh()
+    return _frame_indexes[key]
+
 def check_data_exists( base_dir, garden_id, date_start, num_days, file_type ):
 
     logger = logging.getLogger('OpenET')
-    
-    for x in range (0, num_days):
-
-        date = date_start + datetime.timedelta( days = x )
-        date_str = date.strftime('%Y%m%d')
-        
-        p = create_path( base_dir, garden_id, date_str, file_type )
-
-        if os.path.exists( p ):
-            logger.error( f'OpenET data exists for date: {date}' )
-            return True
-    
-    return False
 
-def get_frame_list( base_dir, garden_id ):
+    found = get_frame_index( base_dir, file_type ).exists( garden_id, date_start, num_days )
+    if found.any():
+        date = date_start + datetime.timedelta( days = int( found.argmax() ) )
+        logger.error( f'OpenET data exists for date: {date}' )
+        return True
 
-    #  Example path: openet_a211N000002Jm8Q_20230805.tif
-    pattern = 'openet_[a-zA-Z0-9]{15}_[0-9]{8}.tif'
-
-    output = []
-    
-    # Get list of files which meet the pattern
-    for (root, d, files) in os.walk( os.path.join( base_dir, 'geotiff' ) ):
-
-        # Check if matches pattern
-        for f in files:
-            if re.fullmatch( pattern, f ) is not None:
+    return False
 
-                parts = os.path.splitext( f )[0].split('_')
-                assert(len(parts) == 3)
+def get_frame_list( base_dir, garden_id, start_date = None, end_date = None ):
+    '''
+    Frames of a garden as a list of { 'path', 'date' }, sorted by date, optionally
+    within an (inclusive) date range.
+    '''
+    return get_frame_index( base_dir, 'geotiff' ).get_frames( garden_id, start_date, end_date )
 
-                if garden_id == parts[1]:
-                    output.append( { 'path': os.path.join( root, f ),
-                                     'date': datetime.datetime.strptime( parts[2], '%Y%m%d') } )
-                    
-    return output
-                    
+def aggregate_garden( base_dir, garden_id, center_ll, aggregator, start_date = None, end_date = None, output_dir = None ):
+    '''
+    Rolling-window ET summary of a garden's frames (see ETAggregator.aggregate()),
+    optionally within an (inclusive) date range.  With output_dir, the mean and sum
+    rasters of each window are written as openet_<garden_id>_<start>_<end>_{mean,sum}.tif.
+    '''
+    dates, paths = get_frame_index( base_dir, 'geotiff' ).query( garden_id, start_date, end_date )
+    return aggregator.aggregate( paths,
+                                 dates,
+                                 center_ll,
+                                 start_date = start_date,
+                                 end_date   = end_date,
+                                 output_dir = output_dir,
+                                 prefix     = f'openet_{garden_id}' )
@@ -0,0 +1,229 @@
+#    File:    ProductRegistry.py
+#
+#    Purpose: Single registry of every path we know about for a collection (raw bands,
+#             reprojected bands and derived products), backed by the SQLite catalog.
+#             Replaces reading a config.cfg in each collection folder.
+#
+
+import concurrent.futures, configparser, logging, os, re
+
+import dug_api.Database as Database
+from dug_api.CollectID import CollectID, FileType
+
+#  Keys follow the config.cfg convention, e.g. b4_path, b4_path_epsg_32613, ndvi_path_epsg_32613
+KEY_PATTERN = re.compile( r'(?P<product>.+)_path(?:_epsg_(?P<epsg>[0-9]+))?' )
+
+#  Raw band keys (lower case, as written by configparser) to collection table columns
+FILE_KEYS = { x.lower(): x for x in FileType.create_empty_dict() }
+
+#  SQLite limits the number of query parameters
+MAX_PARAMS = 500
+
+
+class ProductRegistry:
+    '''
+    Product paths of the collections in the SQLite catalog (see Database.open_catalog()).
+
+    Paths are addressed with the same keys the per-collection config.cfg files use.  Raw
+    band keys (b4_path) live in the files table, everything else, such as
+    b4_path_epsg_32613 or ndvi_path_epsg_32613, in the products table as a
+    (product, epsg) pair.
+    '''
+
+    def __init__( self, conn ):
+        self.conn = conn
+
+    @staticmethod
+    def parse_key( key ):
+        '''
+        Split a path key into its storage location.  Returns ( 'files', file_key, None ),
+        ( 'products', product, epsg ) or None if the key is not a path.
+        '''
+        key = key.lower()
+        if key in FILE_KEYS:
+            return ( 'files', FILE_KEYS[key], None )
+
+        m = KEY_PATTERN.fullmatch( key )
+        if m is None or key in Database.COLLECTION_COLUMNS:
+            return None
+        epsg = 0 if m.group('epsg') is None else int( m.group('epsg') )
+        return ( 'products', m.group('product'), epsg )
+
+    @staticmethod
+    def make_key( product, epsg = None ):
+        '''
+        Path key of a product, e.g. make_key( 'ndvi', 32613 ) -> ndvi_path_epsg_32613.
+        '''
+        if epsg is None or int(epsg) == 0:
+            return f'{product}_path'.lower()
+        return f'{product}_path_epsg_{int(epsg)}'.lower()
+
+    def _select( self, sql, cids ):
+
+        if cids is None:
+            return self.conn.execute( sql ).fetchall()
+
+        rows = []
+        cids = list( cids )
+        for x in range( 0, len(cids), MAX_PARAMS ):
+            chunk = cids[x:x+MAX_PARAMS]
+            rows += self.conn.execute( f'{sql} WHERE cid IN ( {", ".join( "?" * len(chunk) )} )', chunk ).fetchall()
+        return rows
+
+    def load( self, cids = None ):
+        '''
+        Bulk load the paths of all collections, or only of the given CIDs.  Returns a
+        dictionary of CID to a dictionary of path key to path.  This is two queries no
+        matter how many collections are loaded.
+        '''
+
+        output = {}
+        for cid, file_key, pathname in self._select( 'SELECT cid, file_key, pathname FROM files', cids ):
+            output.setdefault( cid, {} )[file_key.lower()] = pathname
+
+        for cid, product, epsg, pathname in self._select( 'SELECT cid, product, epsg, pathname FROM products', cids ):
+            output.setdefault( cid, {} )[ProductRegistry.make_key( product, epsg )] = pathname
+
+        return output
+
+    def get_paths( self, cid ):
+        '''
+        Paths of a single collection, or None if the registry has none.
+        '''
+        return self.load( [ cid ] ).get( cid )
+
+    def has_collection( self, cid ):
+        row = self.conn.execute( 'SELECT 1 FROM collections WHERE cid = ?', ( cid, ) ).fetchone()
+        return row is not None
+
+    def set_paths( self, updates ):
+        '''
+        Record paths for one or more collections in a single transaction, so a failure
+        leaves the registry unchanged.  updates is a dictionary of CID to a dictionary of
+        path key to path.  A path of None removes the key.  Keys which are not paths
+        are ignored.
+
+        The collections must already be in the catalog (see Database.upsert_collections()).
+        '''
+
+        upsert_files  = []
+        delete_files  = []
+        upsert_prods  = []
+        delete_prods  = []
+        for cid, paths in updates.items():
+            for key, pathname in paths.items():
+                parsed = ProductRegistry.parse_key( key )
+                if parsed is None:
+                    continue
+
+                table, name, epsg = parsed
+                if table == 'files':
+                    if pathname is None:
+                        delete_files.append( ( cid, name ) )
+                    else:
+                        upsert_files.append( ( cid, name, pathname ) )
+                elif pathname is None:
+                    delete_prods.append( ( cid, name, epsg ) )
+                else:
+                    upsert_prods.append( ( cid, name, epsg, pathname ) )
+
+        with self.conn:
+            self.conn.executemany( '''INSERT INTO files ( cid, file_key, pathname ) VALUES ( ?, ?, ? )
+                                      ON CONFLICT ( cid, file_key ) DO UPDATE SET pathname = excluded.pathname''',
+                                   upsert_files )
+            self.conn.executemany( 'DELETE FROM files WHERE cid = ? AND file_key = ?', delete_files )
+            self.conn.executemany( '''INSERT INTO products ( cid, product, epsg, pathname ) VALUES ( ?, ?, ?, ? )
+                                      ON CONFLICT ( cid, product, epsg ) DO UPDATE SET pathname = excluded.pathname,
+                                                                                        updated  = CURRENT_TIMESTAMP''',
+                                   upsert_prods )
+            self.conn.executemany( 'DELETE FROM products WHERE cid = ? AND product = ? AND epsg = ?', delete_prods )
+
+        return len(upsert_files) + len(upsert_prods) + len(delete_files) + len(delete_prods)
+
+    def set_path( self, cid, key, pathname ):
+        return self.set_paths( { cid: { key: pathname } } )
+
+    @staticmethod
+    def read_collection_config( pathname ):
+        '''
+        Read the [general] section of a collection folder's config.cfg.  Returns None if
+        the folder has no config.cfg.
+        '''
+        config_path = os.path.join( pathname, 'config.cfg' )
+        if not os.path.exists( config_path ):
+            return None
+
+        config = configparser.ConfigParser()
+        config.read( config_path )
+        if not config.has_section( 'general' ):
+            return {}
+        return dict( config['general'] )
+
+    def import_configs( self, collection_paths, num_workers = 8 ):
+        '''
+        Import the config.cfg files of a list of collection folders.  The files are read
+        on a thread pool, then the collections are upserted and all their paths are
+        written in one transaction.  Folders without a config.cfg are skipped.  Returns
+        the number of collections imported.
+        '''
+
+        collection_paths = [ x for x in collection_paths if CollectID.from_pathname( x ) is not None ]
+
+        #  Small-file reads on network storage are latency bound, so overlap them
+        with concurrent.futures.ThreadPoolExecutor( max_workers = max( 1, num_workers ) ) as executor:
+            configs = list( executor.map( ProductRegistry.read_collection_config, collection_paths ) )
+
+        found   = [ x for x, c in zip( collection_paths, configs ) if c is not None ]
+        updates = {}
+        for pathname, values in zip( collection_paths, configs ):
+            if values is not None:
+                updates[CollectID.from_pathname( pathname ).cid()] = values
+
+        logging.debug( f'Importing {len(found)} of {len(collection_paths)} collection configs into the registry' )
+        if len(found) == 0:
+            return 0
+
+        #  Collection rows come from the folder names, not the (stringified) config values
+        collection_df = CollectID.batch_to_dataframe( found )
+        Database.upsert_collections( self.conn, collection_df[[ x for x in Database.COLLECTION_COLUMNS if x in collection_df ]] )
+        self.set_paths( updates )
+
+        return len(found)
+
+    def export_config( self, cid, pathname = None ):
+        '''
+        Write a config.cfg for a collection from the registry, for tools which still read
+        the per-folder files.  Defaults to the collection folder.  Returns the config.
+        '''
+
+        cursor = self.conn.execute( f'SELECT {", ".join( Database.COLLECTION_COLUMNS )} FROM collections WHERE cid = ?', ( cid, ) )
+        row = cursor.fetchone()
+        if row is None:
+            raise Exception( f'CID ({cid}) not in the product registry.' )
+
+        config = configparser.ConfigParser()
+        config['general'] = {}
+        for col, value in zip( Database.COLLECTION_COLUMNS, row ):
+            if value is not None:
+                config['general'][col] = str(value)
+
+        for key, path in sorted( ( self.get_paths( cid ) or {} ).items() ):
+            config['general'][key] = path
+
+        if pathname is None:
+            pathname = os.path.join( config['general']['pathname'], 'config.cfg' )
+
+        logging.debug( f'Exporting CID ({cid}) registry paths to {pathname}' )
+        with open( pathname, 'w' ) as configfile:
+            config.write( configfile )
+        return config
+
+    def export_configs( self, cids = None ):
+        '''
+        Write the config.cfg of every collection in the registry, or only of the given CIDs.
+        '''
+        if cids is None:
+            cids = [ x[0] for x in self.conn.execute( 'SELECT cid FROM collections' ).fetchall() ]
+        for cid in cids:
+            self.export_config( cid )
+        return len(cids)
@@ -0,0 +1,253 @@
+#    File:    QualityIndex.py
+#
+#    Purpose: Scene-quality index built from each collection's MTL file (cloud cover,
+#             sun angles, thermal constants and scene corners), backed by the SQLite
+#             catalog.  Lets the pipeline reject cloudy scenes before any raster I/O.
+#
+
+import concurrent.futures, logging, os
+
+import numpy as np
+import pandas as pd
+
+import dug_api.Database as Database
+from dug_api import landsat_utilities as lsu
+from dug_api.ProductRegistry import MAX_PARAMS
+
+#  Index columns to MTL keys.  The first key found is used, so Landsat 8/9 thermal
+#  bands 10 and 11 fall back to band 6 (Landsat 7 VCID 1 and 2, then Landsat 4/5).
+QUALITY_KEYS = { 'cloud_cover':        [ 'CLOUD_COVER' ],
+                 'cloud_cover_land':   [ 'CLOUD_COVER_LAND' ],
+                 'sun_elevation':      [ 'SUN_ELEVATION' ],
+                 'sun_azimuth':        [ 'SUN_AZIMUTH' ],
+                 'earth_sun_distance': [ 'EARTH_SUN_DISTANCE' ],
+                 'radiance_mult_b10':  [ 'RADIANCE_MULT_BAND_10', 'RADIANCE_MULT_BAND_6_VCID_1', 'RADIANCE_MULT_BAND_6' ],
+                 'radiance_add_b10':   [ 'RADIANCE_ADD_BAND_10',  'RADIANCE_ADD_BAND_6_VCID_1',  'RADIANCE_ADD_BAND_6' ],
+                 'radiance_mult_b11':  [ 'RADIANCE_MULT_BAND_11', 'RADIANCE_MULT_BAND_6_VCID_2' ],
+                 'radiance_add_b11':   [ 'RADIANCE_ADD_BAND_11',  'RADIANCE_ADD_BAND_6_VCID_2' ],
+                 'k1_b10':             [ 'K1_CONSTANT_BAND_10', 'K1_CONSTANT_BAND_6_VCID_1', 'K1_CONSTANT_BAND_6' ],
+                 'k2_b10':             [ 'K2_CONSTANT_BAND_10', 'K2_CONSTANT_BAND_6_VCID_1', 'K2_CONSTANT_BAND_6' ],
+                 'k1_b11':             [ 'K1_CONSTANT_BAND_11', 'K1_CONSTANT_BAND_6_VCID_2' ],
+                 'k2_b11':             [ 'K2_CONSTANT_BAND_11', 'K2_CONSTANT_BAND_6_VCID_2' ],
+                 'corner_ul_lat':      [ 'CORNER_UL_LAT_PRODUCT' ],
+                 'corner_ul_lon':      [ 'CORNER_UL_LON_PRODUCT' ],
+                 'corner_ur_lat':      [ 'CORNER_UR_LAT_PRODUCT' ],
+                 'corner_ur_lon':      [ 'CORNER_UR_LON_PRODUCT' ],
+                 'corner_ll_lat':      [ 'CORNER_LL_LAT_PRODUCT' ],
+                 'corner_ll_lon':      [ 'CORNER_LL_LON_PRODUCT' ],
+                 'corner_lr_lat':      [ 'CORNER_LR_LAT_PRODUCT' ],
+                 'corner_lr_lon':      [ 'CORNER_LR_LON_PRODUCT' ] }
+
+QUALITY_COLUMNS = [ 'cid', 'mtl_path', 'mtl_source' ] + list( QUALITY_KEYS.keys() )
+
+def _get_limits( max_cloud_cover, max_cloud_cover_land, min_sun_elevation ):
+    '''
+    ( column, limit, is_max ) of each quality limit which is set.
+    '''
+    limits = [ ( 'cloud_cover',      max_cloud_cover,      True ),
+               ( 'cloud_cover_land', max_cloud_cover_land, True ),
+               ( 'sun_elevation',    min_sun_elevation,    False ) ]
+    return [ x for x in limits if x[1] is not None ]
+
+def _flatten_mtl( MTL, values = None ):
+    '''
+    Entries of a parsed MTL by name, walking the groups in file order.  As in
+    landsat_utilities.parse_metadata_table(), the last value of a repeated name wins.
+    '''
+    if values is None:
+        values = {}
+    for key, value in MTL.items():
+        if isinstance( value, dict ):
+            _flatten_mtl( value, values )
+        else:
+            values[key] = value
+    return values
+
+
+class QualityIndex:
+    '''
+    Scene quality of the collections in the SQLite catalog (see Database.open_catalog()).
+
+    Each row is read from the collection's MTL file with
+    landsat_utilities.load_metadata_table(), and tagged with the MTL file's mtime and
+    size so update() only re-reads scenes whose MTL changed.
+    '''
+
+    def __init__( self, conn ):
+        self.conn = conn
+
+    @staticmethod
+    def find_mtl( pathname ):
+        '''
+        Path of the MTL file in a collection folder, or None.
+        '''
+        try:
+            with os.scandir( pathname ) as entries:
+                names = sorted( x.name for x in entries if x.name.endswith( '_MTL.txt' ) )
+        except OSError:
+            return None
+        if len(names) == 0:
+            return None
+        return os.path.join( pathname, names[0] )
+
+    @staticmethod
+    def read_quality( cid, pathname, known_source = None, use_cache = False ):
+        '''
+        Index row of a collection folder, from its MTL file.  Returns None if the folder
+        has no MTL file, or if its MTL still matches known_source.
+        '''
+
+        mtl_path = QualityIndex.find_mtl( pathname )
+        if mtl_path is None:
+            logging.debug( f'No MTL file in {pathname}' )
+            return None
+
+        st = os.stat( mtl_path )
+        source = f'{st.st_mtime_ns}:{st.st_size}'
+        if source == known_source:
+            return None
+
+        keys = [ key for names in QUALITY_KEYS.values() for key in names ]
+        values = _flatten_mtl( lsu.load_metadata_table( mtl_path, keys = keys, use_cache = use_cache ) )
+
+        row = { 'cid': cid, 'mtl_path': mtl_path, 'mtl_source': source }
+        for col, names in QUALITY_KEYS.items():
+            row[col] = next( ( float( values[x] ) for x in names if x in values ), None )
+        return row
+
+    def update( self, collection_df, num_workers = 8, force = False, use_cache = False ):
+        '''
+        Index the collections of a collection table (see CollectID.list_to_dataframes()).
+        MTL files are read on a thread pool, skipping those unchanged since the last
+        update unless force is set, and written in one transaction.  Returns the number
+        of scenes (re)indexed.
+        '''
+
+        known = {}
+        if not force:
+            known = dict( self.conn.execute( 'SELECT cid, mtl_source FROM scene_quality' ).fetchall() )
+
+        cids      = collection_df['cid'].tolist()
+        pathnames = collection_df['pathname'].tolist()
+        with concurrent.futures.ThreadPoolExecutor( max_workers = max( 1, num_workers ) ) as executor:
+            rows = list( executor.map( lambda x: QualityIndex.read_quality( x[0], x[1], known.get( x[0] ), use_cache ),
+                                       zip( cids, pathnames ) ) )
+        rows = [ x for x in rows if x is not None ]
+
+        logging.debug( f'Indexing the MTL of {len(rows)} of {len(cids)} collections' )
+        if len(rows) == 0:
+            return 0
+
+        #  Quality rows reference the collections table
+        updated = { x['cid'] for x in rows }
+        columns = [ x for x in Database.COLLECTION_COLUMNS if x in collection_df ]
+        Database.upsert_collections( self.conn, collection_df.loc[collection_df['cid'].isin( updated ), columns] )
+
+        updates = ', '.join( f'{x} = excluded.{x}' for x in QUALITY_COLUMNS if x != 'cid' )
+        sql = f'''INSERT INTO scene_quality ( {', '.join( QUALITY_COLUMNS )} )
+                  VALUES ( {', '.join( '?' * len(QUALITY_COLUMNS) )} )
+                  ON CONFLICT ( cid ) DO UPDATE SET {updates}'''
+        with self.conn:
+            self.conn.executemany( sql, [ tuple( x[c] for c in QUALITY_COLUMNS ) for x in rows ] )
+
+        return len(rows)
+
+    def load( self, cids = None ):
+        '''
+        Load the index, optionally for a list of CIDs only.
+        '''
+        sql = f'SELECT {", ".join( QUALITY_COLUMNS )} FROM scene_quality'
+        if cids is None:
+            return pd.read_sql_query( sql, self.conn )
+
+        cids = list( cids )
+        output = []
+        for x in range( 0, len(cids), MAX_PARAMS ):
+            chunk = cids[x:x+MAX_PARAMS]
+            output.append( pd.read_sql_query( f'{sql} WHERE cid IN ( {", ".join( "?" * len(chunk) )} )', self.conn, params = chunk ) )
+        if len(output) == 0:
+            return pd.read_sql_query( f'{sql} LIMIT 0', self.conn )
+        return pd.concat( output, ignore_index = True )
+
+    @staticmethod
+    def get_mask( quality_df,
+                  max_cloud_cover      = None,
+                  max_cloud_cover_land = None,
+                  min_sun_elevation    = None ):
+        '''
+        Boolean mask of the rows of quality_df within the limits.  Scenes missing a value
+        pass that limit.
+        '''
+        mask = np.ones( quality_df.shape[0], dtype = bool )
+        for col, limit, is_max in _get_limits( max_cloud_cover, max_cloud_cover_land, min_sun_elevation ):
+            values = quality_df[col].to_numpy( dtype = np.float64, na_value = np.nan )
+            with np.errstate( invalid = 'ignore' ):
+                passed = values <= limit if is_max else values >= limit
+            mask &= passed | np.isnan( values )
+        return mask
+
+    def filter( self,
+                collection_df,
+                max_cloud_cover      = None,
+                max_cloud_cover_land = None,
+                min_sun_elevation    = None,
+                keep_unknown         = True ):
+        '''
+        Rows of a collection table whose scenes are within the quality limits.  Scenes
+        not in the index are kept, unless keep_unknown is False.
+        '''
+
+        quality_df = self.load( collection_df['cid'].unique() )
+        passed = QualityIndex.get_mask( quality_df, max_cloud_cover, max_cloud_cover_land, min_sun_elevation )
+
+        known = collection_df['cid'].isin( quality_df['cid'] )
+        keep  = collection_df['cid'].isin( quality_df['cid'][passed] )
+        if keep_unknown:
+            keep |= ~known
+        return collection_df[keep.to_numpy()]
+
+    def check( self,
+               cid,
+               max_cloud_cover      = None,
+               max_cloud_cover_land = None,
+               min_sun_elevation    = None ):
+        '''
+        Whether a single scene is within the quality limits.  Returns True/False and the
+        reason it failed (or None).  Scenes not in the index pass.
+        '''
+        quality_df = self.load( [ cid ] )
+        if quality_df.shape[0] == 0:
+            return True, None
+
+        row = quality_df.iloc[0]
+        for col, limit, is_max in _get_limits( max_cloud_cover, max_cloud_cover_land, min_sun_elevation ):
+            if pd.isna( row[col] ):
+                continue
+            if ( is_max and row[col] > limit ) or ( not is_max and row[col] < limit ):
+                return False, f'{col} {row[col]} is {"above" if is_max else "below"} {limit}'
+        return True, None
+
+    def footprints( self ):
+        '''
+        Lon/lat bounds of every tile, from the scene corners, in the form SceneIndex
+        takes ({ ( 'wrs2', path, row ): [ [min_lon, min_lat], [max_lon, max_lat] ] }).
+        '''
+        sql = '''SELECT c.wrs2_path, c.wrs2_row, c.ard_col, c.ard_row,
+                        MIN( MIN( q.corner_ul_lon, q.corner_ur_lon, q.corner_ll_lon, q.corner_lr_lon ) ),
+                        MIN( MIN( q.corner_ul_lat, q.corner_ur_lat, q.corner_ll_lat, q.corner_lr_lat ) ),
+                        MAX( MAX( q.corner_ul_lon, q.corner_ur_lon, q.corner_ll_lon, q.corner_lr_lon ) ),
+                        MAX( MAX( q.corner_ul_lat, q.corner_ur_lat, q.corner_ll_lat, q.corner_lr_lat ) )
+                 FROM scene_quality q JOIN collections c ON c.cid = q.cid
+                 WHERE q.corner_ul_lon IS NOT NULL
+                 GROUP BY c.wrs2_path, c.wrs2_row, c.ard_col, c.ard_row'''
+
+        output = {}
+        for path, row, ard_col, ard_row, min_x, min_y, max_x, max_y in self.conn.execute( sql ):
+            if ard_col is not None:
+                key = ( 'ard', int(ard_col), int(ard_row) )
+            elif path is not None:
+                key = ( 'wrs2', int(path), int(row) )
+            else:
+                continue
+            output[key] = [ [ min_x, min_y ], [ max_x, max_y ] ]
+        return output
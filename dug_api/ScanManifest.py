@@ -0,0 +1,146 @@
+#    File:    ScanManifest.py
+#
+#    Purpose: Persisted record of the collection folders we have already scanned, so a
+#             rescan only has to descend into folders which changed.
+#
+
+import json, logging, os
+
+from dug_api.CollectID import CollectID
+
+
+class ScanManifest:
+    '''
+    Tracks directory mtimes, plus file sizes, inodes and mtimes, for every collection
+    folder under the image collection path.
+
+    A collection folder is only listed again if its mtime (or the mtime of one of its
+    sub-folders) changed.  Adding, removing or renaming files updates the folder mtime,
+    but rewriting a file in place does not; use rescan( full = True ) to catch those.
+    '''
+
+    VERSION = 1
+
+    def __init__( self, pathname ):
+
+        self.pathname = pathname
+        self.folders  = {}
+
+        if os.path.exists( pathname ):
+            with open( pathname, 'r' ) as fin:
+                data = json.load( fin )
+            if data.get( 'version' ) == ScanManifest.VERSION:
+                self.folders = data['folders']
+            else:
+                logging.warning( f'Ignoring scan manifest with unsupported version: {pathname}' )
+
+    def save( self ):
+
+        #  Write to a temporary file first so an interrupted save can't corrupt the manifest
+        tmp_path = f'{self.pathname}.tmp'
+        with open( tmp_path, 'w' ) as fout:
+            json.dump( { 'version': ScanManifest.VERSION,
+                         'folders': self.folders }, fout )
+        os.replace( tmp_path, self.pathname )
+
+    @staticmethod
+    def snapshot_folder( pathname ):
+        '''
+        Stat a collection folder.  Returns the mtimes of the folder and its sub-folders
+        and the (size, inode, mtime) of every file, keyed by path relative to the folder.
+        '''
+
+        dirs  = {}
+        files = {}
+
+        pending = [ '' ]
+        while len(pending) > 0:
+            rel_dir = pending.pop()
+            abs_dir = os.path.join( pathname, rel_dir )
+            try:
+                dirs[rel_dir] = os.stat( abs_dir ).st_mtime_ns
+                entries = os.scandir( abs_dir )
+            except OSError:
+                continue
+
+            with entries:
+                for entry in entries:
+                    rel_path = os.path.join( rel_dir, entry.name )
+                    try:
+                        if entry.is_dir( follow_symlinks = False ):
+                            pending.append( rel_path )
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files[rel_path] = [ st.st_size, st.st_ino, st.st_mtime_ns ]
+
+        return { 'dirs': dirs, 'files': files }
+
+    def _folder_changed( self, pathname ):
+        '''
+        Cheap check against the recorded directory mtimes.  Only stats the folders.
+        '''
+
+        record = self.folders.get( pathname )
+        if record is None:
+            return True
+
+        for rel_dir, mtime in record['dirs'].items():
+            try:
+                if os.stat( os.path.join( pathname, rel_dir ) ).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def rescan( self, collection_dir, full = False, num_workers = 8 ):
+        '''
+        Compare the collection folders under collection_dir against the manifest and
+        update it.
+
+        Returns a dictionary with the 'added', 'removed' and 'modified' CID folder paths,
+        plus a 'table' with the list_to_dataframes() rows of the added and modified
+        collections, ready for Configuration.update_table().  Call save() to persist, or
+        use Configuration.rescan_collections(), which also applies the changes to the
+        collection table.
+        '''
+
+        #  Single listing of the top-level folder
+        current = []
+        with os.scandir( collection_dir ) as entries:
+            for entry in entries:
+                if entry.is_dir() and CollectID.from_pathname( entry.path ) is not None:
+                    current.append( entry.path )
+        current.sort()
+
+        current_set = set( current )
+        removed = sorted( x for x in self.folders if x not in current_set )
+        for pathname in removed:
+            del self.folders[pathname]
+
+        added    = []
+        modified = []
+        for pathname in current:
+
+            if not full and not self._folder_changed( pathname ):
+                continue
+
+            snapshot = ScanManifest.snapshot_folder( pathname )
+            previous = self.folders.get( pathname )
+            self.folders[pathname] = snapshot
+
+            if previous is None:
+                added.append( pathname )
+            elif previous['files'] != snapshot['files']:
+                modified.append( pathname )
+
+        logging.debug( f'Rescan of {collection_dir}: {len(added)} added, {len(removed)} removed, {len(modified)} modified.' )
+
+        changed = [ CollectID.from_pathname( x ) for x in added + modified ]
+        table = CollectID.list_to_dataframes( changed, num_workers = num_workers )
+
+        return { 'added':    added,
+                 'removed':  removed,
+                 'modified': modified,
+                 'table':    table }
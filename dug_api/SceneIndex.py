@@ -0,0 +1,170 @@
+#    File:    SceneIndex.py
+#
+#    Purpose: In-memory index over the collection table, so repeated lookups by CID,
+#             tile and date range don't have to scan the whole DataFrame.
+#
+
+import numpy as np
+import pandas as pd
+
+
+class SceneIndex:
+    '''
+    Index over a collection table (see CollectID.list_to_dataframes()).
+
+    Scenes are grouped by tile, either ('wrs2', path, row) or ('ard', col, row), and each
+    tile holds its acquisition dates in sorted order.  Date range queries are a binary
+    search within a tile.  Tile footprints (lon/lat bounds) can be registered to find
+    the tiles covering a location.
+    '''
+
+    def __init__( self, collection_df, footprints = None ):
+
+        self.collection_df = collection_df.reset_index( drop = True )
+        df = self.collection_df
+
+        #  CID to row position
+        self.cid_lookup = { cid: pos for pos, cid in enumerate( df['cid'] ) }
+
+        self.dates  = pd.to_datetime( df['acquisition_date'] ).to_numpy( dtype = 'datetime64[D]' )
+        self.levels = df['processing_level'].astype( str ).to_numpy()
+
+        def as_float( col ):
+            return pd.to_numeric( df[col] ).astype( 'float64' ).to_numpy( na_value = np.nan )
+
+        is_ard = df['ard_col'].notna().to_numpy()
+        col_a  = np.where( is_ard, as_float( 'ard_col' ), as_float( 'wrs2_path' ) )
+        col_b  = np.where( is_ard, as_float( 'ard_row' ), as_float( 'wrs2_row' ) )
+
+        #  Group rows by tile, ordered by date within each tile
+        self.tiles = {}
+        tile_df = pd.DataFrame( { 'is_ard': is_ard, 'a': col_a, 'b': col_b } )
+        for ( ard, a, b ), group in tile_df.groupby( [ 'is_ard', 'a', 'b' ], dropna = True ).groups.items():
+            positions = np.asarray( group )
+            positions = positions[np.argsort( self.dates[positions], kind = 'stable' )]
+            key = ( 'ard' if ard else 'wrs2', int(a), int(b) )
+            self.tiles[key] = ( self.dates[positions], positions )
+
+        self.footprint_keys   = []
+        self.footprint_bounds = np.zeros( ( 0, 4 ) )
+        if footprints is not None:
+            for key, bounds in footprints.items():
+                self.set_footprint( key, bounds )
+
+    def __len__( self ):
+        return self.collection_df.shape[0]
+
+    def tile_keys( self ):
+        return list( self.tiles.keys() )
+
+    def position( self, cid ):
+        '''
+        Row position of a CID in collection_df, or None.
+        '''
+        return self.cid_lookup.get( cid )
+
+    def get( self, cid ):
+        '''
+        Row of the collection table for a CID, or None.  Replaces
+        collection_df.loc[collection_df['cid'] == cid].
+        '''
+        pos = self.cid_lookup.get( cid )
+        if pos is None:
+            return None
+        return self.collection_df.iloc[pos]
+
+    def query_positions( self,
+                         wrs2             = None,
+                         ard              = None,
+                         start_date       = None,
+                         end_date         = None,
+                         processing_level = None ):
+        '''
+        Row positions of the scenes over a tile within an (inclusive) date range.
+
+        wrs2 is a (path, row) pair, ard a (col, row) pair.  If neither is given,
+        every tile is searched.  Results are sorted by tile, then date.
+        '''
+
+        if wrs2 is not None:
+            keys = [ ( 'wrs2', int(wrs2[0]), int(wrs2[1]) ) ]
+        elif ard is not None:
+            keys = [ ( 'ard', int(ard[0]), int(ard[1]) ) ]
+        else:
+            keys = self.tiles.keys()
+
+        return self._query_keys( keys, start_date, end_date, processing_level )
+
+    def _query_keys( self, keys, start_date, end_date, processing_level ):
+
+        start = None if start_date is None else np.datetime64( pd.Timestamp( start_date ).date(), 'D' )
+        end   = None if end_date   is None else np.datetime64( pd.Timestamp( end_date ).date(), 'D' )
+
+        output = []
+        for key in keys:
+            if key not in self.tiles:
+                continue
+            dates, positions = self.tiles[key]
+            lo = 0 if start is None else np.searchsorted( dates, start, side = 'left' )
+            hi = len(dates) if end is None else np.searchsorted( dates, end, side = 'right' )
+            output.append( positions[lo:hi] )
+
+        if len(output) == 0:
+            return np.zeros( 0, dtype = np.int64 )
+        result = np.concatenate( output )
+
+        if processing_level is not None:
+            levels = [ processing_level ] if isinstance( processing_level, str ) else list( processing_level )
+            result = result[np.isin( self.levels[result], levels )]
+        return result
+
+    def query( self, **kwargs ):
+        '''
+        Same as query_positions(), but returns the rows of the collection table.
+        '''
+        return self.collection_df.iloc[self.query_positions( **kwargs )]
+
+    def set_footprint( self, key, bounds ):
+        '''
+        Register the footprint of a tile as lon/lat bounds, in the form
+        [corner1, corner2] or [[x1,y1],[x2,y2]].
+        '''
+        row = [ min( bounds[0][0], bounds[1][0] ), min( bounds[0][1], bounds[1][1] ),
+                max( bounds[0][0], bounds[1][0] ), max( bounds[0][1], bounds[1][1] ) ]
+
+        if key in self.footprint_keys:
+            self.footprint_bounds[self.footprint_keys.index( key )] = row
+        else:
+            self.footprint_keys.append( key )
+            self.footprint_bounds = np.vstack( [ self.footprint_bounds, row ] )
+
+    def intersecting_tiles( self, bounds ):
+        '''
+        Tiles whose footprint intersects the lon/lat bounds.  A single (lon, lat)
+        point is also accepted.
+        '''
+        if np.ndim( bounds ) == 1:
+            bounds = [ bounds, bounds ]
+        min_x = min( bounds[0][0], bounds[1][0] )
+        min_y = min( bounds[0][1], bounds[1][1] )
+        max_x = max( bounds[0][0], bounds[1][0] )
+        max_y = max( bounds[0][1], bounds[1][1] )
+
+        fp = self.footprint_bounds
+        hits = ( fp[:,0] <= max_x ) & ( fp[:,2] >= min_x ) & ( fp[:,1] <= max_y ) & ( fp[:,3] >= min_y )
+        return [ self.footprint_keys[x] for x in np.flatnonzero( hits ) ]
+
+    def query_intersecting( self,
+                            bounds,
+                            start_date       = None,
+                            end_date         = None,
+                            processing_level = None ):
+        '''
+        Rows of the scenes whose tile footprint intersects the lon/lat bounds (or point),
+        for example a garden location.
+        '''
+        positions = self._query_keys( self.intersecting_tiles( bounds ),
+                                      start_date,
+                                      end_date,
+                                      processing_level )
+        return self.collection_df.iloc[positions]
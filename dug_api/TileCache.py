@@ -0,0 +1,220 @@
+#    File:    TileCache.py
+#
+#    Purpose: Memory-bounded LRU cache of warped image tiles, with an optional on-disk
+#             second tier, so re-rendering a figure doesn't redo the warp.
+#
+
+import collections, hashlib, logging, os, tempfile, threading
+
+import numpy as np
+
+#  The disk tier is re-listed once its running size estimate passes max_disk_bytes, or
+#  every DISK_SCAN_INTERVAL writes to pick up tiles written by other processes.  A trim
+#  goes down to DISK_TRIM_FRACTION of the limit, so the next few writes don't trim again.
+DISK_SCAN_INTERVAL = 256
+DISK_TRIM_FRACTION = 0.9
+
+class TileCache:
+    '''
+    LRU cache of tile arrays, capped at max_bytes of array data.
+
+    Keys are built with make_key() from the source path and modification time plus
+    the warp parameters, so a rewritten source image is never served stale.  If
+    disk_path is set, every new tile is also written there as a .npy file, and the
+    directory is trimmed to max_disk_bytes, least recently used first.  The directory
+    may be shared between processes; a tile another process removed is simply a miss.
+
+    Cached arrays are returned read-only, since every caller shares the same array.
+    Copy before modifying in place (see imagery.get_cached_tile()).
+    '''
+
+    def __init__( self, max_bytes = 512 * 1024 * 1024, disk_path = None, max_disk_bytes = 4 * 1024 * 1024 * 1024 ):
+
+        self.max_bytes      = max_bytes
+        self.disk_path      = disk_path
+        self.max_disk_bytes = max_disk_bytes
+
+        self.entries     = collections.OrderedDict()
+        self.num_bytes   = 0
+        self.hits        = 0
+        self.disk_hits   = 0
+        self.misses      = 0
+        self.evictions   = 0
+        self.lock        = threading.Lock()
+
+        #  Running estimate of the disk tier size, None until it is first listed
+        self.disk_bytes  = None
+        self.disk_writes = 0
+
+        if disk_path is not None:
+            os.makedirs( disk_path, exist_ok = True )
+
+    @staticmethod
+    def make_key( pathname, epsg, center, window_size, gsd, resampling ):
+        '''
+        Cache key for a tile of pathname.  Returns None if the path can't be stat'ed
+        (e.g. an in-memory dataset), in which case the tile is not cached.
+        '''
+        try:
+            mtime = os.stat( pathname ).st_mtime_ns
+        except ( OSError, TypeError, ValueError ):
+            return None
+
+        return ( os.path.abspath( pathname ),
+                 mtime,
+                 str(epsg),
+                 tuple( float(x) for x in center ),
+                 tuple( int(x) for x in window_size ),
+                 float(gsd),
+                 str(resampling) )
+
+    def stats( self ):
+        return { 'entries':   len(self.entries),
+                 'bytes':     self.num_bytes,
+                 'hits':      self.hits,
+                 'disk_hits': self.disk_hits,
+                 'misses':    self.misses,
+                 'evictions': self.evictions }
+
+    def clear( self ):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def _disk_file( self, key ):
+        digest = hashlib.sha1( repr(key).encode() ).hexdigest()
+        return os.path.join( self.disk_path, f'{digest}.npy' )
+
+    def get( self, key ):
+        '''
+        Cached tile for key, or None.
+        '''
+        if key is None:
+            return None
+
+        with self.lock:
+            tile = self.entries.get( key )
+            if tile is not None:
+                self.entries.move_to_end( key )
+                self.hits += 1
+                return tile
+
+        if self.disk_path is not None:
+            pathname = self._disk_file( key )
+            if os.path.exists( pathname ):
+                try:
+                    tile = np.load( pathname, allow_pickle = False )
+                except ( OSError, ValueError ) as e:
+                    #  Includes tiles removed by another process's trim since the check
+                    logging.debug( f'Ignoring unreadable tile {pathname}: {e}' )
+                else:
+                    #  Touch it so the disk tier evicts least recently used first
+                    try:
+                        os.utime( pathname )
+                    except OSError:
+                        pass
+                    with self.lock:
+                        self.disk_hits += 1
+                    self._put_memory( key, tile )
+                    return tile
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put( self, key, tile ):
+        '''
+        Store a tile.  Returns the (read-only) cached array.
+        '''
+        if key is None:
+            return tile
+
+        tile = np.ascontiguousarray( tile )
+        tile.setflags( write = False )
+        self._put_memory( key, tile )
+
+        if self.disk_path is not None:
+            self._put_disk( key, tile )
+        return tile
+
+    def _put_memory( self, key, tile ):
+
+        tile.setflags( write = False )
+        if tile.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.num_bytes -= self.entries.pop( key ).nbytes
+            self.entries[key] = tile
+            self.num_bytes += tile.nbytes
+
+            while self.num_bytes > self.max_bytes:
+                _, old = self.entries.popitem( last = False )
+                self.num_bytes -= old.nbytes
+                self.evictions += 1
+
+    def _put_disk( self, key, tile ):
+
+        #  A unique temporary name, so threads and processes sharing the directory never
+        #  write the same file
+        pathname = self._disk_file( key )
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile( dir = self.disk_path, suffix = '.tmp', delete = False ) as fout:
+                tmp_path = fout.name
+                np.save( fout, tile, allow_pickle = False )
+                size = fout.tell()
+            os.replace( tmp_path, pathname )
+        except OSError as e:
+            logging.debug( f'Unable to write tile {pathname}: {e}' )
+            if tmp_path is not None and os.path.exists( tmp_path ):
+                os.remove( tmp_path )
+            return
+
+        with self.lock:
+            self.disk_writes += 1
+            if self.disk_bytes is not None:
+                self.disk_bytes += size
+            rescan = ( self.disk_bytes is None or
+                       self.disk_bytes > self.max_disk_bytes or
+                       self.disk_writes % DISK_SCAN_INTERVAL == 0 )
+        if rescan:
+            self._trim_disk()
+
+    def _trim_disk( self ):
+        '''
+        List the disk tier and, if it is over max_disk_bytes, remove the least recently
+        used tiles down to DISK_TRIM_FRACTION of it.  Resets the running size estimate.
+        '''
+
+        files = []
+        total = 0
+        with os.scandir( self.disk_path ) as entries:
+            for entry in entries:
+                if not entry.name.endswith( '.npy' ):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    #  Removed by another process since the listing
+                    continue
+                files.append( ( st.st_mtime_ns, st.st_size, entry.path ) )
+                total += st.st_size
+
+        if total > self.max_disk_bytes:
+            target = self.max_disk_bytes * DISK_TRIM_FRACTION
+            files.sort()
+            for mtime, size, pathname in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove( pathname )
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                total -= size
+
+        with self.lock:
+            self.disk_bytes = total
@@ -0,0 +1,301 @@
+#    File:    WMSFetcher.py
+#
+#    Purpose: Fetch many WMS GetMap tiles concurrently over pooled keep-alive
+#             connections, with a per-host concurrency cap, a token-bucket rate limit
+#             and retries with exponential backoff.
+#
+
+import collections, concurrent.futures, http.client, logging, random, threading, time, urllib.parse
+
+import numpy as np
+
+from . import wms
+
+#  Responses worth retrying, everything else fails straight away
+RETRY_STATUS = [ 429, 500, 502, 503, 504 ]
+
+#  Timing of one request, attempts includes the retries
+RequestTiming = collections.namedtuple( 'RequestTiming', [ 'url', 'status', 'attempts', 'num_bytes', 'seconds' ] )
+
+
+class TokenBucket:
+    '''
+    Token-bucket rate limiter: rate tokens per second, up to burst at once.
+    '''
+
+    def __init__( self, rate, burst = 1 ):
+        self.rate   = float(rate)
+        self.burst  = max( 1.0, float(burst) )
+        self.tokens = self.burst
+        self.last   = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def acquire( self ):
+        '''
+        Take a token, waiting until one is available.
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min( self.burst, self.tokens + ( now - self.last ) * self.rate )
+                self.last   = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = ( 1.0 - self.tokens ) / self.rate
+            time.sleep( wait )
+
+
+class WMSFetcher:
+    '''
+    Batch fetcher for wms.WMS requests.
+
+    Requests run on a pool of max_workers threads.  Each thread keeps one HTTP/1.1
+    connection per host open between requests, so a batch against one server pays for
+    the connection (and TLS) setup once per thread rather than once per tile.  At most
+    max_per_host requests are in flight to a host, and if rate is set, requests to a
+    host start at no more than rate per second (with bursts of up to burst).
+
+    Failed connections and 429/5xx responses are retried up to max_retries times,
+    waiting backoff * 2^attempt seconds (with jitter, or the server's Retry-After).
+
+    If a cache (TileCache) is given, tiles already in it are not fetched and new tiles
+    are added.  In offline mode, tiles missing from the cache raise.
+
+    The thread pool, and so the connections, live until close() (or the end of a with
+    block), so they're reused across batches.
+    '''
+
+    def __init__( self,
+                  max_workers  = 8,
+                  max_per_host = 4,
+                  rate         = None,
+                  burst        = None,
+                  max_retries  = 4,
+                  backoff      = 0.5,
+                  timeout      = 60.0,
+                  cache        = None,
+                  offline      = False ):
+
+        self.max_workers  = max( 1, max_workers )
+        self.max_per_host = max( 1, max_per_host )
+        self.rate         = rate
+        self.burst        = burst
+        self.max_retries  = max_retries
+        self.backoff      = backoff
+        self.timeout      = timeout
+        self.cache        = cache
+        self.offline      = offline
+
+        self.lock        = threading.Lock()
+        self.local       = threading.local()
+        self.host_slots  = {}
+        self.buckets     = {}
+        self.timings     = []
+        self.connections = []
+        self.executor    = None
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def close( self ):
+        '''
+        Stop the thread pool and close every pooled connection.
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+    def _get_host_limits( self, host ):
+
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore( self.max_per_host )
+                if self.rate is not None:
+                    self.buckets[host] = TokenBucket( self.rate, self.max_per_host if self.burst is None else self.burst )
+            return self.host_slots[host], self.buckets.get( host )
+
+    def _get_connection( self, scheme, host ):
+
+        if not hasattr( self.local, 'connections' ):
+            self.local.connections = {}
+
+        conn = self.local.connections.get( ( scheme, host ) )
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection( host, timeout = self.timeout )
+            else:
+                conn = http.client.HTTPConnection( host, timeout = self.timeout )
+            self.local.connections[( scheme, host )] = conn
+            with self.lock:
+                self.connections.append( conn )
+        return conn
+
+    def _drop_connection( self, scheme, host ):
+
+        conn = self.local.connections.pop( ( scheme, host ), None )
+        if conn is not None:
+            conn.close()
+            with self.lock:
+                self.connections.remove( conn )
+
+    def _get_delay( self, attempt, retry_after = None ):
+
+        if retry_after is not None:
+            try:
+                return float( retry_after )
+            except ValueError:
+                pass
+        return self.backoff * ( 2 ** attempt ) * ( 0.5 + random.random() )
+
+    def request( self, url ):
+        '''
+        GET a URL over this thread's pooled connection, with retries.  Returns the body.
+        '''
+
+        parts  = urllib.parse.urlsplit( url )
+        target = parts.path or '/'
+        if parts.query:
+            target = f'{target}?{parts.query}'
+        slots, bucket = self._get_host_limits( parts.netloc )
+
+        start = time.perf_counter()
+        for attempt in range( 0, self.max_retries + 1 ):
+
+            status = None
+            retry_after = None
+            with slots:
+                if bucket is not None:
+                    bucket.acquire()
+                try:
+                    conn = self._get_connection( parts.scheme, parts.netloc )
+                    conn.request( 'GET', target, headers = { 'Connection': 'keep-alive' } )
+                    response = conn.getresponse()
+                    status   = response.status
+                    body     = response.read()
+                    if response.will_close:
+                        self._drop_connection( parts.scheme, parts.netloc )
+                except ( OSError, http.client.HTTPException ) as e:
+                    #  Stale keep-alive connections land here too, so always reconnect
+                    self._drop_connection( parts.scheme, parts.netloc )
+                    error = e
+                else:
+                    if status == 200:
+                        with self.lock:
+                            self.timings.append( RequestTiming( url, status, attempt + 1, len(body), time.perf_counter() - start ) )
+                        return body
+                    retry_after = response.getheader( 'Retry-After' )
+                    error = Exception( f'WMS request failed with HTTP {status}: {url}' )
+                    if status not in RETRY_STATUS:
+                        break
+
+            if attempt < self.max_retries:
+                delay = self._get_delay( attempt, retry_after )
+                logging.debug( f'Retrying in {delay:0.2f} s after {error}' )
+                time.sleep( delay )
+
+        with self.lock:
+            self.timings.append( RequestTiming( url, status, attempt + 1, 0, time.perf_counter() - start ) )
+        raise error
+
+    def fetch( self, wms_maps ):
+        '''
+        Fetch a list of wms.WMS requests.  Returns a list of arrays of shape
+        (bands, height, width), in request order.
+
+        When every tile has the same size, they're decoded into views of one
+        preallocated (tiles, bands, height, width) array instead of one array each.  The
+        block takes its band count and type from the first tile decoded; a tile which
+        doesn't match (e.g. a different format) gets its own array instead.  With a cache,
+        every tile gets its own array, since a cached view would keep the whole block
+        alive after its entry is evicted.
+        '''
+
+        wms_maps = list( wms_maps )
+        output   = [ None ] * len(wms_maps)
+        keys     = [ None ] * len(wms_maps)
+
+        pending = []
+        for idx, wms_map in enumerate( wms_maps ):
+            if self.cache is not None:
+                keys[idx]   = wms_map.get_cache_key()
+                output[idx] = self.cache.get( keys[idx] )
+                if output[idx] is not None:
+                    continue
+            if self.offline:
+                raise Exception( f'WMS tile not in the cache and offline: {wms_map.get_map_url()}' )
+            pending.append( idx )
+
+        sizes = { ( int( wms_maps[x].win_size_pix[1] ), int( wms_maps[x].win_size_pix[0] ) ) for x in pending }
+        block = { 'array': None }
+        use_block = len(sizes) == 1 and self.cache is None
+
+        def decode( idx, body ):
+            if not use_block:
+                return wms.decode_tile( body )
+
+            #  The block is allocated from the first tile, which gives the band count and type
+            with self.lock:
+                if block['array'] is None:
+                    first = wms.decode_tile( body )
+                    block['array'] = np.empty( ( len(pending), ) + first.shape, dtype = first.dtype )
+                    block['array'][block['slot'][idx]] = first
+                    return block['array'][block['slot'][idx]]
+
+            #  Falls back to a separate array if the tile doesn't match the block
+            return wms.decode_tile( body, out = block['array'][block['slot'][idx]] )
+
+        def fetch_one( idx ):
+            body = self.request( wms_maps[idx].get_map_url() )
+            tile = decode( idx, body )
+            if self.cache is not None:
+                tile = self.cache.put( keys[idx], tile )
+            return idx, tile
+
+        block['slot'] = { x: pos for pos, x in enumerate( pending ) }
+
+        logging.debug( f'Fetching {len(pending)} of {len(wms_maps)} WMS tiles on {self.max_workers} workers' )
+        if len(pending) > 0:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor( max_workers = self.max_workers )
+            for idx, tile in self.executor.map( fetch_one, pending ):
+                output[idx] = tile
+
+        return output
+
+    def fetch_windows( self,
+                       base_url,
+                       epsg,
+                       centers_ll,
+                       win_size_pix,
+                       gsd,
+                       layers,
+                       format,
+                       tile_size = wms.DEFAULT_GRID_TILE_SIZE ):
+        '''
+        Fetch a window around each lon/lat center from fixed grid tiles (see
+        wms.get_grid_window()).  The grid tiles of all the windows are fetched once, as
+        one batch, and only those missing from the cache.  Returns a list of arrays of
+        shape (bands, height, width), in center order.  Windows inside a single grid
+        tile are views of it.
+        '''
+
+        windows = [ wms.get_grid_window( epsg, x, win_size_pix, gsd ) for x in centers_ll ]
+
+        keys = []
+        for window in windows:
+            keys.extend( wms.get_grid_tiles( window, tile_size ) )
+        keys = list( dict.fromkeys( keys ) )
+
+        logging.debug( f'{len(windows)} WMS windows cover {len(keys)} grid tiles of {tile_size} pixels' )
+        tiles = self.fetch( [ wms.create_grid_request( base_url, epsg, x, tile_size, gsd, layers, format ) for x in keys ] )
+        tiles = dict( zip( keys, tiles ) )
+
+        return [ wms.assemble_window( x, tiles, tile_size ) for x in windows ]
@@ -0,0 +1,198 @@
+#    File:    catalog.py
+#
+#    Purpose: Columnar (Parquet/Feather) storage for the Landsat collection table.
+#             Excel is only used as an explicit export.
+#
+
+import logging, os
+
+import numpy as np
+import pandas as pd
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+CATEGORICAL_COLUMNS = [ 'sensor', 'product_type', 'processing_level' ]
+DATE_COLUMNS        = [ 'acquisition_date', 'production_date' ]
+INTEGER_COLUMNS     = [ 'satellite', 'wrs2_path', 'wrs2_row', 'ard_col', 'ard_row' ]
+
+#  Sort order on write.  Keeps each row group to a narrow range of these columns,
+#  so the row-group statistics can skip most of the file on a filtered read.
+SORT_COLUMNS = [ 'satellite', 'wrs2_path', 'wrs2_row', 'ard_col', 'ard_row', 'acquisition_date' ]
+
+def catalog_path( pathname ):
+    '''
+    Return the catalog path for a collection list path.  Excel paths are mapped to a
+    Parquet file of the same name.
+    '''
+    ext = os.path.splitext( pathname )[1].lower()
+    if ext in [ '.parquet', '.feather' ]:
+        return pathname
+    return f'{os.path.splitext( pathname )[0]}.parquet'
+
+def _format( pathname ):
+    if os.path.splitext( pathname )[1].lower() == '.feather':
+        return 'feather'
+    return 'parquet'
+
+def normalize_types( collection_df ):
+    '''
+    Convert the collection table to the catalog dtypes (categorical, nullable integer
+    and datetime64).  Columns which are missing are skipped.
+    '''
+
+    df = collection_df.copy()
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype( 'category' )
+    for col in DATE_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime( df[col] )
+    for col in INTEGER_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric( df[col] ).astype( 'Int16' )
+
+    #  Path columns may be entirely empty, which would otherwise be stored as a null type
+    for col in df.columns:
+        if col in INTEGER_COLUMNS:
+            continue
+        if col.endswith( '_path' ) or '_path_' in col or col in [ 'pathname', 'cid' ]:
+            df[col] = df[col].astype( 'string' )
+    return df
+
+def write_catalog( collection_df, pathname, row_group_size = 1024 ):
+    '''
+    Write the collection table to a Parquet or Feather file, based on the extension.
+    '''
+
+    df = normalize_types( collection_df )
+    sort_cols = [ x for x in SORT_COLUMNS if x in df ]
+    if len(sort_cols) > 0:
+        df = df.sort_values( sort_cols, na_position = 'last', kind = 'stable' )
+
+    table = pa.Table.from_pandas( df, preserve_index = False )
+
+    #  Write to a temporary file first so readers never see a partial catalog
+    tmp_path = f'{pathname}.tmp'
+    if _format( pathname ) == 'feather':
+        feather.write_feather( table, tmp_path, compression = 'lz4', chunksize = row_group_size )
+    else:
+        pq.write_table( table, tmp_path, row_group_size = row_group_size, compression = 'snappy' )
+    os.replace( tmp_path, pathname )
+
+def _isin( name, value ):
+    if np.ndim( value ) == 0:
+        return ds.field( name ) == value
+    return ds.field( name ).isin( list(value) )
+
+def read_catalog( pathname,
+                  columns          = None,
+                  satellite        = None,
+                  processing_level = None,
+                  wrs2_path        = None,
+                  wrs2_row         = None,
+                  start_date       = None,
+                  end_date         = None ):
+    '''
+    Load the collection table, optionally only a subset of columns and rows.
+
+    Filters accept a single value or a list of values.  The date range is inclusive and
+    applies to the acquisition date.  For Parquet, filters are checked against the
+    row-group statistics before any data is decoded.
+    '''
+
+    expr = None
+    def add( term ):
+        nonlocal expr
+        expr = term if expr is None else expr & term
+
+    if satellite is not None:
+        add( _isin( 'satellite', satellite ) )
+    if processing_level is not None:
+        add( _isin( 'processing_level', processing_level ) )
+    if wrs2_path is not None:
+        add( _isin( 'wrs2_path', wrs2_path ) )
+    if wrs2_row is not None:
+        add( _isin( 'wrs2_row', wrs2_row ) )
+    if start_date is not None:
+        add( ds.field( 'acquisition_date' ) >= pa.scalar( pd.Timestamp( start_date ).to_pydatetime() ) )
+    if end_date is not None:
+        add( ds.field( 'acquisition_date' ) <= pa.scalar( pd.Timestamp( end_date ).to_pydatetime() ) )
+
+    dataset = ds.dataset( pathname, format = _format( pathname ) )
+    table = dataset.to_table( columns = columns, filter = expr )
+    return table.to_pandas()
+
+def cache_path( pathname ):
+    '''
+    Return the binary cache path for an Excel file.
+    '''
+    return f'{os.path.splitext( pathname )[0]}.cache.feather'
+
+def _source_key( pathname ):
+    st = os.stat( pathname )
+    return f'{st.st_mtime_ns}:{st.st_size}'.encode()
+
+def write_excel_cache( df, pathname, cache_pathname = None ):
+    '''
+    Store a DataFrame read from an Excel file as Feather, tagged with the mtime and size
+    of the Excel file.  Tables Arrow can't represent (e.g. mixed-type columns) are not
+    cached.
+    '''
+    if cache_pathname is None:
+        cache_pathname = cache_path( pathname )
+
+    try:
+        table = pa.Table.from_pandas( df, preserve_index = False )
+        metadata = dict( table.schema.metadata or {} )
+        metadata[b'dug_source'] = _source_key( pathname )
+        table = table.replace_schema_metadata( metadata )
+
+        tmp_path = f'{cache_pathname}.tmp'
+        feather.write_feather( table, tmp_path, compression = 'lz4' )
+        os.replace( tmp_path, cache_pathname )
+    except ( pa.ArrowException, OSError ) as e:
+        logging.debug( f'Unable to cache {pathname}: {e}' )
+
+def read_cache( pathname, cache_pathname ):
+    '''
+    DataFrame cached from pathname (see write_excel_cache()), or None if there is no
+    cache or pathname changed since it was written.
+    '''
+    if not os.path.exists( cache_pathname ):
+        return None
+
+    try:
+        table = feather.read_table( cache_pathname, memory_map = True )
+        if ( table.schema.metadata or {} ).get( b'dug_source' ) == _source_key( pathname ):
+            return table.to_pandas()
+    except ( pa.ArrowException, OSError ) as e:
+        logging.debug( f'Ignoring unreadable cache {cache_pathname}: {e}' )
+    return None
+
+def read_excel_cached( pathname, cache_pathname = None ):
+    '''
+    Read an Excel file through a Feather cache.  The cache is only used while the mtime
+    and size of the Excel file match the ones it was written from, otherwise the Excel
+    file is parsed and the cache rewritten.
+    '''
+    if cache_pathname is None:
+        cache_pathname = cache_path( pathname )
+
+    df = read_cache( pathname, cache_pathname )
+    if df is not None:
+        return df
+
+    logging.debug( f'Parsing {pathname}' )
+    df = pd.read_excel( pathname )
+    write_excel_cache( df, pathname, cache_pathname )
+    return df
+
+def export_excel( collection_df, pathname ):
+    '''
+    Explicit export of the collection table to Excel, e.g. for sharing.
+    '''
+    logging.debug( f'Exporting {collection_df.shape[0]} collections to {pathname}' )
+    collection_df.to_excel( pathname, index = False )
@@ -3,12 +3,19 @@ import configparser
 import pandas as pd
 import numpy as np
 
+from rasterio.windows import Window
+
 import logging, os, sys
 
 #  Load other DUG APIs
 sys.path.insert(0,'..')
+import dug_api.catalog as catalog
 import dug_api.coordinate as crd
 import dug_api.Database as Database
+from dug_api.CollectID import CollectID
+from dug_api.ProductRegistry import ProductRegistry
+from dug_api.ScanManifest import ScanManifest
+from dug_api.SceneIndex import SceneIndex
 
 
 class Configuration:
@@ -18,13 +25,50 @@ class Configuration:
         config = configparser.ConfigParser()
         config.read( config_path )
         self.config = config
-
-        if os.path.exists( self.get_ls_collection_list_path() ):
-            self.ls_collection_df = pd.read_excel( self.get_ls_collection_list_path() )
-        else:
-            logging.debug( f'No Landsat Collection List at {self.get_ls_collection_list_path()}' )
-            self.ls_collection_df = None
-
+        self.scene_index = None
+        self.ls_collection_conflicts = None
+        self.product_registry = None
+        self.quality_index = None
+        self.garden_registries = {}
+        self.wms_cache = None
+
+        #  Tables are loaded on first access, most scripts never need them
+        self._ls_collection_df    = None
+        self._ls_collection_ready = False
+        self.planet_catalogue     = None
+        self.planet_catalogue_key = None
+
+    @property
+    def ls_collection_df(self):
+        '''
+        Landsat collection table, loaded from the catalog on first access.
+        '''
+        if not self._ls_collection_ready:
+            self._ls_collection_df    = self._load_ls_collection_df()
+            self._ls_collection_ready = True
+        return self._ls_collection_df
+
+    @ls_collection_df.setter
+    def ls_collection_df( self, collection_df ):
+        self._ls_collection_df    = collection_df
+        self._ls_collection_ready = True
+
+    def _load_ls_collection_df(self):
+
+        catalog_path = self.get_ls_collection_catalog_path()
+        list_path    = self.get_ls_collection_list_path()
+        if os.path.exists( catalog_path ):
+            return catalog.read_catalog( catalog_path )
+
+        #  One-time import of an existing Excel collection list
+        if list_path != catalog_path and os.path.exists( list_path ):
+            logging.info( f'Importing Landsat Collection List {list_path} into {catalog_path}' )
+            collection_df = catalog.normalize_types( pd.read_excel( list_path ) )
+            catalog.write_catalog( collection_df, catalog_path )
+            return collection_df
+
+        logging.debug( f'No Landsat Collection Catalog at {catalog_path}' )
+        return None
 
     def get( self, section, value ):
         assert( self.config.has_option( section, value ) )
@@ -32,22 +76,220 @@ class Configuration:
         
     def get_ls_collection_list_path(self):
         '''
-        Return the path to the Landsat Collection List (Excel file)
+        Return the path to the Landsat Collection List (Excel file).  This is only
+        used for imports and explicit exports, see get_ls_collection_catalog_path().
         '''
         return self.config['general']['landsat_collection_list_path']
 
+    def get_ls_collection_catalog_path(self):
+        '''
+        Return the path to the Landsat Collection Catalog (Parquet or Feather file).
+        Defaults to a Parquet file next to the collection list.
+        '''
+        if self.config.has_option( 'general', 'landsat_collection_catalog_path' ):
+            return self.config['general']['landsat_collection_catalog_path']
+        return catalog.catalog_path( self.get_ls_collection_list_path() )
+
+    def export_ls_collection_list( self, pathname = None ):
+        '''
+        Write the collection table to Excel.  Defaults to the collection list path.
+        '''
+        if pathname is None:
+            pathname = self.get_ls_collection_list_path()
+        catalog.export_excel( self.ls_collection_df, pathname )
+
+    def get_catalog_db_path(self):
+        '''
+        Return the path to the SQLite catalog of collections, files and derived products.
+        Defaults to sitting next to the Landsat Collection List.
+        '''
+        if self.config.has_option( 'general', 'catalog_db_path' ):
+            return self.config['general']['catalog_db_path']
+        return f'{os.path.splitext( self.get_ls_collection_list_path() )[0]}.db'
+
+    def open_catalog_db(self):
+        '''
+        Open the SQLite catalog (see Database.open_catalog()).  Each worker should open
+        its own connection.
+        '''
+        return Database.open_catalog( self.get_catalog_db_path() )
+
+    def get_product_registry(self):
+        '''
+        Product path registry in the SQLite catalog.  The connection is opened on first use.
+        '''
+        if self.product_registry is None:
+            self.product_registry = ProductRegistry( self.open_catalog_db() )
+        return self.product_registry
+
+    @staticmethod
+    def get_cid( cid_path ):
+        '''
+        Collection ID of a collection folder, its folder name.  Trailing separators are
+        ignored, so 'LC08_..._02/' is 'LC08_..._02' rather than ''.
+        '''
+        return os.path.basename( os.path.normpath( cid_path ) )
+
+    def get_collection_paths( self, cid_path ):
+        '''
+        Path keys (b4_path, b4_path_epsg_32613, ndvi_path_epsg_32613, ...) of a collection
+        folder.  Collections not yet in the registry are imported from their config.cfg.
+        '''
+        cid_path = os.path.normpath( cid_path )
+        cid = Configuration.get_cid( cid_path )
+        registry = self.get_product_registry()
+
+        paths = registry.get_paths( cid )
+        if paths is None:
+            if registry.import_configs( [ cid_path ] ) == 0:
+                raise Exception( f'CID ({cid}) has no registry entry or config.cfg' )
+            paths = registry.get_paths( cid ) or {}
+        return paths
+
+    def record_collection_paths( self, cid, paths ):
+        '''
+        Record new product paths for a collection in the registry, in one transaction.
+        '''
+        return self.get_product_registry().set_paths( { cid: paths } )
+
+    def get_quality_index(self):
+        '''
+        Scene-quality index in the SQLite catalog.  The connection is opened on first use.
+        '''
+        if self.quality_index is None:
+            #  Imported on use, it pulls in landsat_utilities and with it matplotlib
+            from dug_api.QualityIndex import QualityIndex
+            self.quality_index = QualityIndex( self.open_catalog_db() )
+        return self.quality_index
+
+    def get_quality_limits(self):
+        '''
+        Scene-quality limits from the [general] section (max_cloud_cover,
+        max_cloud_cover_land, min_sun_elevation).  Limits not set are None.
+        '''
+        limits = {}
+        for key in [ 'max_cloud_cover', 'max_cloud_cover_land', 'min_sun_elevation' ]:
+            limits[key] = self.config.getfloat( 'general', key ) if self.config.has_option( 'general', key ) else None
+        return limits
+
+    def check_scene_quality( self, cid_path ):
+        '''
+        Whether a collection is within the configured quality limits, from its MTL file.
+        The scene is indexed first if needed.  Returns True/False and the reason it failed.
+        '''
+        limits = self.get_quality_limits()
+        if all( x is None for x in limits.values() ):
+            return True, None
+
+        collection_df = CollectID.batch_to_dataframe( [ os.path.normpath( cid_path ) ] )
+        quality_index = self.get_quality_index()
+        quality_index.update( collection_df, num_workers = 1 )
+        return quality_index.check( collection_df['cid'].iloc[0], **limits )
+
+    def filter_ls_collections( self, collection_df = None, update = True, keep_unknown = True ):
+        '''
+        Rows of a collection table (by default the Landsat collection table) within the
+        configured quality limits.  With update, new or changed MTL files are indexed first.
+        '''
+        if collection_df is None:
+            collection_df = self.ls_collection_df
+
+        quality_index = self.get_quality_index()
+        if update:
+            quality_index.update( collection_df )
+        return quality_index.filter( collection_df, keep_unknown = keep_unknown, **self.get_quality_limits() )
+
+    def get_wms_cache(self):
+        '''
+        On-disk cache of WMS basemap tiles (see wms.load_tile()), from the [naip]
+        wms_cache_path and wms_cache_max_mb options.  None if no cache path is set.
+        '''
+        if not self.config.has_option( 'naip', 'wms_cache_path' ):
+            return None
+
+        if self.wms_cache is None:
+            from dug_api.TileCache import TileCache
+            max_mb = self.config.getfloat( 'naip', 'wms_cache_max_mb', fallback = 4096 )
+            self.wms_cache = TileCache( max_bytes      = 256 * 1024 * 1024,
+                                        disk_path      = self.config['naip']['wms_cache_path'],
+                                        max_disk_bytes = int( max_mb * 1024 * 1024 ) )
+        return self.wms_cache
+
+    def is_wms_offline(self):
+        '''
+        True if WMS tiles must come from the cache ([naip] wms_offline).
+        '''
+        return self.config.getboolean( 'naip', 'wms_offline', fallback = False )
+
+    def get_et_aggregator(self):
+        '''
+        Rolling-window OpenET aggregator from the [openet] win_size_days, win_skip_days,
+        crop_width_m and crop_height_m options.
+        '''
+        from dug_api.ETAggregator import ETAggregator
+        section = self.config['openet']
+        return ETAggregator( section.getint( 'win_size_days', fallback = 7 ),
+                             section.getint( 'win_skip_days', fallback = 1 ),
+                             section.getfloat( 'crop_width_m', fallback = None ),
+                             section.getfloat( 'crop_height_m', fallback = None ) )
+
+    def get_scan_manifest_path(self):
+        '''
+        Return the path to the collection scan manifest.  Defaults to sitting next to the
+        Landsat Collection List.
+        '''
+        if self.config.has_option( 'general', 'scan_manifest_path' ):
+            return self.config['general']['scan_manifest_path']
+        return f'{os.path.splitext( self.get_ls_collection_list_path() )[0]}.manifest.json'
+
+    def rescan_collections( self, full = False, num_workers = 8, update_file = True ):
+        '''
+        Rescan the image collection folders against the scan manifest (see
+        ScanManifest.rescan()) and apply the changes to the Landsat collection table.
+        Removed collections are dropped, the rows of modified ones are replaced by their
+        new scan, and added ones are appended.  The manifest is saved, and the table too
+        unless update_file is False.  Returns the rescan result.
+        '''
+        manifest = ScanManifest( self.get_scan_manifest_path() )
+        result   = manifest.rescan( self.get_image_collection_path(), full = full, num_workers = num_workers )
+
+        stale = { CollectID.from_pathname( x ).cid() for x in result['removed'] + result['modified'] }
+        if self.ls_collection_df is not None and len(stale) > 0:
+            keep = ~self.ls_collection_df['cid'].isin( stale )
+            self.ls_collection_df = self.ls_collection_df.loc[keep].reset_index( drop = True )
+
+        if len(stale) > 0 or result['table'].shape[0] > 0:
+            self.update_table( 'ls_collection', result['table'], update_file = update_file )
+        manifest.save()
+        return result
+
     def get_planet_catalogue(self):
+        '''
+        Planet catalogue, read through a Feather cache of the Excel file (see
+        catalog.read_excel_cached()).  Only re-read if the file changed since the last call.
+        '''
         path = self.config['general']['planet_catalogue']
-        if os.path.exists( path ):
-            self.planet_catalogue = pd.read_excel( path )
-        else:
-            self.planet_catalogue = self._create_default_planet_catalogue()
+        if not os.path.exists( path ):
+            self.planet_catalogue     = self._create_default_planet_catalogue()
+            self.planet_catalogue_key = None
+            return self.planet_catalogue
+
+        st  = os.stat( path )
+        key = ( st.st_mtime_ns, st.st_size )
+        if self.planet_catalogue is None or key != self.planet_catalogue_key:
+            self.planet_catalogue     = catalog.read_excel_cached( path )
+            self.planet_catalogue_key = key
 
         return self.planet_catalogue
 
     def update_planet_catalogue(self, catalogue):
+        path = self.config['general']['planet_catalogue']
         self.planet_catalogue = catalogue
-        self.planet_catalogue.to_excel( self.config['general']['planet_catalogue'], index=False ) 
+        self.planet_catalogue.to_excel( path, index=False )
+
+        #  Keep the in-memory copy, the Feather cache is rebuilt on the next fresh read
+        st = os.stat( path )
+        self.planet_catalogue_key = ( st.st_mtime_ns, st.st_size )
         return self.planet_catalogue
     
     def _create_default_planet_catalogue(self):
@@ -56,10 +298,34 @@ class Configuration:
 
         return pd.DataFrame( data )
     
+    def get_scene_index(self):
+        '''
+        SceneIndex over the Landsat collection table.  Rebuilt after update_table().
+        '''
+        if self.scene_index is None and self.ls_collection_df is not None:
+
+            #  Tile footprints come from the quality index, if there is one yet
+            footprints = None
+            if os.path.exists( self.get_catalog_db_path() ):
+                footprints = self.get_quality_index().footprints()
+            self.scene_index = SceneIndex( self.ls_collection_df, footprints )
+        return self.scene_index
+
     def get_ls_collection_config(self, cid):
 
         #  Get collection info
-        collect_data = self.ls_collection_df.loc[self.ls_collection_df['cid'] == cid]
+        pos = self.get_scene_index().position( cid )
+        if pos is None:
+            raise Exception( f'CID ({cid}) not in the Landsat Collection List.' )
+        collect_data = self.ls_collection_df.iloc[[pos]]
+
+        #  Registered collections don't need their config.cfg read
+        paths = self.get_product_registry().get_paths( cid )
+        if paths is not None:
+            config = self._collection_config( collect_data )
+            for key, path in paths.items():
+                config['general'][key] = path
+            return config
 
         # Create collection configuration file
         collect_dir = collect_data['pathname'].values[0]
@@ -83,17 +349,28 @@ class Configuration:
         with open( config_path, 'w' ) as configfile:
             config.write(configfile)
 
-    def _create_collection_config( self, config_path, collect_data ):
+        registry = self.get_product_registry()
+        if registry.has_collection( cid ):
+            registry.set_paths( { cid: dict( config['general'] ) } )
+        else:
+            registry.import_configs( [ collect_dir ] )
+
+    def _collection_config( self, collect_data ):
 
-        #  import configparser
-        cid = collect_data['cid'].values[0]
-        logging.info( f'Building new ls config for cid: {cid}' )
         config = configparser.ConfigParser()
         config['general'] = {}
 
         for col in list(collect_data):
             if collect_data[col].isna().any() != True:
                 config['general'][col] = str(collect_data[col].values[0])
+        return config
+
+    def _create_collection_config( self, config_path, collect_data ):
+
+        #  import configparser
+        cid = collect_data['cid'].values[0]
+        logging.info( f'Building new ls config for cid: {cid}' )
+        config = self._collection_config( collect_data )
 
         with open( config_path, 'w' ) as configfile:
             config.write(configfile)
@@ -145,7 +422,8 @@ class Configuration:
     def update_table( self, table_name, new_entries, update_file=True ):
         '''
         Takes an input table or set of columns and adds them to the table. 
-        If the table already has cells populated, they are ignored.
+        If the table already has cells populated, they are ignored.  Cells where
+        the new value differs are recorded in ls_collection_conflicts.
         '''
 
         #  First, load the table from SQLite
@@ -158,57 +436,70 @@ class Configuration:
 
         #  otherwise, merge the columns
         else:
-            self._process_rows( new_entries )
+            self.ls_collection_conflicts = self._process_rows( new_entries )
+            if self.ls_collection_conflicts.shape[0] > 0:
+                logging.warning( f'{self.ls_collection_conflicts.shape[0]} path conflicts kept existing values. See ls_collection_conflicts.' )
+
+        #  Table changed, so the index is stale
+        self.scene_index = None
 
         if update_file:
-            self.ls_collection_df.to_excel( self.get_ls_collection_list_path(),
-                                            index=False )
+            catalog.write_catalog( self.ls_collection_df,
+                                   self.get_ls_collection_catalog_path() )
 
         return self.ls_collection_df
 
     def _process_rows( self, new_entries ):
-        
-        for rdata in new_entries.itertuples(index=False):
-
-            row = rdata._asdict()
-
-            #  Check if the collection id is entered yet
-            c = self.ls_collection_df.loc[self.ls_collection_df['cid'] == row['cid']]
-
-            #  If the collection is not present, throw
-            if c.shape[0] == 0:
-
-                new_data = {}
-                for temp_col in row:
-                    new_data[temp_col] = [row[temp_col]]
-                new_df = pd.DataFrame( new_data )
-                
-                self.ls_collection_df = pd.concat( [ self.ls_collection_df, new_df ], ignore_index=True)
-
-            elif c.shape[0] > 1:
-                raise Exception( f'Multiple CIDs found: {c["cid"].values}' )
-            else:
-                for c in row:
-                    if '_path' in c:
-                        src_val = row[c]
-                        dst_val = self.ls_collection_df.loc[self.ls_collection_df['cid'] == row['cid'],c]
-
-                        #  if neither is valid, then do nothing
-                        if (dst_val.values[0] is None or dst_val.isna().any() ) and src_val is None:
-                            pass
-                    
-                        #  if destination is empty, but source is valid, set it
-                        elif (dst_val.values[0] is None or dst_val.isna().any() ) and src_val != None:
-                            self.ls_collection_df.loc[self.ls_collection_df['cid'] == row['cid'],c] = src_val
-
-                        #  If destination is set, and source is empty, do nothing
-                        elif (dst_val.values[0] != None and dst_val.isna().any() == False) and src_val is None:
-                            pass
-
-                        elif src_val != dst_val.values[0]:
-                            #print( f'Likely need to update col: {c}, CID: {row["cid"]}, Column: {c}, Dest: {dst_val}, Source: {src_val}' )
-                            pass
-        
+        '''
+        Merge new entries into the collection table, keyed on cid.
+
+        Unknown CIDs are appended in bulk.  For known CIDs, empty *_path cells are filled
+        from the new entries, while existing paths always win.  Returns a DataFrame of the
+        conflicts (cid, column, existing, new) where both paths are set but differ.
+        '''
+
+        table = self.ls_collection_df
+        dups = table['cid'][table['cid'].duplicated()]
+        if dups.shape[0] > 0:
+            raise Exception( f'Multiple CIDs found: {dups.values}' )
+
+        #  Repeated CIDs in the update behave like sequential updates: first non-null path wins
+        if new_entries['cid'].duplicated().any():
+            new_entries = new_entries.groupby( 'cid', sort = False, dropna = False ).first().reset_index()
+
+        merged    = table.set_index( 'cid' )
+        updates   = new_entries.set_index( 'cid' )
+        positions = merged.index.get_indexer( updates.index )
+        is_new    = positions < 0
+
+        #  Fill empty path cells of known CIDs in a single combine
+        path_cols = [ x for x in updates.columns if '_path' in x ]
+        for col in path_cols:
+            if col not in merged:
+                merged[col] = None
+
+        known = updates.loc[~is_new, path_cols].astype( object )
+        rows_known = positions[~is_new]
+        cols_known = merged.columns.get_indexer( path_cols )
+        current = merged.iloc[rows_known, cols_known].astype( object )
+        current.index = known.index
+
+        differs = ( current.notna() & known.notna() & ( current != known ) ).to_numpy( dtype = bool )
+        rows, cols = np.nonzero( differs )
+        conflicts = pd.DataFrame( { 'cid':      known.index.values[rows],
+                                    'column':   np.asarray( path_cols, dtype = object )[cols],
+                                    'existing': current.to_numpy()[rows, cols],
+                                    'new':      known.to_numpy()[rows, cols] } )
+
+        merged.iloc[rows_known, cols_known] = current.combine_first( known )[path_cols].to_numpy()
+
+        #  Bulk-append the new collections.  Rows from the catalog and from a scan carry
+        #  different dtypes (Timestamp vs date, categorical vs str), so normalize the result
+        merged = pd.concat( [ merged.reset_index(),
+                              updates.loc[is_new].reset_index() ],
+                            ignore_index = True )
+        self.ls_collection_df = catalog.normalize_types( merged )
+        return conflicts
         
     def is_valid( self ):
         '''
@@ -225,33 +516,45 @@ class Configuration:
 
         return True
 
+    def get_garden_registry( self, epsg = None, pathname = None ):
+        '''
+        Garden registry from the garden list (garden_list_csv, or pathname), projected
+        into epsg (defaults to the output EPSG).  Loaded once per EPSG.
+        '''
+        if epsg is None:
+            epsg = self.get_output_epsg()
+        if pathname is None:
+            pathname = self.config['general']['garden_list_csv']
+
+        key = ( os.path.abspath( pathname ), int(epsg) )
+        if key not in self.garden_registries:
+            #  Imported on use, scipy.spatial is slow to load
+            from dug_api.GardenRegistry import GardenRegistry
+            self.garden_registries[key] = GardenRegistry.from_file( pathname, epsg )
+        return self.garden_registries[key]
+
     def create_garden_windows( self, affine, epsg, shape, win_width = 1000, win_height = 1000 ):
 
         #  Get the center coordinate
         xform = affine.__invert__()
 
-        proj_xform = Transformer.from_crs( 4326, epsg_code, always_xy=True )
+        #  Garden coordinates are already projected into the image EPSG
+        garden_df = self.get_garden_registry( epsg ).garden_df
+        cols, rows = xform * ( garden_df['x'].to_numpy(), garden_df['y'].to_numpy() )
     
-        #  Iterate over each row, creating a rasterio window
+        #  Iterate over the gardens inside the image, creating a rasterio window
         windows = {}
-        for index, row in garden_df.iterrows():
-
-            #  Convert LLA to UTM
-            utm = proj_xform.transform( row['Longitude'], row['Latitude'] )
-
-            #  Convert UTM to Pixels
-            pix = xform * utm
-
-            if pix[0] < shape[1] and pix[0] >= 0 and pix[1] < shape[0] and pix[1] >= 0:
+        inside = ( cols < shape[1] ) & ( cols >= 0 ) & ( rows < shape[0] ) & ( rows >= 0 )
+        for pos in np.flatnonzero( inside ):
 
-                start_x = pix[0] - (win_width / 2)
-                start_y = pix[1] - (win_height / 2)
+            start_x = float( cols[pos] ) - (win_width / 2)
+            start_y = float( rows[pos] ) - (win_height / 2)
 
-                name = row['Name']
+            name = garden_df['name'].iat[pos]
             
-                #  Compute window
-                windows[name] = { 'window': Window( start_x, start_y, win_width, win_height ),
-                                  'latitude': row['Latitude'],
-                                  'longitude': row['Longitude'] }
+            #  Compute window
+            windows[name] = { 'window': Window( start_x, start_y, win_width, win_height ),
+                              'latitude': float( garden_df['latitude'].iat[pos] ),
+                              'longitude': float( garden_df['longitude'].iat[pos] ) }
 
         return windows
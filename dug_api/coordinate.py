@@ -6,34 +6,77 @@
 #
 
 
+import functools
+
 from pyproj import Transformer
 
 import numpy as np
 
+def _crs_key( value ):
+    '''
+    EPSG codes arrive as ints or strings (e.g. from the config file), so '32613' and
+    32613 share a cache entry.
+    '''
+    if isinstance( value, str ) and value.strip().isdigit():
+        return int( value )
+    if isinstance( value, np.integer ):
+        return int( value )
+    return value
+
+@functools.lru_cache( maxsize = 64 )
+def _create_transformer( input_crs, output_crs, always_xy ):
+    return Transformer.from_crs( input_crs,
+                                 output_crs,
+                                 always_xy = always_xy )
+
+def get_transformer( input_epsg, output_epsg, always_xy = True ):
+    '''
+    Return a Transformer from one EPSG (or CRS) into another.  Transformers are cached
+    for the life of the process, as building one costs far more than using it.
+    '''
+    return _create_transformer( _crs_key( input_epsg ),
+                                _crs_key( output_epsg ),
+                                always_xy )
+
 def convert_coord_point( point, input_epsg, output_epsg ):
     '''
     Convert a single coordinate from one EPSG into another.
     '''
 
-    xform = Transformer.from_crs( input_epsg,
-                                  output_epsg,
-                                  always_xy=True )
+    xform = get_transformer( input_epsg, output_epsg )
 
     dest_point = xform.transform( point[0], point[1] )
     return dest_point
 
+def convert_coord_xy( x, y, input_epsg, output_epsg ):
+    '''
+    Convert arrays of x and y coordinates from one EPSG into another in a single call.
+    Returns a tuple of float64 arrays.
+    '''
+    xform = get_transformer( input_epsg, output_epsg )
+
+    dest_x, dest_y = xform.transform( np.asarray( x, dtype = np.float64 ),
+                                      np.asarray( y, dtype = np.float64 ) )
+    return np.asarray( dest_x ), np.asarray( dest_y )
+
+def convert_coord_array( points, input_epsg, output_epsg ):
+    '''
+    Convert an Nx2 array (or list) of points from one EPSG into another in a single call.
+    Returns an Nx2 float64 array.
+    '''
+    points = np.asarray( points, dtype = np.float64 ).reshape( -1, 2 )
+    dest_x, dest_y = convert_coord_xy( points[:,0], points[:,1], input_epsg, output_epsg )
+    return np.column_stack( [ dest_x, dest_y ] )
+
 def convert_coord_list( point_list, 
                         input_epsg, 
                         output_epsg ):
     '''
     Convert a list of points from one EPSG into another.  Useful for Polygons and other shapes.
     '''
-    output = []
-    for point in point_list:
-        output.append( convert_coord_point( point,
-                                            input_epsg,
-                                            output_epsg ) )
-    return output
+    if len(point_list) == 0:
+        return []
+    return [ tuple(x) for x in convert_coord_array( point_list, input_epsg, output_epsg ).tolist() ]
 
 def convert_coord_bbox( bounds, input_epsg, output_epsg ):
     '''
@@ -43,13 +86,11 @@ def convert_coord_bbox( bounds, input_epsg, output_epsg ):
 
     output = []
 
-    pts = []
-    pts.append( list(convert_coord_point( [ min( bounds[0][0], bounds[1][0] ), 
-                                            min( bounds[0][1], bounds[1][1] ) ], 
-                                          input_epsg, output_epsg )) )
-    pts.append( list(convert_coord_point( [ max( bounds[0][0], bounds[1][0] ), 
-                                            max( bounds[0][1], bounds[1][1] ) ],
-                                          input_epsg, output_epsg )) )
+    pts = convert_coord_array( [ [ min( bounds[0][0], bounds[1][0] ),
+                                   min( bounds[0][1], bounds[1][1] ) ],
+                                 [ max( bounds[0][0], bounds[1][0] ),
+                                   max( bounds[0][1], bounds[1][1] ) ] ],
+                               input_epsg, output_epsg ).tolist()
 
     dx = pts[1][0] - pts[0][0]
     dy = pts[1][1] - pts[1][1]
@@ -0,0 +1,242 @@
+#    File:    heatmap.py
+#
+#    Purpose: Batch rendering of LST heatmaps over NAIP basemaps, for every garden and
+#             every LST image.  Each LST image is opened once and all the garden windows
+#             are cut from it in one pass, and each basemap is fetched once and reused
+#             for every date.
+#
+
+import concurrent.futures, logging, os, re, tempfile
+
+import numpy as np
+import pandas as pd
+
+import rasterio
+from PIL import Image
+
+from . import imagery
+from . import warping
+from . import wms
+from .CollectID import CollectID
+from .WMSFetcher import WMSFetcher
+
+#  Basemaps by garden name, set in each worker process by _init_worker().  Values are
+#  arrays, or .npy paths which are memory-mapped on first use (see _get_basemap())
+_basemaps = None
+
+def get_garden_slug( name ):
+    '''
+    Folder name for a garden, e.g. 'Elati Community Garden' -> 'Elati_Community_Garden'.
+    '''
+    return re.sub( r'[^A-Za-z0-9]+', '_', name ).strip('_')
+
+def get_gardens( garden_df, name_col = 'Name', lon_col = 'Longitude', lat_col = 'Latitude' ):
+    '''
+    Garden names and [lon, lat] centers from a garden table, such as data/DUG Gardens.csv.
+    Duplicate names are dropped.
+    '''
+    gardens = garden_df[[ name_col, lon_col, lat_col ]].drop_duplicates( subset = name_col )
+    return [ ( name, [ float(lon), float(lat) ] ) for name, lon, lat in gardens.itertuples( index = False ) ]
+
+def get_garden_folder( garden_index, name ):
+    '''
+    Output folder name of a garden.  Led by its index in get_gardens(), since different
+    names can share a slug ('St. Mary' and 'St Mary' are both 'St_Mary').
+    '''
+    return f'{garden_index:03d}_{get_garden_slug( name )}'
+
+def plan_heatmaps( gardens, lst_paths, output_dir, format = 'png' ):
+    '''
+    Table of the heatmaps to render, one row per garden and LST image, grouped by LST
+    image.  Images go to output_dir/<index>_<garden>/<cid>_<product>.<format>, see
+    get_garden_folder().
+    '''
+
+    rows = []
+    for lst_path in lst_paths:
+
+        cid = CollectID.from_pathname( os.path.dirname( os.path.abspath( lst_path ) ) )
+        stem = os.path.splitext( os.path.basename( lst_path ) )[0].replace( '.', '_' )
+        if cid is not None:
+            stem = f'{cid.cid()}_{stem}'
+
+        for garden_index, ( name, center_ll ) in enumerate( gardens ):
+            rows.append( { 'garden_index':     garden_index,
+                           'garden':           name,
+                           'longitude':        center_ll[0],
+                           'latitude':         center_ll[1],
+                           'cid':              None if cid is None else cid.cid(),
+                           'acquisition_date': None if cid is None else cid.acquisition_date(),
+                           'lst_path':         lst_path,
+                           'image_path':       os.path.join( output_dir, get_garden_folder( garden_index, name ), f'{stem}.{format}' ) } )
+
+    return pd.DataFrame( rows, columns = [ 'garden_index', 'garden', 'longitude', 'latitude', 'cid', 'acquisition_date', 'lst_path', 'image_path' ] )
+
+def load_basemaps( config, gardens, window_size, gsd, wms_cache = None, offline = False, tile_size = None ):
+    '''
+    Fetch the NAIP basemap of every garden once, as one concurrent batch (see
+    WMSFetcher).  Returns a dictionary of garden name to an (height, width, 3) uint8
+    array.  See wms.load_tile() for the cache and offline mode.
+
+    With tile_size, basemaps are cut from fixed grid tiles (see
+    WMSFetcher.fetch_windows()), so nearby gardens share requests.
+    '''
+
+    if tile_size is not None:
+        with WMSFetcher( cache = wms_cache, offline = offline ) as fetcher:
+            tiles = fetcher.fetch_windows( config.get( 'naip', 'wms_url' ),
+                                           config.get( 'general', 'output_crs_epsg' ),
+                                           [ center_ll for name, center_ll in gardens ],
+                                           window_size,
+                                           gsd,
+                                           config.get( 'naip', 'wms_layers' ).split(','),
+                                           config.get( 'naip', 'wms_format' ),
+                                           tile_size )
+        return { name: np.ascontiguousarray( np.transpose( naip_arr, axes=[1,2,0] )[:,:,:3] )
+                 for ( name, center_ll ), naip_arr in zip( gardens, tiles ) }
+
+    wms_maps = [ wms.WMS( url          = config.get( 'naip', 'wms_url' ),
+                          epsg_code    = config.get( 'general', 'output_crs_epsg' ),
+                          center_ll    = center_ll,
+                          win_size_pix = window_size,
+                          gsd          = gsd,
+                          layers       = config.get( 'naip', 'wms_layers' ).split(','),
+                          format       = config.get( 'naip', 'wms_format' ) )
+                 for name, center_ll in gardens ]
+
+    logging.debug( f'Fetching basemaps for {len(wms_maps)} gardens' )
+    with WMSFetcher( cache = wms_cache, offline = offline ) as fetcher:
+        tiles = fetcher.fetch( wms_maps )
+
+    basemaps = {}
+    for ( name, center_ll ), naip_arr in zip( gardens, tiles ):
+        basemaps[name] = np.ascontiguousarray( np.transpose( naip_arr, axes=[1,2,0] )[:,:,:3] )
+    return basemaps
+
+def save_basemaps( basemaps, output_dir ):
+    '''
+    Write each basemap to output_dir as <index>.npy.  Returns a dictionary of garden
+    name to path, for _init_worker().
+    '''
+    paths = {}
+    for idx, ( name, basemap ) in enumerate( basemaps.items() ):
+        paths[name] = os.path.join( output_dir, f'{idx}.npy' )
+        np.save( paths[name], basemap, allow_pickle = False )
+    return paths
+
+def _init_worker( basemaps ):
+    global _basemaps
+    _basemaps = dict( basemaps )
+
+def _get_basemap( name ):
+    '''
+    Basemap of a garden in this worker.  Saved basemaps are memory-mapped, so workers
+    only page in the gardens they render and share those pages.
+    '''
+    basemap = _basemaps[name]
+    if isinstance( basemap, str ):
+        basemap = np.load( basemap, mmap_mode = 'r' )
+        _basemaps[name] = basemap
+    return basemap
+
+def _render_lst_image( lst_path, jobs, epsg_code, window_size, gsd, ratio, temp_range ):
+    '''
+    Cut every garden window in jobs from one LST image, composite them over their
+    basemaps and write the images.  Returns the temperature range of each image.
+    '''
+
+    with rasterio.open( lst_path ) as src_band:
+        nodata = src_band.nodata
+        tiles  = imagery.reproject_windows( src_band,
+                                            epsg_code,
+                                            [ [ x['longitude'], x['latitude'] ] for x in jobs ],
+                                            window_size,
+                                            gsd,
+                                            use_cache   = False,
+                                            num_workers = 1,
+                                            fill_value  = np.nan )
+
+    results = []
+    mosaic  = None
+    for job, tile in zip( jobs, tiles ):
+
+        lst_arr = tile[:,:,0].astype('float32')
+        if nodata is not None and not np.isnan( nodata ):
+            lst_arr[lst_arr == nodata] = np.nan
+
+        if np.isnan( lst_arr ).all():
+            logging.debug( f'No data for {job["garden"]} in {lst_path}' )
+            results.append( [ np.nan, np.nan ] )
+            continue
+
+        #  Every tile is the same size, so the output buffer is reused
+        mosaic, r = imagery.create_merged_heatmap_tile( lst_arr, _get_basemap( job['garden'] ), ratio, temp_range, out = mosaic )
+
+        os.makedirs( os.path.dirname( job['image_path'] ), exist_ok = True )
+        Image.fromarray( mosaic ).save( job['image_path'] )
+        results.append( [ float( r[0] ), float( r[1] ) ] )
+
+    return results
+
+def render_heatmaps( config,
+                     garden_df,
+                     lst_paths,
+                     output_dir,
+                     window_size = [ 1000, 1000 ],
+                     gsd         = 1.0,
+                     ratio       = 0.75,
+                     temp_range  = None,
+                     format      = 'png',
+                     num_workers = None,
+                     wms_cache   = None,
+                     offline     = False,
+                     tile_size   = None ):
+    '''
+    Render the heatmap of every garden in garden_df for every LST image in lst_paths.
+
+    The basemaps are fetched up front, once per garden, through wms_cache if given
+    (and from grid tiles of tile_size pixels if set, see load_basemaps()).  LST images
+    are then rendered on a process pool, one task per image.  The workers memory-map
+    the basemaps from a temporary folder rather than each receiving a copy.  Images are
+    written as PNG or WebP (format) and listed in output_dir/heatmap_index.csv, along
+    with the temperature range of each.  Gardens the image has no data for, including
+    windows outside the image, are listed without an image.  Returns the index.
+    '''
+
+    if num_workers is None:
+        num_workers = warping.default_num_workers()
+
+    gardens   = get_gardens( garden_df )
+    index_df  = plan_heatmaps( gardens, lst_paths, output_dir, format )
+    epsg_code = config.get( 'general', 'output_crs_epsg' )
+
+    basemaps = load_basemaps( config, gardens, window_size, gsd, wms_cache, offline, tile_size )
+
+    tasks = []
+    rows  = []
+    for lst_path, jobs in index_df.groupby( 'lst_path', sort = False ):
+        tasks.append( ( lst_path, jobs.to_dict( 'records' ), epsg_code, window_size, gsd, ratio, temp_range ) )
+        rows.append( jobs.index )
+
+    logging.debug( f'Rendering {index_df.shape[0]} heatmaps from {len(tasks)} LST images on {num_workers} workers' )
+    if num_workers <= 1 or len(tasks) <= 1:
+        _init_worker( basemaps )
+        results = [ _render_lst_image( *x ) for x in tasks ]
+    else:
+        with tempfile.TemporaryDirectory( prefix = 'basemaps_' ) as basemap_dir:
+            with concurrent.futures.ProcessPoolExecutor( max_workers = num_workers,
+                                                         initializer = _init_worker,
+                                                         initargs    = ( save_basemaps( basemaps, basemap_dir ), ) ) as executor:
+                results = list( executor.map( _render_lst_image, *zip( *tasks ) ) )
+
+    ranges = np.full( ( index_df.shape[0], 2 ), np.nan )
+    for idx, r in zip( rows, results ):
+        ranges[idx] = r
+
+    index_df['temp_min'] = ranges[:,0]
+    index_df['temp_max'] = ranges[:,1]
+    index_df.loc[index_df['temp_min'].isna(), 'image_path'] = None
+
+    os.makedirs( output_dir, exist_ok = True )
+    index_df.to_csv( os.path.join( output_dir, 'heatmap_index.csv' ), index = False )
+    return index_df
@@ -7,10 +7,15 @@ import logging, math, os
 
 import numpy as np
 
-import pyproj
-
 import matplotlib as mpl
 
+from . import coordinate as crd
+from . import warping
+from .TileCache import TileCache
+
+#  Shared cache of reproject_image2() tiles
+tile_cache = TileCache()
+
 def get_window_from_coords( bl_corner,
                             tr_corner,
                             coord_epsg,
@@ -32,137 +37,370 @@ def get_image_bbox( band ):
 
     pass
     
+def get_dest_grid( bbox, dest_gsd ):
+    '''
+    Output grid covering a bbox ([corner1, corner2], in the output CRS) at dest_gsd.
+    Returns the affine transform, width and height.
+    '''
+    dest_gsd = float( dest_gsd )
+    left   = min( bbox[0][0], bbox[1][0] )
+    right  = max( bbox[0][0], bbox[1][0] )
+    bottom = min( bbox[0][1], bbox[1][1] )
+    top    = max( bbox[0][1], bbox[1][1] )
+
+    width  = max( 1, math.ceil( ( right - left ) / dest_gsd ) )
+    height = max( 1, math.ceil( ( top - bottom ) / dest_gsd ) )
+    return rasterio.Affine( dest_gsd, 0, left, 0, -dest_gsd, top ), width, height
+
+def get_source_window( src_band, dst_crs, dst_xform, dst_width, dst_height, margin = 2 ):
+    '''
+    Window of the source image needed to fill the output grid.  The output bounds are
+    projected into the source CRS, rounded outwards and padded by margin pixels so the
+    resampling kernel has its neighbors at the edges.  Returns None if the output does
+    not overlap the source.
+    '''
+
+    left, top     = dst_xform * ( 0, 0 )
+    right, bottom = dst_xform * ( dst_width, dst_height )
+    bounds = warp.transform_bounds( dst_crs,
+                                    src_band.crs,
+                                    min( left, right ),
+                                    min( bottom, top ),
+                                    max( left, right ),
+                                    max( bottom, top ),
+                                    densify_pts = 21 )
+
+    win = src_band.window( *bounds )
+    col_off = max( 0, math.floor( min( win.col_off, win.col_off + win.width ) ) - margin )
+    row_off = max( 0, math.floor( min( win.row_off, win.row_off + win.height ) ) - margin )
+    col_end = min( src_band.width,  math.ceil( max( win.col_off, win.col_off + win.width ) ) + margin )
+    row_end = min( src_band.height, math.ceil( max( win.row_off, win.row_off + win.height ) ) + margin )
+
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return Window( col_off, row_off, col_end - col_off, row_end - row_off )
+
+def _open_source( source ):
+
+    if isinstance( source, str ):
+        if not os.path.exists( source ):
+            raise Exception( f'Cannot open {source} as image does not exist.' )
+        logging.debug( f'Opening input image: {source}' )
+        return rasterio.open( source ), True
+    return source, False
+
+def _warp_band( src_band, bidx, src_win, dst_crs, dst_xform, dst_width, dst_height, dtype, resampling, src_img = None, fill_value = None, **warp_options ):
+    '''
+    Warp one band of an open source onto the output grid.  Only src_win is read, unless
+    its pixels are already given as src_img.  Output pixels the source doesn't cover are
+    its nodata, or fill_value (default 0) if it has none.  warp_options are passed to
+    warping.warp_array().
+    '''
+
+    nodata = src_band.nodata
+    dst_nodata = fill_value if nodata is None else nodata
+    if src_win is None:
+        logging.debug( f'Region does not overlap {src_band.name}, output is empty.' )
+        return np.full( ( dst_height, dst_width ), 0 if dst_nodata is None else dst_nodata, dtype = dtype )
+
+    if src_img is None:
+        src_img = src_band.read( bidx, window = src_win )
+    return warping.warp_array( src_img,
+                               src_transform = src_band.window_transform( src_win ),
+                               src_crs       = src_band.crs,
+                               dst_transform = dst_xform,
+                               dst_crs       = dst_crs,
+                               dst_width     = dst_width,
+                               dst_height    = dst_height,
+                               dtype         = dtype,
+                               src_nodata    = nodata,
+                               dst_nodata    = dst_nodata,
+                               resampling    = resampling,
+                               **warp_options )
+
+def reproject_scene( band_paths,
+                     epsg,
+                     bbox_utm,
+                     dest_gsd,
+                     output_paths = None,
+                     path_out     = None,
+                     read_back    = False,
+                     resampling   = rasterio.enums.Resampling.bilinear,
+                     **warp_options ):
+    '''
+    Warp every band of a scene onto the bbox_utm region (in the output EPSG) at dest_gsd.
+
+    band_paths maps a band key to a source path or open dataset.  The output grid is
+    computed once, and the source window once per distinct source grid.  Outputs go to
+    output_paths (band key to path, one GeoTIFF per band) or path_out (a single
+    multi-band GeoTIFF in band_paths order, with the keys as band descriptions).
+
+    warp_options (num_workers, warp_mem_limit) are passed to
+    warping.warp_array().
+
+    Returns the written paths by band key and, if read_back is set, the warped arrays by
+    band key (otherwise None).
+    '''
+
+    if ( output_paths is None ) == ( path_out is None ):
+        raise Exception( 'Provide exactly one of output_paths or path_out.' )
+
+    dst_crs = crs.CRS.from_epsg( epsg )
+    dst_xform, dst_width, dst_height = get_dest_grid( bbox_utm, dest_gsd )
+
+    grid_kwargs = { 'crs':       dst_crs,
+                    'transform': dst_xform,
+                    'width':     dst_width,
+                    'height':    dst_height,
+                    'compress':  'lzw',
+                    'driver':    'GTiff' }
+
+    images  = {}
+    written = {}
+    meta    = None
+    windows = {}
+    for key, source in band_paths.items():
+
+        src_band, opened = _open_source( source )
+        try:
+            #  Bands of a scene usually share a grid, so the window is only solved once
+            grid = ( src_band.crs.to_wkt(), tuple( src_band.transform ), src_band.width, src_band.height )
+            if grid not in windows:
+                windows[grid] = get_source_window( src_band, dst_crs, dst_xform, dst_width, dst_height )
+                logging.debug( f'Source window {windows[grid]} of {src_band.width}x{src_band.height} source.' )
+
+            img = _warp_band( src_band, 1, windows[grid], dst_crs, dst_xform, dst_width, dst_height,
+                              src_band.dtypes[0], resampling, **warp_options )
+            if meta is None:
+                meta = src_band.meta.copy()
+
+            #  Per-band outputs are written as we go, so only one band is held at a time
+            if output_paths is not None:
+                kwargs = src_band.meta.copy()
+                kwargs.update( grid_kwargs )
+                kwargs['count'] = 1
+                with rasterio.open( output_paths[key], 'w', **kwargs ) as dst_band:
+                    dst_band.write( img, 1 )
+                written[key] = output_paths[key]
+
+            if read_back or path_out is not None:
+                images[key] = img
+        finally:
+            if opened:
+                src_band.close()
+
+    if path_out is not None and len(images) > 0:
+        keys   = list( images.keys() )
+        kwargs = meta
+        kwargs.update( grid_kwargs )
+        kwargs.update( { 'count': len(keys),
+                         'dtype': np.result_type( *[ images[x].dtype for x in keys ] ) } )
+        with rasterio.open( path_out, 'w', **kwargs ) as dst_band:
+            for idx, key in enumerate( keys ):
+                dst_band.write( images[key].astype( kwargs['dtype'], copy = False ), idx + 1 )
+                dst_band.set_band_description( idx + 1, key )
+        written = { x: path_out for x in keys }
+
+    return written, ( images if read_back else None )
+
 def reproject_image( path_out,
                      epsg,
                      bbox_utm,
                      dest_gsd,
                      path_in  = None,
-                     src_band = None ):
+                     src_band = None,
+                     **warp_options ):
+    '''
+    Warp a single band image onto the bbox_utm region (in the output EPSG) at dest_gsd.
+    Only the part of the source covering the region is read.  Returns the output as a
+    float32 array of shape (1, height, width).  See reproject_scene() for whole scenes.
+    '''
 
     if ( path_in is None or not os.path.exists( path_in ) ) and src_band is None:
         raise Exception( f'Cannot open {path_in} as image does not exist.' )
 
-    #  Open the input image path
-    if src_band is None:
-        logging.debug( f'Opening input image: {path_in}' )
-        src_band = rasterio.open( path_in )
+    source = path_in if src_band is None else src_band
+    written, images = reproject_scene( { 'band': source },
+                                       epsg,
+                                       bbox_utm,
+                                       dest_gsd,
+                                       output_paths = { 'band': path_out },
+                                       read_back    = True,
+                                       **warp_options )
 
-    dst_crs = crs.CRS.from_epsg( epsg )
+    return images['band'][np.newaxis].astype('f4')
 
+def get_center_bbox( center, window_size, gsd ):
+    '''
+    Bounds ([corner1, corner2]) of a window_size pixel window at gsd around a center
+    point, in the same coordinates as the center.
+    '''
+    return [ [ center[0] - gsd * ( window_size[0] - 1 ) / 2.0,
+               center[1] - gsd * ( window_size[1] - 1 ) / 2.0 ],
+             [ center[0] + gsd * window_size[0] / 2.0,
+               center[1] + gsd * window_size[1] / 2.0 ] ]
 
-    #  Solve for a transform that takes us to the preferred output dimensions
-    dst_xform, dst_width, dst_height = warp.calculate_default_transform( src_crs = src_band.crs,
-                                                                         dst_crs = dst_crs,
-                                                                         width = src_band.width,
-                                                                         height = src_band.height,
-                                                                         left   = min( bbox_utm[0][0], bbox_utm[1][0] ),
-                                                                         right  = max( bbox_utm[0][0], bbox_utm[1][0] ),
-                                                                         bottom = min( bbox_utm[0][1], bbox_utm[1][1] ), 
-                                                                         top    = max( bbox_utm[0][1], bbox_utm[1][1] ),
-                                                                         resolution = dest_gsd )
-    
-    # Create Destination Band
-    kwargs = src_band.meta.copy()
-    kwargs.update({
-        'crs': dst_crs,
-        'transform': dst_xform,
-        'width': dst_width,
-        'height': dst_height,
-        'compress': 'lzw'
-    })
-
-    #open destination raster   
-    destBand = rasterio.open( path_out, 'w', **kwargs)
-
-    # Now actually warp the image
-    bilinear = rasterio.enums.Resampling.bilinear
-    dst_img, affine = warp.reproject( source         = rasterio.band(src_band, 1),
-                                      destination    = rasterio.band(destBand, 1),
-                                      dst_transform  = dst_xform,
-                                      dst_crs        = dst_crs,
-                                      dst_resolution = dest_gsd,
-                                      resampling     = bilinear )
-
-    destBand.close()
-
-    #  Grab the image for grins
-    tmpBand = rasterio.open( path_out )
-    dst_img_copy = tmpBand.read().astype('f4')
-    return dst_img_copy
+def get_cached_tile( tile, read_only = False ):
+    '''
+    Tile to hand to a caller.  Tiles in tile_cache are shared and read-only, so they
+    are copied unless read_only is set.
+    '''
+    if read_only or tile.flags.writeable:
+        return tile
+    return tile.copy()
 
 def reproject_image2( src_band,
                       epsg,
                       center_ll,
                       window_size,
-                      gsd ):
+                      gsd,
+                      resampling = rasterio.enums.Resampling.bilinear,
+                      use_cache  = True,
+                      read_only  = False,
+                      **warp_options ):
+    '''
+    Warp every band of an open image onto a window_size pixel window at gsd, centered
+    on a lon/lat point.  Returns an array of shape (height, width, bands).
+    warp_options are passed to warping.warp_array().
+
+    Tiles of files on disk are kept in tile_cache, keyed on the file and its mtime plus
+    the tile parameters.  The caller gets its own copy of a cached tile, or with
+    read_only, the shared read-only array itself.
+    '''
+
+    key = None
+    if use_cache:
+        key  = TileCache.make_key( src_band.name, epsg, center_ll, window_size, gsd, resampling )
+        tile = tile_cache.get( key )
+        if tile is not None:
+            return get_cached_tile( tile, read_only )
 
     dst_crs = crs.CRS.from_epsg( epsg )
 
-    #  Compute the source bounds 
-    bl_pt = src_band.transform * (0,0)
-    br_pt = src_band.transform * ( src_band.width -1, 0 )
-    tl_pt = src_band.transform * ( 0, src_band.height-1)
-    tr_pt = src_band.transform * ( src_band.width-1,src_band.height-1)
-    
     #  Create output bounds in destination coordinate system
-    dest_xform = pyproj.Transformer.from_crs( 4326, 
-                                              epsg, 
-                                              always_xy=True )
+    dest_xform = crd.get_transformer( 4326, epsg )
     center_utm = dest_xform.transform( center_ll[0], center_ll[1] )
-    dest_window = { 'left':   center_utm[0] - gsd * (window_size[0]-1)/2.0,
-                    'right':  center_utm[0] + gsd * (window_size[0])/2.0,
-                    'top':    center_utm[1] + gsd * (window_size[1])/2.0,
-                    'bottom': center_utm[1] - gsd * (window_size[1]-1)/2.0 }
-    
-    dst_xform, dx, dy = warp.calculate_default_transform( src_crs = src_band.crs,
-                                                          dst_crs = dst_crs,
-                                                          width   = src_band.width,
-                                                          height  = src_band.height,
-                                                          left    = dest_window['left'],
-                                                          right   = dest_window['right'],
-                                                          top     = dest_window['top'],
-                                                          bottom  = dest_window['bottom'],
-                                                          resolution = gsd )
-    
-    #  Create temporary file
-    kwargs = src_band.meta.copy()
-    kwargs.update({
-        'crs':       dst_crs,
-        'transform': dst_xform,
-        'width':     dx,
-        'height':    dy
-    })
-    dst_file = MemoryFile()
-    dst_band = dst_file.open( **kwargs )
-    
-    #  Create reprojection
-    for idx in range( 0, src_band.count):
-        warp.reproject( source         = rasterio.band( src_band, idx + 1 ),
-                        destination    = rasterio.band( dst_band, idx + 1 ),
-                        dst_transform  = dst_xform,
-                        dst_crs        = dst_crs,
-                        dst_resolution = gsd,
-                        resampling     = rasterio.enums.Resampling.bilinear )
+    dst_xform, dx, dy = get_dest_grid( get_center_bbox( center_utm, window_size, gsd ), gsd )
 
-    
-    center_dest = dst_xform.__invert__() * (center_utm[0], center_utm[1])
-    
-    win = Window( center_dest[0] - window_size[0]/2,
-                  center_dest[0] - window_size[1]/2,
-                  window_size[0],
-                  window_size[1] )
-    
-    return np.transpose( dst_band.read(), axes=[1,2,0] )
+    #  Only the part of the source under the window is read
+    src_win = get_source_window( src_band, dst_crs, dst_xform, dx, dy )
+
+    output = []
+    for idx in range( 0, src_band.count ):
+        output.append( _warp_band( src_band, idx + 1, src_win, dst_crs, dst_xform, dx, dy,
+                                   src_band.dtypes[idx], resampling, **warp_options ) )
+
+    return get_cached_tile( tile_cache.put( key, np.stack( output, axis = 2 ) ), read_only )
+
+def reproject_windows( src_band,
+                       epsg,
+                       centers_ll,
+                       window_size,
+                       gsd,
+                       resampling = rasterio.enums.Resampling.bilinear,
+                       use_cache  = True,
+                       read_only  = False,
+                       fill_value = None,
+                       **warp_options ):
+    '''
+    Same as reproject_image2() for a list of lon/lat centers, in one pass over the
+    image.  The source is read once, over the union of the windows, and every tile is
+    warped from that in memory.  Returns a list of arrays of shape (height, width, bands),
+    in centers_ll order.
+
+    If the source has no nodata, pixels outside it are set to fill_value (default 0).
+    With a NaN fill_value, integer bands are warped to float32.
+    '''
+
+    dst_crs = crs.CRS.from_epsg( epsg )
+    centers = crd.convert_coord_array( centers_ll, 4326, epsg )
+
+    tiles   = [ None ] * len(centers)
+    pending = []
+    for idx, center_ll in enumerate( centers_ll ):
+
+        key = None
+        if use_cache:
+            key = TileCache.make_key( src_band.name, epsg, center_ll, window_size, gsd, resampling )
+            if key is not None and fill_value is not None:
+                key = key + ( repr( fill_value ), )
+            tiles[idx] = tile_cache.get( key )
+            if tiles[idx] is not None:
+                tiles[idx] = get_cached_tile( tiles[idx], read_only )
+                continue
+
+        dst_xform, dx, dy = get_dest_grid( get_center_bbox( centers[idx], window_size, gsd ), gsd )
+        src_win = get_source_window( src_band, dst_crs, dst_xform, dx, dy )
+        pending.append( ( idx, key, dst_xform, dx, dy, src_win ) )
+
+    windows = [ x[5] for x in pending if x[5] is not None ]
+    if len(windows) > 0:
+        union = rasterio.windows.union( *windows )
+        logging.debug( f'Reading {union} of {src_band.name} for {len(windows)} windows' )
+        src_data = src_band.read( window = union )
+
+    for idx, key, dst_xform, dx, dy, src_win in pending:
+
+        output = []
+        for bidx in range( 0, src_band.count ):
+            src_img = None
+            if src_win is not None:
+                row = int( src_win.row_off - union.row_off )
+                col = int( src_win.col_off - union.col_off )
+                src_img = src_data[bidx, row:row + int(src_win.height), col:col + int(src_win.width)]
+
+            dtype = src_band.dtypes[bidx]
+            if fill_value is not None and np.isnan( fill_value ) and not np.issubdtype( np.dtype( dtype ), np.floating ):
+                dtype = 'float32'
+            output.append( _warp_band( src_band, bidx + 1, src_win, dst_crs, dst_xform, dx, dy,
+                                       dtype, resampling, src_img = src_img, fill_value = fill_value, **warp_options ) )
+
+        tiles[idx] = get_cached_tile( tile_cache.put( key, np.stack( output, axis = 2 ) ), read_only )
+
+    return tiles
+
+#  Colormap lookup tables, by (name, size)
+_colormap_luts = {}
+
+#  Rows composited per pass, bounds the temporaries to a few MB
+COMPOSITE_BLOCK_ROWS = 256
+
+def get_colormap_lut( name = 'jet', size = 256 ):
+    '''
+    uint8 RGB lookup table (size x 3) of a matplotlib colormap.  Built once per name.
+    '''
+    key = ( name, size )
+    if key not in _colormap_luts:
+        cm  = mpl.colormaps[name].resampled( size )
+        lut = ( cm( np.arange( size ) )[:,:3] * 255 ).astype('uint8')
+        lut.setflags( write = False )
+        _colormap_luts[key] = lut
+    return _colormap_luts[key]
 
 def create_merged_heatmap_tile( top_image,
                                 base_image, 
                                 t, 
-                                temp_range = None ):
+                                temp_range = None,
+                                cmap       = 'jet',
+                                out        = None ):
+    '''
+    Blend a colormapped heatmap of top_image (2D, e.g. temperatures) over an 8-bit RGB
+    base_image with opacity t.  Returns the uint8 RGB result and the [hm_min, hm_max]
+    range used, which is temp_range if given, else the range of top_image.
 
-    #  Convert Basemap to Float32 with 8-bit pixel range
-    bs_max = np.nanmax( base_image )
-    bs_min = np.nanmin( base_image )
-    bs_img = base_image.astype('float32')
+    Values are quantized straight into a uint8 colormap table and blended in 8.8 fixed
+    point, a block of rows at a time, into out (allocated if None).  NaN pixels are
+    transparent and keep the base image.
+    '''
+
+    top_image = np.asarray( top_image )
+    if top_image.ndim == 3:
+        top_image = top_image[:,:,0]
+
+    base_image = np.asarray( base_image )
+    if base_image.dtype != np.uint8:
+        base_image = np.clip( base_image, 0, 255 ).astype('uint8')
+    base_image = base_image[:,:,:3]
 
     #  Convert Top image to heatmap
     if temp_range is None:
@@ -171,11 +409,34 @@ def create_merged_heatmap_tile( top_image,
     else:
         hm_min = temp_range[0]
         hm_max = temp_range[1]
-        
-    hm = ( top_image - hm_min ) / (hm_max - hm_min)
-    cm = mpl.colormaps['jet']
-    hm_col = ( cm(hm) * 255 ).astype('float32')[:,:,:3]
 
-    res_img = ((hm_col * t) + (bs_img * (1-t))).astype('uint8')
+    lut    = get_colormap_lut( cmap )
+    scale  = np.float32( lut.shape[0] / ( hm_max - hm_min ) ) if hm_max != hm_min else np.float32( 0 )
+    weight = np.uint16( round( min( max( t, 0.0 ), 1.0 ) * 256 ) )
+
+    if out is None:
+        out = np.empty( top_image.shape + ( 3, ), dtype = 'uint8' )
+
+    for row in range( 0, top_image.shape[0], COMPOSITE_BLOCK_ROWS ):
+        rows = slice( row, row + COMPOSITE_BLOCK_ROWS )
+        top  = top_image[rows]
+        base = base_image[rows]
+
+        #  Quantize into the table, out of range values clamp to the end colors
+        idx = ( top - np.float32( hm_min ) ) * scale
+        nan_mask = np.isnan( idx )
+        np.clip( idx, 0, lut.shape[0] - 1, out = idx )
+        idx[nan_mask] = 0
+        color = lut[idx.astype('uint8')]
+
+        #  color * t + base * (1 - t), in 8.8 fixed point
+        blend = color.astype('uint16')
+        blend *= weight
+        blend += base.astype('uint16') * ( 256 - weight )
+        blend >>= 8
+        out[rows] = blend
+
+        if nan_mask.any():
+            out[rows][nan_mask] = base[nan_mask]
 
-    return res_img, [hm_min, hm_max]
+    return out, [hm_min, hm_max]
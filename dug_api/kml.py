@@ -0,0 +1,33 @@
+#    File:    kml.py
+#
+#    Purpose: Streaming reader for the point Placemarks of KML files.  Kept apart from
+#             landsat_utilities so reading a garden list doesn't import matplotlib.
+#
+
+import xml.etree.ElementTree as ET
+
+#  KML namespace
+KML_NS = '{http://www.opengis.net/kml/2.2}'
+
+def iter_kml_placemarks( kml_path ):
+    '''
+    Stream the point Placemarks of a KML file with iterparse.  Yields dictionaries with
+    the name and coordinate ([lon, lat, alt]) of each.  Each Placemark is released once
+    read, so memory use doesn't grow with the file.
+    '''
+
+    for event, node in ET.iterparse( kml_path, events = ( 'end', ) ):
+        if node.tag != f'{KML_NS}Placemark':
+            continue
+
+        coords = node.findtext( f'{KML_NS}Point/{KML_NS}coordinates' )
+        if coords is not None:
+            yield { 'name':       node.findtext( f'{KML_NS}name' ),
+                    'coordinate': [ float(x) for x in coords.strip().split(',') ] }
+        node.clear()
+
+def parse_kml( kml_path ):
+    '''
+    List of the point Placemarks in a KML file, see iter_kml_placemarks().
+    '''
+    return list( iter_kml_placemarks( kml_path ) )
@@ -8,64 +8,182 @@ from rasterio import Affine as A
 
 from urllib.request import urlopen
 
-from pyproj import Transformer
-
-import sys
+import datetime, json, logging, os, re, sys
 
 import numpy as np
+import pandas as pd
 
+from . import imagery
+from .kml import KML_NS, iter_kml_placemarks, parse_kml
+from .TileCache import TileCache
 from . import wms
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
-def parse_kvp_entry( line ):
-    
-    idx = line.find('=')
-    key = line[0:idx-1].strip('\'" \n')
-    value = line[idx+1:].strip('\'" \n')
-    return key, value
-    
-def add_kvp_entry( MTL, group_queue, key, value ):
+#  Version of the MTL cache format, bump when the parsed output changes
+MTL_CACHE_VERSION = 1
 
-    # if the group_queue is empty, done
-    if len(group_queue) <= 0:
-        MTL[key] = value;
-        return MTL
+#  Unquoted MTL values, e.g. WRS_PATH = 33, CLOUD_COVER = 1.23, DATE_ACQUIRED = 2023-08-05
+MTL_INT_PATTERN      = re.compile( r'[+-]?[0-9]+' )
+MTL_FLOAT_PATTERN    = re.compile( r'[+-]?(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?' )
+MTL_DATE_PATTERN     = re.compile( r'[0-9]{4}-[0-9]{2}-[0-9]{2}' )
+MTL_DATETIME_PATTERN = re.compile( r'[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(?:\.[0-9]+)?Z' )
 
-    #  Check if the group is added
-    if group_queue[0] not in MTL:
-        MTL[group_queue[0]] = {}
+def parse_kvp_entry( line ):
+    '''
+    Split an MTL line into its key and raw value.  Returns None for lines without a
+    value (e.g. the closing END).
+    '''
+    key, sep, value = line.partition( '=' )
+    if not sep:
+        return None
+    return key.strip(), value.strip()
 
-    MTL[group_queue[0]] = add_kvp_entry( MTL[group_queue[0]],
-                                         group_queue[1:],
-                                         key,
-                                         value )
-    return MTL
-    
-    
-def load_metadata_table( pathname ):
+def parse_mtl_value( value ):
     '''
-    Parse a Landsat MTL file and return a large dictionary of Key/Value pairs
+    Convert a raw MTL value.  Quoted values are strings, unquoted numbers become int
+    or float, and dates and UTC timestamps become datetime.date and datetime.datetime.
     '''
-    
-    #  Full list of MTL data
-    MTL = {}
+    if value.startswith( '"' ):
+        return value.strip( '"' )
+    if MTL_INT_PATTERN.fullmatch( value ):
+        return int( value )
+    if MTL_FLOAT_PATTERN.fullmatch( value ):
+        return float( value )
+    if MTL_DATE_PATTERN.fullmatch( value ):
+        return datetime.date.fromisoformat( value )
+    if MTL_DATETIME_PATTERN.fullmatch( value ):
+        return datetime.datetime.fromisoformat( value.replace( 'Z', '+00:00' ) )
+    return value
+
+def parse_metadata_table( pathname, keys = None ):
+    '''
+    Parse a Landsat MTL file in a single pass.  Groups become nested dictionaries and
+    values are typed by parse_mtl_value().
+
+    If keys is given, only those entries are kept (along with the groups they're in).  A
+    key is either a name (CLOUD_COVER, matched in every group) or a group path
+    (IMAGE_ATTRIBUTES.CLOUD_COVER).  If an entry is repeated, the last value wins, with
+    or without keys, so a selective read matches the full parse.
+    '''
+
+    wanted = None if keys is None else set( keys )
 
-    group_queue = []
+    MTL   = {}
+    stack = [ MTL ]
+    names = []
     with open( pathname, 'r' ) as fin:
-        for line in fin.readlines():
-            key, value = parse_kvp_entry( line )
-            
-            #  Don't bother with parent node
-            if ( key == 'GROUP' or key == 'END_GROUP' ) and value == 'LANDSAT_METADATA_FILE':
+        for line in fin:
+            entry = parse_kvp_entry( line )
+            if entry is None:
                 continue
+            key, value = entry
+
             if key == 'GROUP':
-                group_queue.append( value )
+                #  Don't bother with parent node
+                if value == 'LANDSAT_METADATA_FILE':
+                    continue
+                names.append( value )
+                stack.append( None )
             elif key == 'END_GROUP':
-                group_queue.pop(-1)
+                if value == 'LANDSAT_METADATA_FILE':
+                    continue
+                names.pop()
+                stack.pop()
             else:
-                MTL = add_kvp_entry( MTL, group_queue, key, value )
+                if wanted is not None:
+                    path = '.'.join( names + [ key ] )
+                    if key not in wanted and path not in wanted:
+                        continue
+
+                #  Groups are only created once they hold an entry, so selective reads
+                #  don't return empty groups
+                if stack[-1] is None:
+                    for idx in range( 1, len(stack) ):
+                        if stack[idx] is None:
+                            stack[idx] = stack[idx-1].setdefault( names[idx-1], {} )
+                stack[-1][key] = parse_mtl_value( value )
+    return MTL
+
+def get_mtl_cache_path( pathname ):
+    '''
+    Return the parsed cache path for an MTL file.
+    '''
+    return f'{os.path.splitext( pathname )[0]}.cache.json'
+
+def _encode_mtl_value( value ):
+    if isinstance( value, datetime.datetime ):
+        return { '__datetime__': value.isoformat() }
+    if isinstance( value, datetime.date ):
+        return { '__date__': value.isoformat() }
+    raise TypeError( f'Cannot encode {type(value)}' )
+
+def _decode_mtl_value( obj ):
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.datetime.fromisoformat( obj['__datetime__'] )
+        if '__date__' in obj:
+            return datetime.date.fromisoformat( obj['__date__'] )
+    return obj
+
+def _select_mtl_keys( MTL, keys, names = () ):
+
+    output = {}
+    for key, value in MTL.items():
+        if isinstance( value, dict ):
+            value = _select_mtl_keys( value, keys, names + ( key, ) )
+            if len(value) > 0:
+                output[key] = value
+        elif key in keys or '.'.join( names + ( key, ) ) in keys:
+            output[key] = value
+    return output
+
+def load_metadata_table( pathname, keys = None, use_cache = True ):
+    '''
+    Parse a Landsat MTL file and return a large dictionary of Key/Value pairs, see
+    parse_metadata_table().
+
+    With use_cache, the full parse is kept next to the MTL file as JSON (see
+    get_mtl_cache_path()), tagged with the MTL file's mtime and size, so repeat reads
+    skip the parse.  Folders we can't write to are simply not cached.
+    '''
+
+    if not use_cache:
+        return parse_metadata_table( pathname, keys )
+
+    st = os.stat( pathname )
+    source = f'{st.st_mtime_ns}:{st.st_size}'
+    cache_pathname = get_mtl_cache_path( pathname )
+
+    MTL = None
+    if os.path.exists( cache_pathname ):
+        try:
+            with open( cache_pathname, 'r' ) as fin:
+                data = json.load( fin, object_hook = _decode_mtl_value )
+            if data.get( 'version' ) == MTL_CACHE_VERSION and data.get( 'source' ) == source:
+                MTL = data['mtl']
+        except ( OSError, ValueError ) as e:
+            logging.debug( f'Ignoring unreadable MTL cache {cache_pathname}: {e}' )
+
+    if MTL is None:
+        MTL = parse_metadata_table( pathname )
+        try:
+            #  Write to a temporary file first so readers never see a partial cache
+            tmp_path = f'{cache_pathname}.{os.getpid()}.tmp'
+            with open( tmp_path, 'w' ) as fout:
+                json.dump( { 'version': MTL_CACHE_VERSION,
+                             'source':  source,
+                             'mtl':     MTL },
+                           fout,
+                           separators = ( ',', ':' ),
+                           default    = _encode_mtl_value )
+            os.replace( tmp_path, cache_pathname )
+        except OSError as e:
+            logging.debug( f'Unable to write MTL cache {cache_pathname}: {e}' )
+
+    if keys is not None:
+        return _select_mtl_keys( MTL, set( keys ) )
     return MTL
 
 def print_mtl( mtl, offset = 0 ):
@@ -74,160 +192,108 @@ def print_mtl( mtl, offset = 0 ):
     for key in mtl:
         if isinstance( mtl[key], dict ):
             print( tag + key )
-            Print_MTL( mtl[key], offset + 4 )
+            print_mtl( mtl[key], offset + 4 )
         else:
-            print( tag + key + ' = ' + mtl[key] )
-
-def parse_placemark_node( placemark_node, ns ):
-
-    coords = placemark_node.find( 'kml:Point', ns ).find( 'kml:coordinates', ns ).text.split(',')
-
-    results = { 'name':       placemark_node.find( 'kml:name', ns ).text,
-                'coordinate': [ float(x) for x in coords ] }
-
-    return results
-    
-def find_all_nodes( base_node, node_to_find ):
-
-    ns = { 'kml': 'http://www.opengis.net/kml/2.2' }
-
-    results = []
-    node_list = base_node.findall( 'kml:Placemark', ns )
-    for node in node_list:
-        results.append( parse_placemark_node( node, ns ) )
-    return results        
-    
-def parse_kml( kml_path ):
-    
-    tree = ET.parse( kml_path )
-    root = tree.getroot()
-
-    ns = { 'kml': 'http://www.opengis.net/kml/2.2' }
-    
-    #  Iterate over nodes, looking for a Placemark
-    placemark_nodes = []
-    
-    for child in root:        
-        placemark_nodes += find_all_nodes( child, 'Placemark' )
-
-    return placemark_nodes    
-
-
+            print( tag + key + ' = ' + str( mtl[key] ) )
 
 def load_landsat_tile( lst_path,
                        epsg_code,
                        center_ll,
                        window_size,
-                       gsd ):
-
-    src_band = rasterio.open( lst_path )
-    dst_crs = crs.CRS.from_epsg( epsg_code )
-    
-    #  Compute the source bounds 
-    bl_pt = src_band.transform * (0,0)
-    br_pt = src_band.transform * ( src_band.width -1, 0 )
-    tl_pt = src_band.transform * ( 0, src_band.height-1)
-    tr_pt = src_band.transform * ( src_band.width-1,src_band.height-1)
-
-    #  Create output bounds in destination coordinate system
-    dest_xform = Transformer.from_crs( 4326, epsg_code, always_xy=True )
-    center_utm = dest_xform.transform( center_ll[0], center_ll[1] )
-    dest_window = { 'left':   center_utm[0] - gsd * (window_size[0]-1)/2.0,
-                    'right':  center_utm[0] + gsd * (window_size[0])/2.0,
-                    'top':    center_utm[1] + gsd * (window_size[1])/2.0,
-                    'bottom': center_utm[1] - gsd * (window_size[1]-1)/2.0 }
-    
-    dst_xform, dx, dy = warp.calculate_default_transform( src_crs = src_band.crs,
-                                                          dst_crs = dst_crs,
-                                                          width   = src_band.width,
-                                                          height  = src_band.height,
-                                                          left    = dest_window['left'],
-                                                          right   = dest_window['right'],
-                                                          top     = dest_window['top'],
-                                                          bottom  = dest_window['bottom'],
-                                                          resolution = gsd )
-    
-    #  Create temporary file
-    kwargs = src_band.meta.copy()
-    kwargs.update({
-        'crs':       dst_crs,
-        'transform': dst_xform,
-        'width':     dx,
-        'height':    dy
-    })
-    dst_file = MemoryFile()
-    dst_band = dst_file.open( **kwargs )
-    
-    #  Create reprojection
-    for idx in range( 0, src_band.count):
-        warp.reproject( source         = rasterio.band( src_band, idx + 1 ),
-                        destination    = rasterio.band( dst_band, idx + 1 ),
-                        dst_transform  = dst_xform,
-                        dst_crs        = dst_crs,
-                        dst_resolution = gsd,
-                        resampling     = rasterio.enums.Resampling.bilinear )
-
-    
-    center_dest = dst_xform.__invert__() * (center_utm[0], center_utm[1])
-    
-    win = Window( center_dest[0] - window_size[0]/2,
-                  center_dest[0] - window_size[1]/2,
-                  window_size[0],
-                  window_size[1] )
-    
-    return np.transpose( dst_band.read(), axes=[1,2,0] )
+                       gsd,
+                       resampling = rasterio.enums.Resampling.bilinear,
+                       use_cache  = True,
+                       read_only  = False,
+                       **warp_options ):
+    '''
+    Load a window_size pixel tile at gsd, centered on a lon/lat point, from a Landsat
+    image.  Returns an array of shape (height, width, bands).  Tiles are served from
+    imagery.tile_cache when possible, without opening the image, as a copy unless
+    read_only is set (see imagery.get_cached_tile()).
+    '''
 
+    key = None
+    if use_cache:
+        key  = TileCache.make_key( lst_path, epsg_code, center_ll, window_size, gsd, resampling )
+        tile = imagery.tile_cache.get( key )
+        if tile is not None:
+            return imagery.get_cached_tile( tile, read_only )
 
+    with rasterio.open( lst_path ) as src_band:
+        tile = imagery.reproject_image2( src_band,
+                                         epsg_code,
+                                         center_ll,
+                                         window_size,
+                                         gsd,
+                                         resampling = resampling,
+                                         use_cache  = False,
+                                         **warp_options )
 
-def merge_tiles( top_image, base_image, t, temp_range = None ):
+    return imagery.get_cached_tile( imagery.tile_cache.put( key, tile ), read_only )
 
-    #  Convert Basemap to Float32 with 8-bit pixel range
-    bs_max = np.max( base_image )
-    bs_min = np.min( base_image )
-    bs_img = base_image.astype('float32')
 
-    #  Convert Top image to heatmap
-    if temp_range is None:
-        hm_max = np.max( top_image )
-        hm_min = np.min( top_image )
-    else:
-        hm_min = temp_range[0]
-        hm_max = temp_range[1]
-        
-    hm = ( top_image - hm_min ) / (hm_max - hm_min)
-    cm = mpl.colormaps['jet']
-    hm_col = ( cm(hm) * 255 ).astype('float32')[:,:,:3]
 
-    res_img = ((hm_col * t) + (bs_img * (1-t))).astype('uint8')
+def merge_tiles( top_image, base_image, t, temp_range = None ):
+    '''
+    Blend a heatmap of top_image over base_image, see imagery.create_merged_heatmap_tile().
+    '''
+    return imagery.create_merged_heatmap_tile( top_image, base_image, t, temp_range )
 
-    return res_img, [hm_min, hm_max]
+def load_naip_wms_tile( naip_url, epsg_code, center_ll, window_size, gsd, layers, format, cache = None, offline = False ):
+    '''
+    Fetch a window_size pixel NAIP tile at gsd, centered on a lon/lat point, from the
+    WMS.  Returns an array of shape (bands, height, width).  See wms.load_tile() for
+    the cache and offline mode.
+    '''
+    return wms.load_tile( base_url     = naip_url,
+                          epsg         = epsg_code,
+                          center_ll    = center_ll,
+                          win_size_pix = window_size,
+                          gsd          = gsd,
+                          layers       = layers,
+                          format       = format,
+                          cache        = cache,
+                          offline      = offline )
+
+def get_garden_center( garden ):
+    '''
+    Name and [lon, lat] of a garden, from a row or a single-row DataFrame of the garden list.
+    '''
+    if isinstance( garden, pd.DataFrame ):
+        if garden.shape[0] != 1:
+            raise Exception( f'Expected a single garden, got {garden.shape[0]} rows.' )
+        garden = garden.iloc[0]
+    return garden['Name'], [ float( garden['Longitude'] ), float( garden['Latitude'] ) ]
 
-def create_lst_heatmap_tile( config, garden, lst_path, window_size, gsd, ratio = 0.75, temp_range = None ):
+def create_lst_heatmap_tile( config, garden, lst_path, window_size, gsd, ratio = 0.75, temp_range = None, wms_cache = None, offline = False ):
+    '''
+    Render one garden's heatmap for one LST image.  See heatmap.render_heatmaps() to
+    render many gardens and images at once.
+    '''
 
-    epsg_code = config['general']['output_crs_epsg']
+    epsg_code = config.get( 'general', 'output_crs_epsg' )
 
-    idx = garden.index.tolist()[0]
-    name    = garden.loc[idx,'Name']
-    win_lat = garden.loc[idx,'Latitude']
-    win_lon = garden.loc[idx,'Longitude']
+    name, center_ll = get_garden_center( garden )
     
     #  First load the landsat tile
     lst_arr = load_landsat_tile( lst_path, 
                                  epsg_code   = epsg_code,
-                                 center_ll   = [win_lon, win_lat],
+                                 center_ll   = center_ll,
                                  window_size = window_size,
                                  gsd         = gsd )
     shp = lst_arr.shape
     lst_arr = lst_arr.reshape( shp[0], shp[1] )
 
     #  Load NAIP image
-    naip_arr = load_naip_wms_tile( naip_url    = config['naip']['wms_url'],
+    naip_arr = load_naip_wms_tile( naip_url    = config.get( 'naip', 'wms_url' ),
                                    epsg_code   = epsg_code,
-                                   center_ll   = [win_lon, win_lat],
-                                   window_size = [1000,1000],
+                                   center_ll   = center_ll,
+                                   window_size = window_size,
                                    gsd         = gsd,
-                                   layers      = config['naip']['wms_layers'].split(','),
-                                   format      = config['naip']['wms_format'] )
+                                   layers      = config.get( 'naip', 'wms_layers' ).split(','),
+                                   format      = config.get( 'naip', 'wms_format' ),
+                                   cache       = wms_cache,
+                                   offline     = offline )
 
     naip_arr = np.transpose( naip_arr, axes=[1,2,0] )[:,:,:3]
 
@@ -0,0 +1,74 @@
+#    File:    warping.py
+#
+#    Purpose: Multithreaded warping.  Arrays are warped with GDAL's own warper threads,
+#             which split the rows of each warp chunk between them, so the output is
+#             the same as a plain single-threaded rasterio.warp.reproject().
+#
+
+import logging, os, warnings
+
+import numpy as np
+
+import rasterio
+from rasterio import warp
+from rasterio.errors import NotGeoreferencedWarning
+
+#  GDAL warp memory limit, in MB.  0 keeps GDAL's default, the same as
+#  rasterio.warp.reproject(), so GDAL chunks the grid the same way.
+DEFAULT_WARP_MEM_LIMIT = 0
+
+def default_num_workers():
+    return min( 8, os.cpu_count() or 1 )
+
+def warp_array( src_img,
+                src_transform,
+                src_crs,
+                dst_transform,
+                dst_crs,
+                dst_width,
+                dst_height,
+                dtype          = None,
+                src_nodata     = None,
+                dst_nodata     = None,
+                resampling     = rasterio.enums.Resampling.bilinear,
+                num_workers    = 1,
+                warp_mem_limit = DEFAULT_WARP_MEM_LIMIT ):
+    '''
+    Warp a 2D source array onto a destination grid on num_workers GDAL warper threads.
+
+    This is a single rasterio.warp.reproject() call.  GDAL still cuts the grid into
+    chunks by warp_mem_limit (MB) and picks each chunk's source window and resampling
+    scale as it would single-threaded; the threads only share out the rows of a chunk.
+    The output is therefore bit-identical to the serial call (num_workers = 1) for any
+    number of workers.
+
+    Warping independent strips of the grid is not: GDAL resamples source-edge pixels
+    differently depending on each strip's source window, so the result would change
+    with the strip size.
+    '''
+
+    if dtype is None:
+        dtype = src_img.dtype
+    if dst_nodata is None:
+        dst_nodata = src_nodata
+    if num_workers is None:
+        num_workers = default_num_workers()
+
+    dst_img = np.full( ( dst_height, dst_width ), 0 if dst_nodata is None else dst_nodata, dtype = dtype )
+
+    logging.debug( f'Warping {dst_width}x{dst_height} on {num_workers} GDAL threads' )
+    with warnings.catch_warnings():
+        #  Array sources have no georeferencing of their own, the transforms are passed in
+        warnings.simplefilter( 'ignore', NotGeoreferencedWarning )
+        warp.reproject( source         = src_img,
+                        destination    = dst_img,
+                        src_transform  = src_transform,
+                        src_crs        = src_crs,
+                        src_nodata     = src_nodata,
+                        dst_transform  = dst_transform,
+                        dst_crs        = dst_crs,
+                        dst_nodata     = dst_nodata,
+                        resampling     = resampling,
+                        num_threads    = max( 1, int(num_workers) ),
+                        warp_mem_limit = warp_mem_limit )
+    return dst_img
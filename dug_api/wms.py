@@ -1,5 +1,7 @@
 
-import pyproj
+import logging, urllib.parse
+
+import numpy as np
 
 import rasterio
 from rasterio import MemoryFile, crs, warp
@@ -7,6 +9,8 @@ from rasterio import Affine as A
 
 from urllib.request import urlopen
 
+from . import coordinate as crd
+
 class WMS:
 
     def __init__(self,
@@ -17,7 +21,8 @@ class WMS:
                  gsd          = None,
                  layers       = None,
                  transparent  = False,
-                 format       = None ):
+                 format       = None,
+                 bbox         = None ):
 
         if url:
             self.url = url
@@ -35,15 +40,19 @@ class WMS:
             self.transparent = transparent
         if format:
             self.format = format
+        if bbox:
+            self.bbox = bbox
             
     def get_bbox(self):
 
+        #  Grid tiles (see create_grid_request()) have a fixed bbox
+        if getattr( self, 'bbox', None ) is not None:
+            return list( self.bbox )
+
         if self.center_ll:
 
             #  Convert center to destination coordinate
-            xform = pyproj.Transformer.from_crs( 4326, 
-                                                 self.epsg_code,
-                                                 always_xy=True )
+            xform = crd.get_transformer( 4326, self.epsg_code )
 
             center_out = xform.transform( self.center_ll[0],
                                           self.center_ll[1] )
@@ -56,42 +65,191 @@ class WMS:
 
             return [ min_x, min_y, max_x, max_y ]
         
-    def get_map_url( self ):
+    def get_map_params( self ):
+        '''
+        GetMap parameters of the request, in URL order.
+        '''
 
         bbox = self.get_bbox()
-        
-        layer_str = ''
-        counter = 0
-        for layer in self.layers:
-            if counter > 0:
-                layer_str += ','
-            layer_str += layer
-            counter += 1
-        
-        request_type = 'GetMap'
-        url = f'{self.url}&request={request_type}'
-        url = f'{url}&layers={layer_str}'
-
-        if self.transparent is None:
-            pass
-        else:
-            url = f'{url}&transparent={self.transparent}'
-        
-        url = f'{url}&crs=EPSG:{self.epsg_code}'
-        url = f'{url}&format={self.format}'
-        url = f'{url}&width={self.win_size_pix[0]}'
-        url = f'{url}&height={self.win_size_pix[1]}'
-        url = f'{url}&bbox={bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]}'
 
+        params = [ ( 'request', 'GetMap' ),
+                   ( 'layers',  ','.join( self.layers ) ) ]
+        if self.transparent is not None:
+            params.append( ( 'transparent', self.transparent ) )
+
+        params += [ ( 'crs',    f'EPSG:{self.epsg_code}' ),
+                    ( 'format', self.format ),
+                    ( 'width',  self.win_size_pix[0] ),
+                    ( 'height', self.win_size_pix[1] ),
+                    ( 'bbox',   f'{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]}' ) ]
+        return params
+
+    def get_map_url( self ):
+
+        url = self.url
+        for key, value in self.get_map_params():
+            url = f'{url}&{key}={value}'
         return url
 
+    def get_cache_key( self ):
+        '''
+        Canonical key of the GetMap request for a TileCache.  Numbers are normalized
+        (e.g. 1000 and 1000.0 pixels, or bbox float noise below a micrometer), as is the
+        order of the base URL's parameters, so equivalent requests share a key.
+        '''
+
+        #  The base URL's own query parameters are sorted, so their order doesn't matter
+        parts = urllib.parse.urlsplit( self.url )
+        query = urllib.parse.urlencode( sorted( urllib.parse.parse_qsl( parts.query, keep_blank_values = True ),
+                                                key = lambda x: ( x[0].lower(), x[1] ) ) )
+        url   = urllib.parse.urlunsplit( ( parts.scheme, parts.netloc.lower(), parts.path, query, '' ) )
+
+        bbox = tuple( round( float(x), 6 ) for x in self.get_bbox() )
+        return ( 'wms',
+                 url,
+                 tuple( str(x) for x in self.layers ),
+                 f'EPSG:{int(self.epsg_code)}',
+                 bbox,
+                 ( int( self.win_size_pix[0] ), int( self.win_size_pix[1] ) ),
+                 str( self.format ),
+                 str( self.transparent ) )
+
+def decode_tile( tile_bytes, out = None ):
+    '''
+    Decode a GetMap response into an array of shape (bands, height, width).  If out is
+    given and the tile has its shape and type, the pixels are decoded straight into it.
+    Otherwise (e.g. a PNG with alpha among RGB JPEGs) the tile gets its own array.
+    '''
+    profile = { 'transform': A.identity() }
+    with MemoryFile( tile_bytes ) as memfile:
+        with memfile.open( **profile ) as dataset:
+            if out is None:
+                return dataset.read()
+            if ( dataset.count, dataset.height, dataset.width ) != out.shape or any( x != out.dtype for x in dataset.dtypes ):
+                logging.debug( f'Tile of {dataset.count}x{dataset.height}x{dataset.width} {dataset.dtypes[0]} does not fit {out.shape} {out.dtype}' )
+                return dataset.read()
+            return dataset.read( out = out )
+
+#  Width and height of a grid tile, in pixels
+DEFAULT_GRID_TILE_SIZE = 512
+
+def get_grid_window( epsg, center_ll, win_size_pix, gsd ):
+    '''
+    Window of win_size_pix pixels at gsd around a lon/lat point, snapped to the pixel
+    grid of the EPSG (pixel edges on multiples of gsd).  Returns ( col, row, width,
+    height ) in grid pixels, where rows count down from y = 0.  The window moves by
+    at most half a pixel compared to WMS.get_bbox().
+    '''
+    xform  = crd.get_transformer( 4326, epsg )
+    center = xform.transform( center_ll[0], center_ll[1] )
+
+    width  = int( win_size_pix[0] )
+    height = int( win_size_pix[1] )
+    col = int( round( center[0] / gsd - width / 2.0 ) )
+    row = int( round( -center[1] / gsd - height / 2.0 ) )
+    return ( col, row, width, height )
+
+def get_grid_tiles( window, tile_size = DEFAULT_GRID_TILE_SIZE ):
+    '''
+    ( tile_col, tile_row ) of the grid tiles covering a grid window.
+    '''
+    col, row, width, height = window
+    return [ ( tc, tr ) for tr in range( row // tile_size, ( row + height - 1 ) // tile_size + 1 )
+                        for tc in range( col // tile_size, ( col + width - 1 ) // tile_size + 1 ) ]
+
+def create_grid_request( url, epsg, tile, tile_size, gsd, layers, format ):
+    '''
+    GetMap request for one grid tile.  Its bbox is a whole number of tiles from the
+    origin, so the same tile always makes the same request (and cache key).
+    '''
+    span = tile_size * gsd
+    bbox = [ tile[0] * span, -( tile[1] + 1 ) * span, ( tile[0] + 1 ) * span, -tile[1] * span ]
+    return WMS( url          = url,
+                epsg_code    = epsg,
+                win_size_pix = [ tile_size, tile_size ],
+                gsd          = gsd,
+                layers       = layers,
+                format       = format,
+                bbox         = bbox )
+
+def assemble_window( window, tiles, tile_size = DEFAULT_GRID_TILE_SIZE ):
+    '''
+    Cut a grid window out of its grid tiles (a dictionary of ( tile_col, tile_row ) to
+    an array of shape (bands, tile_size, tile_size)).  A window inside one tile is a
+    view of that tile, otherwise the pieces are copied into a new array.
+    '''
+    col, row, width, height = window
+    keys = get_grid_tiles( window, tile_size )
+
+    if len(keys) == 1:
+        tc, tr = keys[0]
+        c0 = col - tc * tile_size
+        r0 = row - tr * tile_size
+        return tiles[keys[0]][:, r0:r0 + height, c0:c0 + width]
+
+    first  = tiles[keys[0]]
+    output = np.empty( ( first.shape[0], height, width ), dtype = first.dtype )
+    for tc, tr in keys:
+        c0 = max( col, tc * tile_size )
+        c1 = min( col + width, ( tc + 1 ) * tile_size )
+        r0 = max( row, tr * tile_size )
+        r1 = min( row + height, ( tr + 1 ) * tile_size )
+        output[:, r0 - row:r1 - row, c0 - col:c1 - col] = tiles[( tc, tr )][:, r0 - tr * tile_size:r1 - tr * tile_size,
+                                                                               c0 - tc * tile_size:c1 - tc * tile_size]
+    return output
+
+def fetch_map( wms_map, cache = None, offline = False ):
+    '''
+    Fetch and decode one GetMap request, through the cache if given.
+    '''
+    key = None
+    if cache is not None:
+        key  = wms_map.get_cache_key()
+        tile = cache.get( key )
+        if tile is not None:
+            return tile
+
+    url = wms_map.get_map_url()
+    if offline:
+        raise Exception( f'WMS tile not in the cache and offline: {url}' )
+
+    logging.debug( f'Fetching {url}' )
+    tile = decode_tile( urlopen(url).read() )
+    if cache is None:
+        return tile
+    return cache.put( key, tile )
+
 def load_tile( base_url,
                epsg,
                center_ll,
                win_size_pix,
                gsd,
                layers,
-               format ):
+               format,
+               cache     = None,
+               offline   = False,
+               tile_size = None ):
+    '''
+    Fetch a GetMap tile and return it as an array of shape (bands, height, width).
+
+    With a cache (a TileCache, usually with a disk_path), tiles are stored under the
+    canonical GetMap parameters (see WMS.get_cache_key()) and only fetched once.  In
+    offline mode, a tile missing from the cache raises instead of being fetched.
+
+    With tile_size, the window is snapped to the pixel grid and assembled from fixed
+    grid tiles of tile_size pixels (see get_grid_window()), so overlapping windows,
+    e.g. of nearby gardens, share cached tiles.  Cached windows inside one tile are
+    read-only views.
+    '''
+
+    if tile_size is not None:
+        window = get_grid_window( epsg, center_ll, win_size_pix, gsd )
+        tiles  = {}
+        for tile in get_grid_tiles( window, tile_size ):
+            tiles[tile] = fetch_map( create_grid_request( base_url, epsg, tile, tile_size, gsd, layers, format ),
+                                     cache,
+                                     offline )
+        return assemble_window( window, tiles, tile_size )
 
     wms_map = WMS( url          = base_url,
                    epsg_code    = epsg,
@@ -100,12 +258,4 @@ def load_tile( base_url,
                    gsd          = gsd,
                    layers       = layers,
                    format       = format )
-    
-    url = wms_map.get_map_url()
-
-    profile = { 'transform': A.identity() }
-    tif_bytes = urlopen(url).read()
-    with MemoryFile(tif_bytes) as memfile:
-        with memfile.open( **profile ) as dataset:
-            return dataset.read()
-    #            show(dataset)
\ No newline at end of file
+    return fetch_map( wms_map, cache, offline )
@@ -0,0 +1,104 @@
+#    File:    test_collect_id.py
+#
+#    Purpose: CollectID.batch_to_dataframe() against one CollectID per name.
+#
+
+import os, random, sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+from dug_api.CollectID import CollectID
+
+def create_names( is_file, num_names = 2000, seed = 0 ):
+    '''
+    Mix of valid and invalid names: unknown sensors and levels, bad digits, impossible
+    dates, trailing separators and extra text, and Landsat 7 band suffixes.
+    '''
+    rng = random.Random( seed )
+
+    names = []
+    for _ in range( num_names ):
+        sensor    = rng.choice( 'COTEX' )
+        satellite = rng.choice( [ '08', '09', '07', '7x' ] )
+        level     = rng.choice( [ 'L1TP', 'L1GT', 'L2SP', 'CU', 'L2SR' ] )
+        acq       = f'{rng.randint(2013,2023)}{rng.randint(0,13):02d}{rng.randint(0,31):02d}'
+        cid       = f'L{sensor}{satellite}_{level}_{rng.randint(1,40):03d}{rng.randint(1,40):03d}_{acq}_20240101_02'
+        pathname  = rng.choice( [ '/data/collections/', '', 'relative/', '/a/b.c/' ] ) + cid
+
+        if is_file:
+            band = rng.choice( [ 'B1', 'B4', 'B10', 'B6_VCID_1', 'B6_VCID_2', 'QA_PIXEL', 'ANG', 'B99' ] )
+            if level == 'CU':
+                pathname = f'{pathname}/{cid}_{rng.choice( [ "ST_", "" ] )}{band}.TIF'
+            elif level == 'L2SP':
+                pathname = f'{pathname}/{cid}_T1_{rng.choice( [ "SR", "ST" ] )}_{band}.{rng.choice( [ "TIF", "tif.aux" ] )}'
+            else:
+                pathname = f'{pathname}/{cid}_T1_{band}{rng.choice( [ ".TIF", "" ] )}'
+        else:
+            pathname += rng.choice( [ '', '/', '_extra' ] )
+        names.append( pathname )
+
+    return names + [ '', None, 'garbage', 'LC08' ]
+
+def parse_one( name, is_file ):
+    '''
+    Fields of one name through the constructor, None if it is not a valid CID.
+    '''
+    try:
+        cid = CollectID( name, is_file = is_file )
+    except Exception:
+        return None
+
+    fields = { 'cid':               cid.cid(),
+               'sensor':            cid.sensor().name,
+               'satellite':         cid.satellite(),
+               'processing_level':  cid.processing_level().name,
+               'wrs2_path':         cid.wrs2_path(),
+               'wrs2_row':          cid.wrs2_row(),
+               'ard_col':           cid.ard_col(),
+               'ard_row':           cid.ard_row(),
+               'acquisition_date':  cid.acquisition_date(),
+               'production_date':   cid.production_date(),
+               'collection_number': cid.collection_number() }
+    if is_file:
+        fields['file_type'] = None if cid.file_type() is None else cid.file_type().name
+    return fields
+
+def to_python( value ):
+    if pd.isna( value ):
+        return None
+    if isinstance( value, pd.Timestamp ):
+        return value.date()
+    return value
+
+@pytest.mark.parametrize( 'is_file', [ False, True ] )
+def test_batch_matches_constructor( is_file ):
+
+    names = create_names( is_file )
+    batch = CollectID.batch_to_dataframe( names, is_file = is_file )
+    assert batch.shape[0] == len(names)
+
+    num_valid = 0
+    for name, row in zip( names, batch.to_dict( 'records' ) ):
+
+        expected = None if name is None else parse_one( name, is_file )
+        if expected is None:
+            #  The constructor also rejects impossible dates, which the batch leaves null
+            if pd.isna( row['acquisition_date'] ) or pd.isna( row['production_date'] ):
+                continue
+            assert pd.isna( row['cid'] ), name
+            continue
+
+        num_valid += 1
+        assert { key: to_python( row[key] ) for key in expected } == expected, name
+
+    #  The mix should exercise both sides
+    assert 0 < num_valid < len(names)
+
+@pytest.mark.parametrize( 'is_file', [ False, True ] )
+def test_batch_of_valid_names( is_file ):
+
+    names = [ x for x in create_names( is_file ) if x is not None and parse_one( x, is_file ) is not None ]
+    batch = CollectID.batch_to_dataframe( names, is_file = is_file )
+    assert batch['cid'].notna().all()
@@ -0,0 +1,40 @@
+#    File:    test_config.py
+#
+#    Purpose: Configuration lookups of collection folders.
+#
+
+import os, sys
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+from dug_api.config import Configuration
+
+CID = 'LC08_L2SP_033032_20230805_20230812_02'
+
+def create_config( tmp_path ):
+
+    cid_path = tmp_path / 'collections' / CID
+    cid_path.mkdir( parents = True )
+    ( cid_path / 'config.cfg' ).write_text( f'[general]\nb4_path = {cid_path}/B4.TIF\n' )
+
+    config_path = tmp_path / 'dug.cfg'
+    config_path.write_text( '[general]\n'
+                            f'landsat_collection_list_path = {tmp_path}/collections.xlsx\n'
+                            f'catalog_db_path = {tmp_path}/catalog.db\n'
+                            'output_crs_epsg = 32613\n'
+                            f'image_collection_path = {tmp_path}/collections\n' )
+    return Configuration( str( config_path ) ), str( cid_path )
+
+def test_trailing_separator_keeps_cid( tmp_path ):
+
+    config, cid_path = create_config( tmp_path )
+    cid_arg = cid_path + os.sep
+
+    #  As the lsp-* utilities do with their --cid argument
+    cid = Configuration.get_cid( cid_arg )
+    assert cid == CID
+
+    paths = config.get_collection_paths( cid_arg )
+    assert paths['b4_path'] == f'{cid_path}/B4.TIF'
+
+    config.record_collection_paths( cid, { 'b4_path_epsg_32613': f'{cid_path}/B4.epsg_32613.TIF' } )
+    assert config.get_collection_paths( cid_path )['b4_path_epsg_32613'] == f'{cid_path}/B4.epsg_32613.TIF'
@@ -0,0 +1,79 @@
+#    File:    test_et_aggregator.py
+#
+#    Purpose: ETAggregator reading frames whose grids don't all match.
+#
+
+import datetime, os, sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+import dug_api.coordinate as crd
+from dug_api.ETAggregator import ETAggregator
+
+CENTER_LL = [ -105.05, 39.74 ]
+GSD       = 30.0
+SIZE      = 200
+
+def create_frame( path, value, col_shift = 0.0, row_shift = 0.0, gsd = GSD, epsg_code = 32613 ):
+    '''
+    Frame of value * 1000 plus the column on the first frame's grid, so frames only
+    agree once they're read onto the same grid.
+    '''
+
+    x, y = crd.convert_coord_point( CENTER_LL, 4326, 32613 )
+    if epsg_code != 32613:
+        x, y = crd.convert_coord_point( CENTER_LL, 4326, epsg_code )
+    transform = from_origin( x - 3000 + col_shift * gsd, y + 3000 - row_shift * gsd, gsd, gsd )
+
+    with rasterio.open( path,
+                        'w',
+                        driver    = 'GTiff',
+                        width     = SIZE,
+                        height    = SIZE,
+                        count     = 1,
+                        dtype     = 'float32',
+                        crs       = f'EPSG:{epsg_code}',
+                        transform = transform,
+                        nodata    = -9999 ) as dst:
+        cols = np.arange( SIZE, dtype = np.float32 ) + np.float32( col_shift )
+        dst.write( np.broadcast_to( value * 1000 + cols, ( SIZE, SIZE ) ).astype( np.float32 ), 1 )
+    return path
+
+def aggregate( tmp_path, frames ):
+
+    paths = [ create_frame( str( tmp_path / f'frame_{idx}.tif' ), idx + 1, **kwargs )
+              for idx, kwargs in enumerate( frames ) ]
+    dates = [ datetime.date( 2023, 7, 1 ) + datetime.timedelta( days = idx ) for idx in range( len(paths) ) ]
+    aggregator = ETAggregator( len(paths), crop_width_m = 1500, crop_height_m = 1200 )
+    return list( aggregator.iter_windows( paths, dates, CENTER_LL ) )
+
+def test_shifted_frame_is_read_onto_first_grid( tmp_path ):
+
+    #  Second frame is shifted 10 pixels right, so the crop is the same ground area
+    windows = aggregate( tmp_path, [ {}, { 'col_shift': 10 } ] )
+    assert len(windows) == 1
+    assert windows[0].num_frames == 2
+    assert ( windows[0].count == 2 ).all()
+    cols = windows[0].mean[0] - 1500
+    assert np.allclose( cols, cols[0] + np.arange( len(cols) ) )
+    assert np.allclose( windows[0].mean, windows[0].mean[0] )
+
+def test_frame_past_edge_is_padded( tmp_path ):
+
+    #  Shifted far enough that it only partly covers the crop
+    windows = aggregate( tmp_path, [ {}, { 'col_shift': 110 } ] )
+    count = windows[0].count
+    assert count.min() == 1 and count.max() == 2
+    assert np.allclose( windows[0].sum[count == 1] // 1000, 1.0 )
+
+@pytest.mark.parametrize( 'frame', [ { 'col_shift': 0.5 },
+                                     { 'gsd': 20.0 },
+                                     { 'epsg_code': 26913 } ] )
+def test_mismatched_grid_raises( tmp_path, frame ):
+
+    with pytest.raises( Exception, match = 'Frame' ):
+        aggregate( tmp_path, [ {}, frame ] )
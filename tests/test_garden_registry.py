@@ -0,0 +1,43 @@
+#    File:    test_garden_registry.py
+#
+#    Purpose: GardenRegistry loading and caching of garden lists.
+#
+
+import os, subprocess, sys
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+from dug_api.GardenRegistry import GardenRegistry
+
+KML = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <Placemark><name>Kml Garden</name><Point><coordinates>-105.01,39.71,1600</coordinates></Point></Placemark>
+  </Document>
+</kml>
+'''
+
+def test_csv_and_kml_lists_have_separate_caches( tmp_path ):
+
+    csv_path = tmp_path / 'DUG Gardens.csv'
+    csv_path.write_text( 'Name,Longitude,Latitude\nCsv Garden,-105.05,39.74\n' )
+    kml_path = tmp_path / 'DUG Gardens.kml'
+    kml_path.write_text( KML )
+
+    assert GardenRegistry.cache_path( str( csv_path ), 32613 ) != GardenRegistry.cache_path( str( kml_path ), 32613 )
+
+    #  Twice each, so the second round reads from the caches
+    for _ in range( 2 ):
+        assert GardenRegistry.from_file( str( csv_path ), 32613 ).garden_df['name'].tolist() == [ 'Csv Garden' ]
+        assert GardenRegistry.from_file( str( kml_path ), 32613 ).garden_df['name'].tolist() == [ 'Kml Garden' ]
+
+def test_config_import_is_light():
+
+    #  Every lsp-* script imports the config, the heavy modules load on use
+    code = ( 'import sys, dug_api.config; '
+             'print( [ x for x in ( "matplotlib.pyplot", "scipy.spatial", "dug_api.landsat_utilities" ) if x in sys.modules ] )' )
+    result = subprocess.run( [ sys.executable, '-c', code ],
+                             cwd            = os.path.join( os.path.dirname( __file__ ), '..' ),
+                             capture_output = True,
+                             text           = True,
+                             check          = True )
+    assert result.stdout.strip() == '[]'
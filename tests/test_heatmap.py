@@ -0,0 +1,83 @@
+#    File:    test_heatmap.py
+#
+#    Purpose: Batch heatmap rendering from synthetic LST images.
+#
+
+import os, sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+import dug_api.coordinate as crd
+from dug_api import heatmap
+
+EPSG        = 32613
+CENTER_LL   = [ -105.05, 39.74 ]
+WINDOW_SIZE = [ 40, 40 ]
+GSD         = 30.0
+
+class StubConfig:
+    def get( self, section, value ):
+        return { ( 'general', 'output_crs_epsg' ): str(EPSG) }[( section, value )]
+
+def create_lst( path, value ):
+    '''
+    3 km square of constant LST around CENTER_LL, without a nodata value.
+    '''
+    x, y = crd.convert_coord_point( CENTER_LL, 4326, EPSG )
+    with rasterio.open( path,
+                        'w',
+                        driver    = 'GTiff',
+                        width     = 100,
+                        height    = 100,
+                        count     = 1,
+                        dtype     = 'float32',
+                        crs       = f'EPSG:{EPSG}',
+                        transform = from_origin( x - 1500, y + 1500, 30, 30 ) ) as dst:
+        dst.write( np.full( ( 100, 100 ), value, dtype = np.float32 ), 1 )
+    return str( path )
+
+def create_gardens():
+    #  Same slug, an edge garden half off the image, and one well outside it
+    x, y = crd.convert_coord_point( CENTER_LL, 4326, EPSG )
+    edge_ll    = crd.convert_coord_point( [ x + 1500, y ], EPSG, 4326 )
+    outside_ll = crd.convert_coord_point( [ x + 6000, y ], EPSG, 4326 )
+    return pd.DataFrame( { 'Name':      [ 'St. Mary', 'St Mary', 'Edge', 'Outside' ],
+                           'Longitude': [ CENTER_LL[0], CENTER_LL[0], edge_ll[0], outside_ll[0] ],
+                           'Latitude':  [ CENTER_LL[1], CENTER_LL[1], edge_ll[1], outside_ll[1] ] } )
+
+@pytest.fixture
+def basemaps( monkeypatch ):
+    def load_basemaps( config, gardens, window_size, gsd, *args ):
+        return { name: np.full( ( window_size[1], window_size[0], 3 ), 128, dtype = np.uint8 ) for name, center_ll in gardens }
+    monkeypatch.setattr( heatmap, 'load_basemaps', load_basemaps )
+
+def test_gardens_with_the_same_slug_get_their_own_folder( tmp_path ):
+
+    gardens  = heatmap.get_gardens( create_gardens() )
+    index_df = heatmap.plan_heatmaps( gardens, [ str( tmp_path / 'lst.tif' ) ], str( tmp_path ) )
+    assert index_df['image_path'].is_unique
+
+@pytest.mark.parametrize( 'num_workers', [ 1, 2 ] )
+def test_render_heatmaps( tmp_path, basemaps, num_workers ):
+
+    lst_paths = [ create_lst( tmp_path / f'lst_{idx}.tif', 300 + idx ) for idx in range( 2 ) ]
+    index_df  = heatmap.render_heatmaps( StubConfig(),
+                                         create_gardens(),
+                                         lst_paths,
+                                         str( tmp_path / 'output' ),
+                                         window_size = WINDOW_SIZE,
+                                         gsd         = GSD,
+                                         num_workers = num_workers )
+
+    #  Pixels off the edge of the image are not rendered as a temperature of 0
+    rendered = index_df[index_df['garden'] != 'Outside']
+    assert rendered['temp_min'].tolist() == rendered['lst_path'].map( { lst_paths[0]: 300.0, lst_paths[1]: 301.0 } ).tolist()
+    assert all( os.path.exists( x ) for x in rendered['image_path'] )
+
+    outside = index_df[index_df['garden'] == 'Outside']
+    assert outside['temp_min'].isna().all() and outside['image_path'].isna().all()
@@ -0,0 +1,78 @@
+#    File:    test_tile_cache.py
+#
+#    Purpose: TileCache disk tier, trimming and sharing the directory.
+#
+
+import contextlib, os, sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+import dug_api.TileCache as tc
+from dug_api.TileCache import TileCache
+
+TILE_BYTES = 64 * 64 * 4
+
+def create_tile( value ):
+    return np.full( ( 64, 64 ), value, dtype = np.float32 )
+
+def disk_usage( path ):
+    return sum( os.path.getsize( os.path.join( path, x ) ) for x in os.listdir( path ) if x.endswith( '.npy' ) )
+
+def test_disk_tier_is_not_listed_on_every_put( tmp_path, monkeypatch ):
+
+    scans = []
+    real_scandir = os.scandir
+    def counting_scandir( path ):
+        scans.append( path )
+        return real_scandir( path )
+    monkeypatch.setattr( os, 'scandir', counting_scandir )
+
+    max_disk_bytes = 40 * TILE_BYTES
+    cache = TileCache( max_bytes = 0, disk_path = str( tmp_path ), max_disk_bytes = max_disk_bytes )
+    for idx in range( 400 ):
+        cache.put( ( 'tile', idx ), create_tile( idx ) )
+        assert disk_usage( tmp_path ) <= max_disk_bytes
+
+    #  One listing per trim (about every 4 tiles once full), not one per put
+    assert len(scans) < 150
+    assert cache.get( ( 'tile', 399 ) ) is not None
+    assert cache.get( ( 'tile', 0 ) ) is None
+
+def test_tile_removed_by_another_process_is_a_miss( tmp_path, monkeypatch ):
+
+    cache = TileCache( max_bytes = 0, disk_path = str( tmp_path ) )
+    cache.put( ( 'tile', 1 ), create_tile( 1 ) )
+    cache.put( ( 'tile', 2 ), create_tile( 2 ) )
+
+    #  Removed between the load and the touch: still a hit
+    def removed_utime( path, *args, **kwargs ):
+        raise FileNotFoundError( path )
+    monkeypatch.setattr( os, 'utime', removed_utime )
+    assert ( cache.get( ( 'tile', 1 ) ) == 1 ).all()
+    monkeypatch.undo()
+
+    #  Removed outright: a miss
+    os.remove( cache._disk_file( ( 'tile', 2 ) ) )
+    assert cache.get( ( 'tile', 2 ) ) is None
+
+def test_trim_skips_tiles_removed_during_listing( tmp_path, monkeypatch ):
+
+    cache = TileCache( max_bytes = 0, disk_path = str( tmp_path ), max_disk_bytes = 3 * TILE_BYTES )
+    for idx in range( 3 ):
+        cache.put( ( 'tile', idx ), create_tile( idx ) )
+
+    #  Another process removes a tile after our listing, before we stat it
+    real_scandir = os.scandir
+    @contextlib.contextmanager
+    def racing_scandir( path ):
+        with real_scandir( path ) as entries:
+            entries = list( entries )
+        with contextlib.suppress( FileNotFoundError ):
+            os.remove( cache._disk_file( ( 'tile', 0 ) ) )
+        yield iter( entries )
+    monkeypatch.setattr( os, 'scandir', racing_scandir )
+    monkeypatch.setattr( tc, 'DISK_SCAN_INTERVAL', 1 )
+
+    cache.put( ( 'tile', 3 ), create_tile( 3 ) )
+    assert cache.disk_bytes <= 3 * TILE_BYTES
@@ -0,0 +1,131 @@
+#    File:    test_wms_cache.py
+#
+#    Purpose: WMS tile caching (wms.load_tile() with a TileCache) against a local
+#             stand-in WMS server.
+#
+
+import http.server, io, os, sys, tempfile, threading, urllib.parse, warnings
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+from dug_api import wms
+from dug_api.TileCache import TileCache
+
+CENTER_LL = [ -105.05, 39.74 ]
+WIN_SIZE  = [ 64, 48 ]
+
+class StandInWMS( http.server.BaseHTTPRequestHandler ):
+    '''
+    Answers every GetMap with a PNG of the requested size, and counts the requests.
+    '''
+
+    num_requests = 0
+
+    def do_GET( self ):
+
+        StandInWMS.num_requests += 1
+        query  = dict( urllib.parse.parse_qsl( urllib.parse.urlsplit( self.path ).query ) )
+        width  = int( float( query['width'] ) )
+        height = int( float( query['height'] ) )
+        img = np.full( ( height, width, 3 ), StandInWMS.num_requests % 256, dtype = np.uint8 )
+
+        buffer = io.BytesIO()
+        Image.fromarray( img ).save( buffer, 'PNG' )
+        body = buffer.getvalue()
+
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'image/png' )
+        self.send_header( 'Content-Length', str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        pass
+
+@pytest.fixture
+def wms_url():
+
+    StandInWMS.num_requests = 0
+    server = http.server.ThreadingHTTPServer( ( '127.0.0.1', 0 ), StandInWMS )
+    threading.Thread( target = server.serve_forever, daemon = True ).start()
+    yield f'http://127.0.0.1:{server.server_port}/wms?service=WMS&version=1.3.0'
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture( autouse = True )
+def no_georeferencing_warning():
+    #  The stand-in serves PNGs, which have no georeferencing
+    with warnings.catch_warnings():
+        warnings.filterwarnings( 'ignore', message = 'Dataset has no geotransform' )
+        yield
+
+def load( url, cache, offline = False ):
+    return wms.load_tile( url, 32613, CENTER_LL, WIN_SIZE, 1.0, [ '0' ], 'image/png', cache = cache, offline = offline )
+
+def test_cache_miss_fetches_once( wms_url ):
+
+    with tempfile.TemporaryDirectory() as disk_path:
+        cache = TileCache( disk_path = disk_path )
+        tile  = load( wms_url, cache )
+
+        assert StandInWMS.num_requests == 1
+        assert tile.shape == ( 3, WIN_SIZE[1], WIN_SIZE[0] )
+        assert cache.stats()['misses'] == 1
+        assert len( os.listdir( disk_path ) ) == 1
+
+def test_cache_hit_skips_the_server( wms_url ):
+
+    with tempfile.TemporaryDirectory() as disk_path:
+        first = load( wms_url, TileCache( disk_path = disk_path ) )
+
+        #  A new cache on the same directory, as in a later run
+        cache  = TileCache( disk_path = disk_path )
+        second = load( wms_url, cache )
+
+        assert StandInWMS.num_requests == 1
+        assert cache.stats()['disk_hits'] == 1
+        assert np.array_equal( first, second )
+
+        load( wms_url, cache )
+        assert StandInWMS.num_requests == 1
+        assert cache.stats()['hits'] == 1
+
+def test_offline_without_cached_tile_raises( wms_url ):
+
+    with tempfile.TemporaryDirectory() as disk_path:
+        with pytest.raises( Exception, match = 'offline' ):
+            load( wms_url, TileCache( disk_path = disk_path ), offline = True )
+        assert StandInWMS.num_requests == 0
+
+def test_offline_with_cached_tile( wms_url ):
+
+    with tempfile.TemporaryDirectory() as disk_path:
+        first  = load( wms_url, TileCache( disk_path = disk_path ) )
+        second = load( wms_url, TileCache( disk_path = disk_path ), offline = True )
+
+        assert StandInWMS.num_requests == 1
+        assert np.array_equal( first, second )
+
+def test_cache_key_ignores_parameter_order():
+
+    params = { 'url':          'http://example.com/wms?service=WMS&version=1.3.0',
+               'epsg_code':    32613,
+               'center_ll':    CENTER_LL,
+               'win_size_pix': WIN_SIZE,
+               'gsd':          1.0,
+               'layers':       [ '0' ],
+               'format':       'image/png' }
+    key = wms.WMS( **params ).get_cache_key()
+
+    #  Keyword order, base URL parameter order and int/float sizes
+    reordered = dict( reversed( list( params.items() ) ) )
+    reordered['url'] = 'http://example.com/wms?version=1.3.0&service=WMS'
+    reordered['win_size_pix'] = [ float(x) for x in WIN_SIZE ]
+    assert wms.WMS( **reordered ).get_cache_key() == key
+
+    #  A different request has a different key
+    params['layers'] = [ '1' ]
+    assert wms.WMS( **params ).get_cache_key() != key
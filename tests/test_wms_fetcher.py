@@ -0,0 +1,89 @@
+#    File:    test_wms_fetcher.py
+#
+#    Purpose: WMSFetcher batches against a local stand-in WMS server.
+#
+
+import http.server, io, os, sys, threading, urllib.parse, warnings
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join( os.path.dirname( __file__ ), '..' ))
+from dug_api import wms
+from dug_api.TileCache import TileCache
+from dug_api.WMSFetcher import WMSFetcher
+
+WIN_SIZE = [ 32, 24 ]
+
+class MixedWMS( http.server.BaseHTTPRequestHandler ):
+    '''
+    Answers GetMap with RGB PNGs, except layer 'alpha', which is RGBA.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET( self ):
+
+        query  = dict( urllib.parse.parse_qsl( urllib.parse.urlsplit( self.path ).query ) )
+        width  = int( float( query['width'] ) )
+        height = int( float( query['height'] ) )
+        bands  = 4 if query['layers'] == 'alpha' else 3
+        img = np.full( ( height, width, bands ), 200, dtype = np.uint8 )
+
+        buffer = io.BytesIO()
+        Image.fromarray( img ).save( buffer, 'PNG' )
+        body = buffer.getvalue()
+
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'image/png' )
+        self.send_header( 'Content-Length', str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        pass
+
+@pytest.fixture
+def wms_url():
+
+    server = http.server.ThreadingHTTPServer( ( '127.0.0.1', 0 ), MixedWMS )
+    threading.Thread( target = server.serve_forever, daemon = True ).start()
+    yield f'http://127.0.0.1:{server.server_port}/wms?service=WMS'
+    server.shutdown()
+    server.server_close()
+
+def create_requests( url, layers ):
+    return [ wms.WMS( url          = url,
+                      epsg_code    = 32613,
+                      center_ll    = [ -105.05 + 0.001 * idx, 39.74 ],
+                      win_size_pix = WIN_SIZE,
+                      gsd          = 1.0,
+                      layers       = [ layer ],
+                      format       = 'image/png' ) for idx, layer in enumerate( layers ) ]
+
+@pytest.mark.parametrize( 'layers', [ [ '0', '0', 'alpha', '0', '0' ],
+                                      [ 'alpha', '0', '0', '0' ] ] )
+def test_mismatched_tile_gets_its_own_array( wms_url, layers ):
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings( 'ignore', message = 'Dataset has no geotransform' )
+        with WMSFetcher( max_workers = 1 ) as fetcher:
+            tiles = fetcher.fetch( create_requests( wms_url, layers ) )
+
+    for layer, tile in zip( layers, tiles ):
+        assert tile.shape == ( 4 if layer == 'alpha' else 3, WIN_SIZE[1], WIN_SIZE[0] )
+        assert ( tile == 200 ).all()
+
+def test_cached_tiles_own_their_memory( wms_url ):
+
+    #  A view of a shared block would keep every sibling tile alive after eviction
+    with warnings.catch_warnings():
+        warnings.filterwarnings( 'ignore', message = 'Dataset has no geotransform' )
+        with WMSFetcher( max_workers = 1, cache = TileCache( max_bytes = 1024 * 1024 ) ) as fetcher:
+            tiles = fetcher.fetch( create_requests( wms_url, [ '0', '0', '0' ] ) )
+
+    for idx, tile in enumerate( tiles ):
+        assert tile.base is None or tile.base.nbytes == tile.nbytes
+        for other in tiles[idx+1:]:
+            assert not np.shares_memory( tile, other )
@@ -60,21 +60,20 @@ def main():
     config = Configuration( cmd_options.config_path )
 
     #  Get some baseline parameters
-    cid      = os.path.basename( cmd_options.cid_path )
+    cid      = Configuration.get_cid( cmd_options.cid_path )
     epsg     = config.get_output_epsg()
     bbox_utm = config.get_region()
     dest_gsd = config.get_output_gsd()
 
-    # Load the collection config, if it doesnt already exist
-    cid_config_path = os.path.join( cmd_options.cid_path, 'config.cfg' )
+    #  Skip scenes outside the quality limits before touching any imagery
+    usable, reason = config.check_scene_quality( cmd_options.cid_path )
+    if not usable:
+        logger.info( f'Skipping {cid}: {reason}' )
+        return
 
-    cid_config = configparser.ConfigParser()
-    if os.path.exists( cid_config_path ) == False:
-        logger.error( f'CID has no configuration file. Creating one at {cid_config_path}' )
-        assert(False)
-    
-    logger.info( f'Loading CID Config: {cid_config_path}' )
-    cid_config.read( cid_config_path )
+    #  Load the collection paths from the registry (imports config.cfg on first use)
+    logger.info( f'Loading CID Paths: {cid}' )
+    cid_paths = config.get_collection_paths( cmd_options.cid_path )
 
     #  Create the required keys
     band_info = { 'band04': { 'key': f'b4_path_epsg_{epsg}'  },
@@ -82,8 +81,8 @@ def main():
 
     # Make sure we have enough bands
     for id in band_info:
-        if cid_config.has_option('general',band_info[id]['key']):
-            band_info[id]['path']  = cid_config['general'][band_info[id]['key']]
+        if band_info[id]['key'] in cid_paths:
+            band_info[id]['path']  = cid_paths[band_info[id]['key']]
             band_info[id]['valid'] = True
         else:
             band_info[id]['valid'] = True
@@ -109,6 +108,7 @@ def main():
     mode_list = [ 'avdan',
                   'xiaolei',
                   'gopinadh' ]
+    new_paths = {}
     for mode in mode_list:
 
         code = mode[0:3]
@@ -138,6 +138,7 @@ def main():
             em_10_band = rasterio.open( out_path, 'w', **kwargs)
             em_10_band.write( em_img_10, 1 )
             em_10_band.close()
+        new_paths[f'emissivity_{code}10_path_epsg_{epsg}'] = out_path
 
         #  Write NDVI Image to Disk
         kwargs.update( { 'dtype': band_info['ndvi']['image'].dtype } )
@@ -151,6 +152,10 @@ def main():
             em_11_band = rasterio.open( out_path, 'w', **kwargs)
             em_11_band.write( em_img_11, 1 )
             em_11_band.close()
+        new_paths[f'emissivity_{code}11_path_epsg_{epsg}'] = out_path
+
+    #  Record all outputs in one transaction
+    config.record_collection_paths( cid, new_paths )
 
     
 if __name__ == '__main__':
@@ -75,9 +75,13 @@ def create_land_surface_temp_image( band04,
     outpath_c = f'{output_dir}/{bands["lst_c"]["default"]}'
     outpath_f = f'{output_dir}/{bands["lst_f"]["default"]}'
 
+    #  Registry keys of the outputs
+    new_paths = { f'lst_{tag}_{em_method}_c_path_epsg_{epsg}': outpath_c,
+                  f'lst_{tag}_{em_method}_f_path_epsg_{epsg}': outpath_f }
+
     if overwrite == False and os.path.exists( outpath_c ) and os.path.exists( outpath_f ):
         logger.info( f'Destination images already exist.' )
-        return
+        return new_paths
 
     #  Read images
     band04_image = band04.read(1).astype('f4')
@@ -118,6 +122,8 @@ def create_land_surface_temp_image( band04,
         img_f_band.write( img_f, 1 )
         img_f_band.close()
 
+    return new_paths
+
 def main():
 
     cmd_options = parse_command_line()
@@ -135,19 +141,18 @@ def main():
     config = Configuration( cmd_options.config_path )
 
     #  Get some baseline parameters
-    cid      = os.path.basename( cmd_options.cid_path )
+    cid      = Configuration.get_cid( cmd_options.cid_path )
     epsg     = config.get_output_epsg()
 
-    # Load the collection config, if it doesnt already exist
-    cid_config_path = os.path.join( cmd_options.cid_path, 'config.cfg' )
+    #  Skip scenes outside the quality limits before touching any imagery
+    usable, reason = config.check_scene_quality( cmd_options.cid_path )
+    if not usable:
+        logger.info( f'Skipping {cid}: {reason}' )
+        return
 
-    cid_config = configparser.ConfigParser()
-    if os.path.exists( cid_config_path ) == False:
-        logger.error( f'CID has no configuration file. Creating one at {cid_config_path}' )
-        assert(False)
-    
-    logger.info( f'Loading CID Config: {cid_config_path}' )
-    cid_config.read( cid_config_path )
+    #  Load the collection paths from the registry (imports config.cfg on first use)
+    logger.info( f'Loading CID Paths: {cid}' )
+    cid_paths = config.get_collection_paths( cmd_options.cid_path )
 
     #  Create the required keys
     band_info = { 'band04': { 'key': f'b4_path_epsg_{epsg}'  },
@@ -157,10 +162,10 @@ def main():
 
     # Make sure we have enough bands
     for id in band_info:
-        assert( cid_config.has_option( 'general',band_info[id]['key'] ) )
-        assert( os.path.exists( cid_config['general'][band_info[id]['key']] ) )
+        assert( band_info[id]['key'] in cid_paths )
+        assert( os.path.exists( cid_paths[band_info[id]['key']] ) )
 
-        band_info[id]['path']  = cid_config['general'][band_info[id]['key']]
+        band_info[id]['path']  = cid_paths[band_info[id]['key']]
         
         #  Load requisite bands
         logger.debug( f'Loading Key: {id}, Image: {os.path.basename(band_info[id]["path"])}' )
@@ -172,21 +177,26 @@ def main():
     lt_mode_list = [ 'jiminez-munoz', 'sobrino-1993' ]
     band_meta = band_info['band04']['handle'].meta.copy()
     output_dir = os.path.dirname( band_info['band04']['path'])
+    new_paths = {}
     for em_mode in em_mode_list:
 
         for lt_mode in lt_mode_list:
             
-            create_land_surface_temp_image( band_info['band04']['handle'],
-                                            band_info['band05']['handle'],
-                                            band_info['band10']['handle'],
-                                            band_info['band11']['handle'],
-                                            band_meta,
-                                            lt_mode,
-                                            em_mode,
-                                            epsg,
-                                            logger,
-                                            output_dir,
-                                            cmd_options.overwrite )
+            paths = create_land_surface_temp_image( band_info['band04']['handle'],
+                                                    band_info['band05']['handle'],
+                                                    band_info['band10']['handle'],
+                                                    band_info['band11']['handle'],
+                                                    band_meta,
+                                                    lt_mode,
+                                                    em_mode,
+                                                    epsg,
+                                                    logger,
+                                                    output_dir,
+                                                    cmd_options.overwrite )
+            new_paths.update( paths )
+
+    #  Record all outputs in one transaction
+    config.record_collection_paths( cid, new_paths )
 
     
 if __name__ == '__main__':
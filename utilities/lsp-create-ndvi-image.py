@@ -90,20 +90,20 @@ def main():
     else:
         config = Configuration( cmd_options.config_path )
         epsg = config.get_output_epsg()
+        cid  = Configuration.get_cid( cmd_options.cid_path )
 
-        # Load the collection config, if it doesnt already exist
-        cid_config_path = os.path.join( cmd_options.cid_path, 'config.cfg' )
+        #  Skip scenes outside the quality limits before touching any imagery
+        usable, reason = config.check_scene_quality( cmd_options.cid_path )
+        if not usable:
+            logger.info( f'Skipping {cid}: {reason}' )
+            return
 
-        cid_config = configparser.ConfigParser()
-        if os.path.exists( cid_config_path ) == False:
-            logger.error( f'CID has no configuration file. Creating one at {cid_config_path}' )
-            assert(False)
-    
-        logger.info( f'Loading CID Config: {cid_config_path}' )
-        cid_config.read( cid_config_path )
+        #  Load the collection paths from the registry (imports config.cfg on first use)
+        logger.info( f'Loading CID Paths: {cid}' )
+        cid_paths = config.get_collection_paths( cmd_options.cid_path )
 
-        red_path  = cid_config['general'][f'b4_path_epsg_{epsg}']
-        nir_path  = cid_config['general'][f'b5_path_epsg_{epsg}']
+        red_path  = cid_paths[f'b4_path_epsg_{epsg}']
+        nir_path  = cid_paths[f'b5_path_epsg_{epsg}']
         ndvi_path = os.path.join( os.path.dirname(red_path), f'ndvi.epsg_{epsg}.tif' )
 
     assert( os.path.exists( red_path ) )
@@ -136,6 +136,10 @@ def main():
     ndvi_band.write( ndvi_image.astype(rasterio.float32), 1 )
     ndvi_band.close()
 
+    if cmd_options.cid_path is not None:
+        config.record_collection_paths( cid,
+                                        { f'ndvi_path_epsg_{epsg}': ndvi_path } )
+
     
 if __name__ == '__main__':
     main()
\ No newline at end of file
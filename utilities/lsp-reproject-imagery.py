@@ -67,47 +67,56 @@ def main():
     config = Configuration( cmd_options.config_path )
 
     #  Get some baseline parameters
-    cid      = os.path.basename( cmd_options.cid_path )
+    cid      = Configuration.get_cid( cmd_options.cid_path )
     epsg     = config.get_output_epsg()
     bbox_utm = config.get_region()
     dest_gsd = config.get_output_gsd()
 
-    # Load the collection config, if it doesnt already exist
-    cid_config_path = os.path.join( cmd_options.cid_path, 'config.cfg' )
+    #  Skip scenes outside the quality limits before touching any imagery
+    usable, reason = config.check_scene_quality( cmd_options.cid_path )
+    if not usable:
+        logger.info( f'Skipping {cid}: {reason}' )
+        return
 
-    cid_config = configparser.ConfigParser()
-    if os.path.exists( cid_config_path ) == False:
-        logger.error( f'CID has no configuration file. Creating one at {cid_config_path}' )
-        assert(False)
-    
-    logger.info( f'Loading CID Config: {cid_config_path}' )
-    cid_config.read( cid_config_path )
+    #  Load the collection paths from the registry (imports config.cfg on first use)
+    logger.info( f'Loading CID Paths: {cid}' )
+    cid_paths = config.get_collection_paths( cmd_options.cid_path )
 
     #  Get only band keys (non EPSG keys)
-    band_keys = list( filter( is_band_key, list(cid_config['general'] ) ) )
+    new_paths    = {}
+    band_paths   = {}
+    output_paths = {}
+    band_keys = list( filter( is_band_key, list(cid_paths) ) )
     for band_key in band_keys:
 
         # Key for output path
         key_out = f'{band_key}_epsg_{epsg}'
 
         #  Check if the image path exists
-        path_in  = cid_config.get('general',band_key)
+        path_in  = cid_paths[band_key]
 
         filename_out = f'{os.path.splitext( os.path.basename( path_in ) )[0]}.epsg_{epsg}.TIF'
         path_out = os.path.join( os.path.dirname( path_in ), filename_out )
         assert( os.path.exists( path_in ) )
 
-        logging.debug( f'Reprojecting {os.path.basename(path_in)} to {os.path.basename(path_out)}' )
+        new_paths[key_out] = path_out
         if os.path.exists( path_out ):
             logging.debug( f'Skipping {band_key} as destination image already exists.' )
-
         else:
-            # Reproject image
-            imagery.reproject_image( path_in  = path_in,
-                                     path_out = path_out,
-                                     epsg     = epsg,
-                                     bbox_utm = bbox_utm,
-                                     dest_gsd = dest_gsd )
+            logging.debug( f'Reprojecting {os.path.basename(path_in)} to {os.path.basename(path_out)}' )
+            band_paths[band_key]   = path_in
+            output_paths[band_key] = path_out
+
+    # Reproject all remaining bands of the scene onto one grid
+    if len(band_paths) > 0:
+        imagery.reproject_scene( band_paths   = band_paths,
+                                 epsg         = epsg,
+                                 bbox_utm     = bbox_utm,
+                                 dest_gsd     = dest_gsd,
+                                 output_paths = output_paths )
+
+    #  Record all outputs in one transaction
+    config.record_collection_paths( cid, new_paths )
 
 
 if __name__ == '__main__':